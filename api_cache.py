@@ -0,0 +1,128 @@
+'''This module handles: caching api responses, so repeated identical requests
+do not reach the upstream apis.
+
+Entries are keyed by (source, *request arguments), expire after a per-source
+time-to-live and are evicted least-recently-used first once MAX_ENTRIES is
+reached. Expired entries are kept (until evicted) along with their validators,
+so they can be revalidated with a conditional request.
+
+Below is a summary of the functions defined within this module
+
+api_cache
+    .cache_get()
+        > returns a fresh cached response, counting hits and misses
+    .cache_lookup()
+        > returns a cached entry whether or not it has expired (for revalidation)
+    .cache_put()
+        > stores a response, along with any etag/last-modified validators
+    .cache_refresh()
+        > marks an expired entry as fresh, after a successful revalidation
+    .clear_cache()
+        > removes all entries and resets counters
+    .get_cache_stats()
+        > returns hit/miss/revalidation/eviction counters
+'''
+
+import logging
+import threading
+from collections import OrderedDict
+from time import time
+
+logger_ac = logging.getLogger(__name__)
+
+MAX_ENTRIES = 128
+CACHE_TTLS = { # time-to-live (seconds) for each source
+    'covid': 5*60,
+    'news': 15*60
+    }
+DEFAULT_TTL = 60
+
+global cache_stats
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'evictions': 0}
+
+def _is_fresh(key: tuple, entry: dict) -> bool:
+    '''Checks if an entry is within the time-to-live of its source.'''
+    return time() - entry['stored'] < CACHE_TTLS.get(key[0], DEFAULT_TTL)
+
+def cache_get(key: tuple):
+    '''Returns the cached response for a key, if it has not expired.
+
+    Args:
+        key: tuple of (source, *request arguments), e.g. ('news', terms, page_size)
+
+    Returns:
+        The cached response, or None on a cache miss
+    '''
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and _is_fresh(key, entry):
+            _cache.move_to_end(key)
+            cache_stats['hits'] += 1
+            return entry['value']
+        cache_stats['misses'] += 1
+    return None
+
+def cache_lookup(key: tuple) -> dict:
+    '''Returns the cached entry for a key, even if it has expired.
+
+    Args:
+        key: tuple of (source, *request arguments)
+
+    Returns:
+        Dictionary with the cached value, time stored and validators
+        {value, stored, etag, last_modified}, or None if not cached
+    '''
+    with _cache_lock:
+        entry = _cache.get(key)
+        return dict(entry) if entry is not None else None
+
+def cache_put(key: tuple, value, etag: str=None,
+              last_modified: str=None) -> type(None):
+    '''Stores a response, evicting the least recently used entries if full.
+
+    Args:
+        key: tuple of (source, *request arguments)
+        value: response to be cached
+        etag: ETag header of the response (if any)
+        last_modified: Last-Modified header (or equivalent) of the response
+    '''
+    with _cache_lock:
+        _cache[key] = {'value': value, 'stored': time(),
+                       'etag': etag, 'last_modified': last_modified}
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+            cache_stats['evictions'] += 1
+    logger_ac.info('response cached [source=%s]', key[0])
+
+def cache_refresh(key: tuple):
+    '''Restarts the time-to-live of an entry, after upstream confirmed it is unchanged.
+
+    Args:
+        key: tuple of (source, *request arguments)
+
+    Returns:
+        The cached response, or None if the entry has been evicted
+    '''
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        entry['stored'] = time()
+        _cache.move_to_end(key)
+        cache_stats['revalidated'] += 1
+        return entry['value']
+
+def clear_cache() -> type(None):
+    '''Removes all cached responses, and resets the counters.'''
+    with _cache_lock:
+        _cache.clear()
+        for k in cache_stats:
+            cache_stats[k] = 0
+
+def get_cache_stats() -> dict:
+    '''Returns a copy of the cache counters, along with the current size.'''
+    with _cache_lock:
+        return dict(cache_stats, size=len(_cache))
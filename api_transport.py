@@ -0,0 +1,162 @@
+'''This module handles: the transport used by the api sessions - pooled
+connections to the upstream apis, optionally recording every response to
+disk, or replaying recorded responses instead of using the network.
+
+Recording/replaying is set by "transport_mode" ("record" or "replay") and
+"transport_path" (directory of recordings) in config.json. Recordings are
+keyed by method, path and query (not host), so responses recorded from the
+real apis can also be served by mock_upstream.
+
+Below is a summary of the functions defined within this module
+
+api_transport
+    .recording_key()
+        > returns the key a request is recorded under
+    .save_recording()
+        > writes a response to the recordings directory
+    .load_recording()
+        > reads a recorded response
+    .mount()
+        > mounts the configured transport on a requests session
+'''
+
+import os
+import json
+import logging
+from hashlib import sha1
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import config_service
+import metrics
+
+logger_at = logging.getLogger(__name__)
+
+MODES = ('record', 'replay')
+POOL_MAXSIZE = 10 # connections kept alive per host
+# not recorded, as bodies are stored decoded
+UNSTORED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+def recording_key(method: str, url: str) -> str:
+    '''Returns the key a request is recorded under.
+
+    Args:
+        method: http method, e.g. GET
+        url: request url, including the query
+
+    Returns:
+        Method, path and (sorted) query, e.g. "GET /v2/everything?page=1&q=Covid"
+    '''
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f'{method.upper()} {parts.path}?{query}'
+
+def _recording_path(directory: str, key: str) -> str:
+    '''Returns the file a recording is stored in.'''
+    return os.path.join(directory, sha1(key.encode()).hexdigest()+'.json')
+
+def save_recording(directory: str, key: str, status: int, headers: dict,
+                   body: bytes) -> type(None):
+    '''Writes a response to the recordings directory (replacing any earlier
+    recording of the same request).
+
+    Args:
+        directory: recordings directory
+        key: as returned from recording_key
+        status: http status code
+        headers: response headers
+        body: response body
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = _recording_path(directory, key)
+    with open(path+'.tmp', 'w') as recording_file:
+        json.dump({'key': key, 'status': status, 'headers': dict(headers),
+                   'body': body.decode('utf-8', 'replace')}, recording_file)
+    os.replace(path+'.tmp', path)
+
+def load_recording(directory: str, key: str) -> dict:
+    '''Reads a recorded response.
+
+    Args:
+        directory: recordings directory
+        key: as returned from recording_key
+
+    Returns:
+        {key, status, headers, body}, or None if the request was not recorded
+    '''
+    try:
+        with open(_recording_path(directory, key), 'r') as recording_file:
+            return json.load(recording_file)
+    except FileNotFoundError:
+        return None
+
+class RecordReplayAdapter(BaseAdapter):
+    '''Transport adapter which records responses (sent by another adapter),
+    or replays recorded responses without using the network.'''
+
+    def __init__(self, mode: str, directory: str, adapter: BaseAdapter=None):
+        super().__init__()
+        self.mode = mode
+        self.directory = directory
+        self.adapter = adapter or HTTPAdapter(pool_maxsize=POOL_MAXSIZE)
+
+    def send(self, request, **kwargs):
+        key = recording_key(request.method, request.url)
+        if self.mode == 'record':
+            response = self.adapter.send(request, **kwargs)
+            headers = {name: value for name, value in response.headers.items()
+                       if name.lower() not in UNSTORED_HEADERS}
+            save_recording(self.directory, key, response.status_code,
+                           headers, response.content)
+            logger_at.info('response recorded [%s]', key)
+            return response
+        recording = load_recording(self.directory, key)
+        if recording is None:
+            raise requests.ConnectionError(f'no recorded response for {key}',
+                                           request=request)
+        response = requests.Response()
+        response.status_code = recording['status']
+        response.headers = CaseInsensitiveDict(recording['headers'])
+        response._content = recording['body'].encode()
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'Replayed'
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+metrics.describe('dashboard_upstream_http_seconds', 'Duration of http requests to the '
+                 'upstream apis (until response headers), by api and status')
+metrics.describe('dashboard_upstream_retries_total', 'Upstream requests retried')
+
+def mount(session: requests.Session, api: str=None,
+          pool_maxsize: int=POOL_MAXSIZE) -> requests.Session:
+    '''Mounts the configured transport on a session (for http and https), and
+    records the duration of each response.
+
+    Args:
+        session: session used for api requests
+        api: name of api, used to label recorded durations
+        pool_maxsize: connections kept alive per host
+
+    Returns:
+        The session
+    '''
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    mode = config_service.get('transport_mode')
+    if mode in MODES:
+        directory = config_service.get('transport_path', 'recordings')
+        adapter = RecordReplayAdapter(mode, directory, adapter)
+        logger_at.info('api transport set to %s [path=%s]', mode, directory)
+    elif mode:
+        logger_at.warning('unknown transport_mode %s ignored', mode)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    def record_duration(response, *args, **kwargs):
+        metrics.observe('dashboard_upstream_http_seconds', response.elapsed.total_seconds(),
+                        api=api or 'unknown', status=response.status_code)
+    session.hooks['response'].append(record_duration)
+    return session
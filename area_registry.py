@@ -0,0 +1,216 @@
+'''This module handles: the areas served by the dashboard - an index of the
+configured areas (by name and code), and a compact table of their stats.
+
+Areas are read from config.json: the main location, along with any listed in
+"areas", e.g. [{"name": "Exeter", "type": "ltla", "code": "E07000041",
+"population": 133572}] (an area's "nation" defaults to "nation" in config.json,
+or England; the main location's population is "population"). Each area is
+given a row, which it keeps while the dashboard is running - unless its type
+or nation is changed, when it is given a new row (so stats of the old details
+are never shown for the new ones).
+
+The stats of every area are held in a table of arrays, one value per area for
+each local stat, while the national stats are held once for each nation - so
+serving hundreds of areas takes a few kilobytes, rather than a tuple per area.
+
+Below is a summary of the functions defined within this module
+
+area_registry
+    .register_area()
+        > adds an area to the index, returning its row
+    .load_areas()
+        > registers the areas listed in config.json
+    .find_area()
+        > returns the row of an area, by name or code
+    .get_area()
+        > returns the details of the area in a row
+    .get_areas()
+        > returns the details of every registered area, in row order
+    .get_population()
+        > returns the population of the area in a row
+    .build_table()
+        > packs the stats of the registered areas into a table
+    .merge_tables()
+        > fills the unknown stats of a table from an earlier table
+    .table_stats()
+        > returns the stats of an area from a table, in the format of covid_data
+'''
+
+import logging
+import threading
+from array import array
+import config_service
+
+logger_ar = logging.getLogger(__name__)
+
+DEFAULT_NATION = 'England'
+MISSING = -2**63 # sentinel for stats which could not be fetched
+
+global areas
+areas = [] # (name, type, code, nation), indexed by row - only ever appended to
+_index = {} # lower case name or code -> (latest) row
+populations = {} # row -> population, of areas where it is configured
+_register_lock = threading.Lock()
+
+def register_area(name: str, area_type: str, code: str=None,
+                  nation: str=None, population: int=None) -> int:
+    '''Adds an area to the index (if not already registered with the same details).
+
+    Args:
+        name: area name, as used by the covid api, e.g. Exeter
+        area_type: area type, e.g. ltla
+        code: area code, e.g. E07000041
+        nation: name of the nation containing the area
+        population: population of the area (for rates per 100,000)
+
+    Returns:
+        Row of the area (a new row if its type or nation has changed), or None
+        if the area is invalid
+    '''
+    if not (isinstance(name, str) and name and isinstance(area_type, str)):
+        return None
+    if area_type == 'nation':
+        nation = name
+    nation = nation or config_service.get('nation', DEFAULT_NATION)
+    with _register_lock:
+        row = _index.get(name.lower())
+        if row is not None and (areas[row][1], areas[row][3]) != (area_type, nation):
+            logger_ar.info('area details changed [name=%s, type=%s, nation=%s]',
+                           name, area_type, nation)
+            code = code or areas[row][2]
+            row = None # re-registered, and the old row is no longer refreshed
+        if row is None:
+            row = len(areas)
+            areas.append((name, area_type, code, nation))
+            _index[name.lower()] = row
+            logger_ar.info('area registered [name=%s, type=%s]', name, area_type)
+        if code:
+            _index[code.lower()] = row
+        if isinstance(population, int) and population > 0:
+            populations[row] = population
+    return row
+
+def load_areas(config: dict=None) -> list:
+    '''Registers the main location, and the areas listed in config.json.
+
+    Args:
+        config: parsed config.json, defaults to the current config
+
+    Returns:
+        Rows of the configured areas (the main location first)
+    '''
+    if config is None:
+        config = config_service.load_config() or {}
+    nation = config.get('nation')
+    rows = [register_area(config.get('location'), config.get('location_type'),
+                          nation=nation, population=config.get('population'))]
+    for area in config.get('areas') or []:
+        if not isinstance(area, dict):
+            logger_ar.warning('invalid area in config [area=%s]', area)
+            continue
+        rows.append(register_area(area.get('name'), area.get('type'),
+                                  area.get('code'), area.get('nation') or nation,
+                                  area.get('population')))
+    return [row for row in rows if row is not None]
+
+def find_area(key: str) -> int:
+    '''Returns the row of an area.
+
+    Args:
+        key: area name or code (not case sensitive)
+
+    Returns:
+        Row of the area, or None if it is not registered
+    '''
+    if not isinstance(key, str):
+        return None
+    return _index.get(key.lower())
+
+def get_area(row: int) -> tuple[str, str, str, str]:
+    '''Returns the details (name, type, code, nation) of the area in a row.'''
+    return areas[row]
+
+def get_areas() -> list:
+    '''Returns the details (name, type, code, nation) of every registered area,
+    in row order.'''
+    return list(areas)
+
+def get_population(row: int) -> int:
+    '''Returns the population of the area in a row, or None if not configured.'''
+    return populations.get(row)
+
+def build_table(local_cases: dict, nation_stats: dict) -> tuple:
+    '''Packs the stats of the registered areas into a table.
+
+    Args:
+        local_cases: row -> 7 day case count of the area
+        nation_stats: nation -> (7 day case count, hospital cases, deaths)
+
+    Returns:
+        Table of (local cases, nation of each row, nations, national cases,
+        hospital cases, deaths) - arrays, with MISSING for unknown values
+    '''
+    count = len(areas)
+    nations = tuple(sorted({areas[row][3] for row in range(count)} | set(nation_stats)))
+    nation_rows = {nation: i for i, nation in enumerate(nations)}
+    def value(stat):
+        return MISSING if stat is None else stat
+    national = [nation_stats.get(nation) or (None, None, None) for nation in nations]
+    return (array('q', (value(local_cases.get(row)) for row in range(count))),
+            array('H', (nation_rows[areas[row][3]] for row in range(count))),
+            nations,
+            array('q', (value(stats[0]) for stats in national)),
+            array('q', (value(stats[1]) for stats in national)),
+            array('q', (value(stats[2]) for stats in national)))
+
+def merge_tables(table: tuple, previous: tuple) -> tuple:
+    '''Fills the unknown stats of a table (e.g. of areas whose request failed)
+    from an earlier table, so a failed update does not hide the last known stats.
+
+    Args:
+        table: as returned from build_table
+        previous: earlier table, or None
+
+    Returns:
+        New table, or None if table has no known stats (nothing was fetched)
+    '''
+    local_cases, nation_rows, nations, national_cases, hospital, deaths = table
+    if all(stat == MISSING for column in (local_cases, national_cases, hospital, deaths)
+           for stat in column):
+        return None
+    if not previous:
+        return table
+    local_cases = array('q', local_cases)
+    for row, (stat, known) in enumerate(zip(local_cases, previous[0])):
+        if stat == MISSING:
+            local_cases[row] = known
+    previous_rows = {nation: n for n, nation in enumerate(previous[2])}
+    national = [array('q', column) for column in (national_cases, hospital, deaths)]
+    for n, nation in enumerate(nations):
+        if nation not in previous_rows:
+            continue
+        for column, known in zip(national, previous[3:]):
+            if column[n] == MISSING:
+                column[n] = known[previous_rows[nation]]
+    return (local_cases, nation_rows, nations, *national)
+
+def table_stats(table: tuple, row: int) -> tuple[str, int, str, int, int, int]:
+    '''Returns the stats of an area from a table.
+
+    Args:
+        table: as returned from build_table
+        row: row of the area
+
+    Returns:
+        (area, last7days_cases_local, nation, last7days_cases_nation,
+        hospital_cases, total_deaths), as get_covid_stats - or None if the
+        area was registered after the table was built
+    '''
+    if not table or row is None or not 0 <= row < len(table[0]):
+        return None
+    local_cases, nation_rows, nations, national_cases, hospital, deaths = table
+    def value(stat):
+        return None if stat == MISSING else stat
+    n = nation_rows[row]
+    return (areas[row][0], value(local_cases[row]), nations[n],
+            value(national_cases[n]), value(hospital[n]), value(deaths[n]))
@@ -0,0 +1,166 @@
+'''
+This module handles:
+    > an alternative, asynchronous (ASGI) entry point for the dashboard,
+        e.g. run with "uvicorn asgi_main:app"
+    > serving the interface, live updates (see live_updates) and static
+        files from an asyncio event loop
+
+Requests are handled exactly as in main (which is imported, so the flask
+entry point keeps working). Cached pages are served directly from the event
+loop; anything which may block (applying request arguments, rendering and
+reading static files) runs on a worker thread, so one process can hold many
+concurrent connections.
+'''
+
+## imports
+import os
+import asyncio
+import mimetypes
+from urllib.parse import parse_qsl
+import main
+import json_api
+import live_updates
+import metrics
+
+STATIC_DIR = os.path.join(os.getcwd(), 'static')
+
+async def send_response(send, status: int, body: bytes=b'',
+                        headers: list=None) -> type(None):
+    '''Sends a complete http response.
+
+    Args:
+        send: ASGI send callable
+        status: http status code
+        body: response body
+        headers: list of (name, value) pairs, as bytes
+    '''
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-length', str(len(body)).encode())]+(headers or [])})
+    await send({'type': 'http.response.body', 'body': body})
+
+def _without_body(send):
+    '''Wraps an ASGI send callable for HEAD requests - the headers of the GET
+    response (including its content-length) are sent, without the body.'''
+    async def send_head(message):
+        if message['type'] == 'http.response.body':
+            message = dict(message, body=b'')
+        await send(message)
+    return send_head
+
+def read_static(path: str) -> bytes:
+    '''Reads a static file, returning None if it does not exist (or is outside STATIC_DIR).'''
+    filename = os.path.realpath(os.path.join(STATIC_DIR, path))
+    if not filename.startswith(STATIC_DIR+os.sep) or not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as static_file:
+        return static_file.read()
+
+async def index(scope, send) -> type(None):
+    '''Handles requests for the interface (see main.index).'''
+    with metrics.timed('dashboard_index_seconds'):
+        await _index(scope, send)
+
+async def _index(scope, send) -> type(None):
+    '''Handles requests for the interface, see index.'''
+    update_args = dict(parse_qsl(scope['query_string'].decode()))
+    if update_args.keys()-{'area'}: # area alone changes nothing
+        with metrics.timed('dashboard_index_stage_seconds', stage='request_args'):
+            await asyncio.to_thread(main.handle_request_args, update_args)
+    version = main.dashboard_state.get_snapshot()[0]
+    row = main.area_page_key(update_args.get('area'))
+    page = main.rendered_pages.get(row)
+    if page is not None and page[0] == main.page_version(version, row):
+        # served without leaving the event loop
+        html, etag = page[1:]
+    else:
+        html, etag = await asyncio.to_thread(main.get_rendered_page,
+                                             update_args.get('area'))
+    headers = dict(scope['headers'])
+    if json_api.etag_matches(headers.get(b'if-none-match', b'').decode(), f'"{etag}"'):
+        await send_response(send, 304, headers=[(b'etag', f'"{etag}"'.encode())])
+        return
+    await send_response(send, 200, html.encode(),
+                        [(b'content-type', b'text/html; charset=utf-8'),
+                         (b'etag', f'"{etag}"'.encode())])
+
+async def api(scope, send) -> type(None):
+    '''Handles requests to the json api (see main.api). Responses are cached by
+    json_api, so are served without leaving the event loop.'''
+    headers = dict(scope['headers'])
+    status, body, response_headers = main.get_api_response(
+        scope['path'][len('/api/'):], dict(parse_qsl(scope['query_string'].decode())),
+        headers.get(b'accept-encoding', b'').decode(),
+        headers.get(b'if-none-match', b'').decode())
+    await send_response(send, status, body,
+                        [(name.lower().encode(), value.encode())
+                         for name, value in response_headers])
+
+async def events(scope, receive, send) -> type(None):
+    '''Streams changes to the interface, as Server-Sent Events (see main.events).
+
+    Open streams only wait on the event loop, so do not hold a thread each.
+    '''
+    headers = dict(scope['headers'])
+    since = headers.get(b'last-event-id', b'').decode() or \
+        dict(parse_qsl(scope['query_string'].decode())).get('version')
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'),
+                            (b'cache-control', b'no-cache')]})
+    async def stream():
+        async for event in live_updates.event_stream_async(since):
+            await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    streaming = asyncio.ensure_future(stream())
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    waiting = asyncio.ensure_future(disconnected())
+    await asyncio.wait([streaming, waiting], return_when=asyncio.FIRST_COMPLETED)
+    for task in (streaming, waiting):
+        task.cancel()
+
+async def app(scope, receive, send) -> type(None):
+    '''ASGI application, serving /index, /events, /api/, /analytics, /metrics, /profile and /static/.'''
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    path = scope['path']
+    if scope['method'] == 'HEAD':
+        send = _without_body(send)
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_response(send, 405)
+    elif path == '/index':
+        await index(scope, send)
+    elif path == '/events':
+        await events(scope, receive, send)
+    elif path.startswith('/api/'):
+        await api(scope, send)
+    elif path == '/analytics':
+        args = dict(parse_qsl(scope['query_string'].decode()))
+        status, body = await asyncio.to_thread(main.get_analytics, args)
+        await send_response(send, status, body.encode(),
+                            [(b'content-type', b'application/json')])
+    elif path == '/metrics':
+        body = await asyncio.to_thread(metrics.render_metrics)
+        await send_response(send, 200, body.encode(),
+                            [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')])
+    elif path == '/profile':
+        clear = bool(dict(parse_qsl(scope['query_string'].decode())).get('clear'))
+        await send_response(send, 200, metrics.profile_report(clear).encode(),
+                            [(b'content-type', b'text/plain; charset=utf-8')])
+    elif path.startswith('/static/'):
+        body = await asyncio.to_thread(read_static, path[len('/static/'):])
+        if body is None:
+            await send_response(send, 404)
+        else:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            await send_response(send, 200, body, [(b'content-type', content_type.encode())])
+    else:
+        await send_response(send, 404)
@@ -0,0 +1,68 @@
+'''This module handles: generating the (synthetic, deterministic) fixtures used
+by the benchmarks, in the formats returned from the static csv file, the
+uk-covid-19 api and the news api (generated as by mock_upstream) - so
+benchmarks run offline.
+
+Below is a summary of the functions defined within this module
+
+fixtures
+    .write_csv_fixture()
+        > writes a csv file in the format of nation_2021-10-28.csv
+    .covid_api_payload()
+        > returns a covid api response with a given number of rows
+    .news_api_payload()
+        > returns a news api response with a given number of articles
+'''
+
+import random
+from datetime import date, timedelta
+import mock_upstream
+
+CSV_HEADER = ('areaCode,areaName,areaType,date,cumDailyNsoDeathsByDeathDate,'
+              'hospitalCases,newCasesBySpecimenDate')
+LATEST_DATE = date(2021, 10, 28)
+
+def write_csv_fixture(filename: str, rows: int, seed: int=0) -> type(None):
+    '''Writes a csv file, newest row first, with the gaps of the real file
+    (no cases for the latest day, and deaths only reported after a delay).
+
+    Args:
+        filename: file to be written
+        rows: number of data rows
+        seed: seed of the generated values
+    '''
+    rng = random.Random(seed)
+    with open(filename, 'w') as csv_file:
+        csv_file.write(CSV_HEADER+'\n')
+        lines = []
+        for i in range(rows):
+            day = LATEST_DATE-timedelta(days=i%36500)
+            deaths = '' if i < 11 else str(150_000-i//10)
+            cases = '' if i == 0 else str(rng.randrange(20_000, 50_000))
+            lines.append(f'E92000001,England,nation,{day.isoformat()},{deaths},'
+                         f'{rng.randrange(5_000, 9_000)},{cases}\n')
+            if len(lines) == 10_000: # written in chunks, so memory use is bounded
+                csv_file.writelines(lines)
+                lines = []
+        csv_file.writelines(lines)
+
+def covid_api_payload(rows: int, location: str='England') -> dict:
+    '''Returns a covid api response (as returned from covid_API_request).
+
+    Args:
+        rows: number of rows in data
+        location: area name of rows
+    '''
+    return {'data': mock_upstream.covid_rows(location, 'nation', rows),
+            'lastUpdate': LATEST_DATE.isoformat()+'T15:00:00.000000Z',
+            'length': rows, 'totalPages': 1}
+
+def news_api_payload(articles: int, start: int=0) -> dict:
+    '''Returns a news api response (as returned from news_API_request).
+
+    Args:
+        articles: number of articles
+        start: index of first article, so pages have distinct urls
+    '''
+    return {'status': 'ok', 'totalResults': start+articles,
+            'articles': mock_upstream.news_articles(start, articles)}
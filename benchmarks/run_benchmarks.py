@@ -0,0 +1,248 @@
+'''This module handles: measuring the performance of the dashboard offline, and
+comparing the results against a stored (json) baseline to flag regressions.
+
+Run from the project directory, e.g.
+    python benchmarks/run_benchmarks.py --save benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Each benchmark is run for several rounds, and the minimum and median times
+(seconds) are recorded. A benchmark regresses if its median exceeds that of
+the baseline by more than the threshold.
+
+Below is a summary of the functions defined within this module
+
+run_benchmarks
+    .measure()
+        > times a function over several rounds
+    .csv_benchmarks()
+        > benchmarks parsing/processing of csv files, for each size
+    .covid_json_benchmarks()
+        > benchmarks get_stats_from_json on large api payloads
+    .news_benchmarks()
+        > benchmarks update_news against a large index of dismissed articles
+    .index_benchmarks()
+        > benchmarks /index through the flask test client
+    .run()
+        > runs the selected benchmarks
+    .compare()
+        > compares results against a baseline, returning the regressions
+    .main()
+        > command line entry point
+'''
+
+import os
+import sys
+import json
+import platform
+import tempfile
+import argparse
+from datetime import datetime
+from statistics import median
+from time import perf_counter, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # config.json and templates are read from the project directory
+
+import fixtures
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+ALL_SIZES = DEFAULT_SIZES+[10**7]
+THRESHOLD = 0.2 # largest allowed (fractional) increase in median time
+MIN_TIME = 0.5 # minimum time (seconds) spent on each benchmark
+
+def measure(function, rounds: int=None, min_time: float=MIN_TIME) -> dict:
+    '''Times a function over several rounds.
+
+    Args:
+        function: function taking no arguments
+        rounds: number of rounds, None to run for at least min_time (and
+            at least 3 rounds)
+        min_time: minimum total time (seconds), if rounds is None
+
+    Returns:
+        {min, median, rounds} - times in seconds
+    '''
+    times = []
+    start = perf_counter()
+    while (len(times) < rounds if rounds else
+           len(times) < 3 or perf_counter()-start < min_time):
+        t = perf_counter()
+        function()
+        times.append(perf_counter()-t)
+    return {'min': min(times), 'median': median(times), 'rounds': len(times)}
+
+def csv_benchmarks(sizes: list) -> dict:
+    '''Benchmarks parse_csv_data, process_covid_csv_data and the streaming
+    reader on synthetic csv files of each size.'''
+    import covid_data_handler as cdh
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            filename = os.path.join(directory, f'covid_{size}.csv')
+            fixtures.write_csv_fixture(filename, size)
+            rounds = 3 if size >= 10**6 else None
+            results[f'parse_csv_data[{size}]'] = measure(
+                lambda: cdh.parse_csv_data(filename), rounds)
+            lines = cdh.parse_csv_data(filename)
+            results[f'process_covid_csv_data[{size}]'] = measure(
+                lambda: cdh.process_covid_csv_data(lines), rounds)
+            del lines
+            results[f'process_covid_csv_stream[{size}]'] = measure(
+                lambda: cdh.process_covid_csv_stream(cdh.stream_csv_data(filename)), rounds)
+            os.remove(filename)
+    return results
+
+def covid_json_benchmarks(sizes: list) -> dict:
+    '''Benchmarks get_stats_from_json (the metrics of get_covid_stats) on api
+    payloads of each size.'''
+    import covid_data_handler as cdh
+    results = {}
+    for size in sizes:
+        if size > 10**6: # payloads are held as dictionaries, so limited by memory
+            continue
+        payload = fixtures.covid_api_payload(size)
+        def extract():
+            cdh.get_stats_from_json(payload, 'newCasesByPublishDate', 7, True)
+            cdh.get_stats_from_json(payload, 'hospitalCases')
+            cdh.get_stats_from_json(payload, 'cumDeaths28DaysByPublishDate')
+        results[f'get_stats_from_json[{size}]'] = measure(extract)
+    return results
+
+def news_benchmarks(sizes: list) -> dict:
+    '''Benchmarks update_news with dismissed article indexes of each size
+    (news api requests are answered from fixtures).'''
+    import covid_news_handling as cnh
+    results = {}
+    original_request = cnh.news_API_request
+    def news_API_request(covid_terms=None, page_size=20, page=1):
+        return fixtures.news_api_payload(page_size, (page-1)*page_size)
+    cnh.news_API_request = news_API_request
+    try:
+        for size in sizes:
+            if size > 10**6:
+                continue
+            now = time()
+            dismissed = {f'dismissed-{i}': now for i in range(size)}
+            for i in range(0, 30, 2): # half of the first page has been dismissed
+                dismissed[cnh.article_id(f'https://news.example.com/articles/{i}')] = now
+            cnh.dismissed_articles.clear()
+            cnh.dismissed_articles.update(dismissed)
+            results[f'update_news[{size}]'] = measure(
+                lambda: cnh.update_news('Covid', sch=False))
+    finally:
+        cnh.news_API_request = original_request
+        cnh.dismissed_articles.clear()
+    return results
+
+def index_benchmarks(requests: int=200) -> dict:
+    '''Benchmarks /index through the flask test client, both when the page is
+    unchanged and when every request follows an update (so is re-rendered).'''
+    import covid_data_handler as cdh
+    import covid_news_handling as cnh
+    # initial updates are replaced, so importing main makes no api requests
+    cdh.update_covid_data = lambda: None
+    cnh.update_news = lambda *args, **kwargs: None
+    import main
+    import dashboard_state
+    dashboard_state.publish('covid_data', ('Exeter', 1000, 'England', 20000, 7000, 140000))
+    dashboard_state.publish('covid_news', tuple(
+        cnh.format_news_article(a) for a in fixtures.news_api_payload(10)['articles']))
+    client = main.app.test_client()
+    etag = client.get('/index').headers['ETag']
+    def unchanged():
+        for _ in range(requests):
+            client.get('/index')
+    def conditional():
+        for _ in range(requests):
+            client.get('/index', headers={'If-None-Match': etag})
+    def updated():
+        for i in range(requests):
+            dashboard_state.publish('covid_data',
+                                    ('Exeter', i, 'England', 20000, 7000, 140000))
+            client.get('/index')
+    return {f'index_unchanged[{requests}]': measure(unchanged),
+            f'index_conditional[{requests}]': measure(conditional),
+            f'index_updated[{requests}]': measure(updated)}
+
+def run(sizes: list, selected: str=None) -> dict:
+    '''Runs the benchmarks.
+
+    Args:
+        sizes: numbers of rows (or dismissed articles) benchmarked
+        selected: only run benchmark groups containing this string, None for all
+
+    Returns:
+        Results, with the environment they were measured in
+    '''
+    groups = {'csv': csv_benchmarks, 'covid_json': covid_json_benchmarks,
+              'news': news_benchmarks, 'index': lambda sizes: index_benchmarks()}
+    results = {}
+    for name, group in groups.items():
+        if selected is None or selected in name:
+            results.update(group(sizes))
+    return {'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'date': datetime.now().isoformat(timespec='seconds')},
+            'results': results}
+
+def compare(results: dict, baseline: dict, threshold: float=THRESHOLD) -> list:
+    '''Compares results against a baseline.
+
+    Args:
+        results: as returned from run
+        baseline: as returned from run (e.g. loaded from a saved file)
+        threshold: largest allowed (fractional) increase in median time
+
+    Returns:
+        List of (name, baseline median, median, ratio) for each regression
+    '''
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['median']/base['median']
+        if ratio > 1+threshold:
+            regressions.append((name, base['median'], result['median'], ratio))
+    return regressions
+
+def main(args: list=None) -> int:
+    '''Runs the benchmarks from the command line.
+
+    Returns:
+        Exit status - 1 if any regressions were found, else 0
+    '''
+    parser = argparse.ArgumentParser(description='Offline dashboard benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='numbers of rows benchmarked (10000000 for the largest file)')
+    parser.add_argument('--all-sizes', action='store_true',
+                        help=f'benchmark every size, {ALL_SIZES}')
+    parser.add_argument('--select', help='only run groups containing this string '
+                        '(csv, covid_json, news, index)')
+    parser.add_argument('--save', help='write results to a json file (e.g. a new baseline)')
+    parser.add_argument('--compare', help='compare results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='largest allowed increase in median time (fraction)')
+    options = parser.parse_args(args)
+    results = run(ALL_SIZES if options.all_sizes else options.sizes, options.select)
+    for name, result in results['results'].items():
+        print(f'{name:<40} median {result["median"]*1000:10.3f} ms'
+              f'   min {result["min"]*1000:10.3f} ms   ({result["rounds"]} rounds)')
+    if options.save:
+        with open(options.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f'results saved to {options.save}')
+    if options.compare:
+        with open(options.compare, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.threshold)
+        for name, base, current, ratio in regressions:
+            print(f'REGRESSION {name}: {base*1000:.3f} ms -> {current*1000:.3f} ms '
+                  f'({ratio:.2f}x)')
+        if regressions:
+            return 1
+        print('no regressions')
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
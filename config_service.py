@@ -0,0 +1,250 @@
+'''This module handles: reading config.json - the file is parsed (and validated)
+once, and reads are then served from memory.
+
+The file is checked for changes at most every CHECK_INTERVAL, and is only
+reparsed when its modification time (or size) has changed. A valid new config
+replaces the old one as a whole, so readers never see a partial reload; an
+invalid one is logged and ignored (an invalid first config is replaced by the
+defaults in template_config.json). Functions added with on_change are called
+with the keys which changed, so e.g. a new location can trigger a refresh of
+the covid stats alone.
+
+Below is a summary of the functions defined within this module
+
+config_service
+    .validate_config()
+        > checks a config against SCHEMA, returning a list of problems
+    .load_config()
+        > returns the current config, reloading it if the file has changed
+    .get()
+        > returns a single value from the current config
+    .on_change()
+        > adds a function to be called when values in the config change
+    .override()
+        > overrides values of the config in memory, without changing the file
+    .start()
+        > starts checking the file for changes on a background thread
+    .stop()
+        > stops the background thread
+'''
+
+import os
+import logging
+import threading
+from json import load, JSONDecodeError
+from time import time
+
+logger_cs = logging.getLogger(__name__)
+
+CONFIG_PATH = 'config.json'
+TEMPLATE_PATH = 'template_config.json' # defaults, used if the first config loaded is invalid
+CHECK_INTERVAL = 1 # longest time (seconds) before changes to the file are seen
+# key -> type of value, nested for dictionaries (keys not listed are optional)
+SCHEMA = {
+    'location': str,
+    'location_type': str,
+    'news_search_terms': str,
+    'api_keys': {'news_api': str},
+    'log_file_path': str,
+}
+OPTIONAL = {
+    'dismissed_articles_path': str,
+    'shared_state_path': str,
+    'covid_api_url': str,
+    'news_api_url': str,
+    'transport_mode': str,
+    'transport_path': str,
+    'sampling_profiler': bool,
+    'deferred_startup': bool,
+    'nation': str,
+    'areas': list,
+    'population': int,
+    'show_analytics': bool,
+    'schedule_journal_path': str,
+}
+
+global _config
+_config = None # current config, replaced as a whole on reload
+_file_config = None # config as parsed from the file, before any overrides
+_overrides = {} # key -> value replacing that of the file, see override
+_file_state = None # (mtime, size) of the file when last loaded
+_last_check = 0
+_load_lock = threading.Lock()
+change_callbacks = [] # (callback, keys)
+_stop_event = threading.Event()
+_watch_thread = None
+
+def validate_config(config: dict) -> list:
+    '''Checks a config against SCHEMA (the checks of test_config_valid).
+
+    Args:
+        config: parsed config.json
+
+    Returns:
+        List of problems found (empty if the config is valid)
+    '''
+    if not isinstance(config, dict):
+        return ['config is not a json object']
+    problems = []
+    def check(values: dict, schema: dict, required: bool, prefix: str=''):
+        for key, expected in schema.items():
+            if key not in values:
+                if required:
+                    problems.append(f'{prefix}{key} is missing')
+            elif isinstance(expected, dict):
+                if isinstance(values[key], dict):
+                    check(values[key], expected, required, prefix+key+'.')
+                else:
+                    problems.append(f'{prefix}{key} is not an object')
+            elif not isinstance(values[key], expected):
+                problems.append(f'{prefix}{key} is not a {expected.__name__}')
+    check(config, SCHEMA, True)
+    check(config, OPTIONAL, False)
+    if config.get('api_keys', {}).get('news_api') == '[api-key]':
+        problems.append('api_keys.news_api has not been set')
+    return problems
+
+def _changed_keys(old: dict, new: dict) -> set:
+    '''Returns the (top-level) keys whose values differ between two configs.'''
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+def load_config(force: bool=False) -> dict:
+    '''Returns the current config, reloading it if the file has changed.
+
+    Args:
+        force: flag for checking the file immediately, rather than every
+            CHECK_INTERVAL
+
+    Returns:
+        Parsed config.json (shared, so must not be modified), or None if no
+        valid config has been loaded
+    '''
+    global _config, _file_config, _file_state, _last_check
+    config = _config
+    if config is not None and not force and time()-_last_check < CHECK_INTERVAL:
+        return config # served from memory
+    changes = None
+    with _load_lock:
+        _last_check = time()
+        try:
+            stat = os.stat(CONFIG_PATH)
+        except OSError:
+            logger_cs.error('config file not found [path=%s]', CONFIG_PATH)
+            return _config
+        if (stat.st_mtime_ns, stat.st_size) == _file_state:
+            return _config
+        _file_state = (stat.st_mtime_ns, stat.st_size)
+        try:
+            with open(CONFIG_PATH, 'r') as config_file:
+                new_config = load(config_file)
+        except (OSError, JSONDecodeError):
+            logger_cs.exception('config file could not be parsed, not reloaded')
+            return _config
+        problems = validate_config(new_config)
+        if problems:
+            logger_cs.error('invalid config (%s)', ', '.join(problems))
+            if _config is not None: # previous config is kept
+                return _config
+            new_config = _load_template()
+            if new_config is None:
+                return None
+        _file_config = new_config
+        if _overrides:
+            new_config = dict(new_config, **_overrides)
+        old_config, _config = _config, new_config
+        if old_config is not None:
+            changes = _changed_keys(old_config, new_config)
+        logger_cs.info('config loaded [path=%s]', CONFIG_PATH)
+    if changes:
+        _notify(changes, new_config)
+    return new_config
+
+def _load_template() -> dict:
+    '''Returns the template config (see TEMPLATE_PATH), in place of an invalid
+    first config - so news is disabled until the file is fixed, as the template
+    holds no api key. None if the template cannot be read.'''
+    try:
+        with open(TEMPLATE_PATH, 'r') as template_file:
+            template = load(template_file)
+    except (OSError, JSONDecodeError):
+        logger_cs.exception('template config could not be read [path=%s]', TEMPLATE_PATH)
+        return None
+    logger_cs.warning('template config used until the config is fixed [path=%s]',
+                      TEMPLATE_PATH)
+    return template
+
+def get(key: str, default=None):
+    '''Returns a single value from the current config.
+
+    Args:
+        key: top-level key in config.json, e.g. location
+        default: returned if the key is not set
+    '''
+    config = load_config()
+    if config is None:
+        return default
+    return config.get(key, default)
+
+def on_change(callback, keys: list=None) -> type(None):
+    '''Adds a function to be called when values in the config change.
+
+    Args:
+        callback: function taking the set of changed keys, and the new config
+        keys: keys to be notified of, None for any key
+    '''
+    if all(c is not callback for c, _ in change_callbacks):
+        change_callbacks.append((callback, None if keys is None else set(keys)))
+
+def override(values: dict=None) -> type(None):
+    '''Overrides values of the config in memory, without changing the file
+    (e.g. to point the api urls at a test server). Overrides are kept when the
+    file is reloaded; change callbacks are not called.
+
+    Args:
+        values: values replacing those in config.json, None to remove every override
+    '''
+    global _config
+    with _load_lock:
+        if values is None:
+            _overrides.clear()
+        else:
+            _overrides.update(values)
+        if _file_config is not None:
+            _config = dict(_file_config, **_overrides) if _overrides else _file_config
+
+def _notify(changes: set, config: dict) -> type(None):
+    '''Calls the change callbacks interested in a set of changed keys.'''
+    logger_cs.info('config changed [keys=%s]', ', '.join(sorted(changes)))
+    for callback, keys in change_callbacks:
+        if keys is None or keys & changes:
+            try:
+                callback(changes if keys is None else keys & changes, config)
+            except Exception:
+                logger_cs.exception('config change callback failed')
+
+def _watch() -> type(None):
+    '''Main loop of the watcher thread.'''
+    while not _stop_event.wait(CHECK_INTERVAL):
+        load_config(force=True)
+
+def start() -> type(None):
+    '''Starts checking the file for changes on a background thread, so change
+    notifications are sent whether or not the config is being read.'''
+    global _watch_thread
+    if _watch_thread is not None and _watch_thread.is_alive():
+        return
+    _stop_event.clear()
+    _watch_thread = threading.Thread(target=_watch, name='config-watcher', daemon=True)
+    _watch_thread.start()
+
+def stop(timeout: float=None) -> type(None):
+    '''Stops the watcher thread.
+
+    Args:
+        timeout: maximum time (seconds) to wait for the thread to finish
+    '''
+    global _watch_thread
+    _stop_event.set()
+    if _watch_thread is not None:
+        _watch_thread.join(timeout)
+        _watch_thread = None
@@ -0,0 +1,253 @@
+'''This module handles: rolling-window and trend analytics of covid metrics -
+rolling totals, averages, week-over-week change and rates per 100,000 people.
+
+A single pass over an api payload (or the stored series of an area, see
+covid_store) builds prefix sums of every metric, along with prefix counts of
+the days with a value (see covid_data_handler.prefix_sums). Any window's total (and average) is then the difference
+of two prefix sums, so each stat takes constant time, whatever the window.
+
+Windows are counted in rows (one row per day), and end at the latest row with
+a value for the metric - or, for metrics in SKIP_LATEST, the row before it, as
+the latest day's figures are incomplete (see get_stats_from_json).
+
+Below is a summary of the functions defined within this module
+
+covid_analytics
+    .series_from_rows()
+        > builds prefix sums of each metric from api rows, in one pass
+    .series_from_store()
+        > builds prefix sums of each metric from an area's stored series
+    .window_total()
+        > returns the total of a metric over a window of days
+    .window_average()
+        > returns the daily average of a metric over a window of days
+    .week_over_week()
+        > returns the change in a metric's 7 day total from the previous 7 days
+    .per_100k()
+        > converts a value to a rate per 100,000 people
+    .summarise()
+        > returns every stat of every metric in a series
+    .area_analytics()
+        > returns the stats of a registered area, from its stored series
+'''
+
+import logging
+import threading
+from datetime import date
+import area_registry
+import covid_data_handler
+import covid_store
+
+logger_ca = logging.getLogger(__name__)
+
+METRICS = covid_store.METRICS
+SKIP_LATEST = {'newCasesByPublishDate': 1} # incomplete latest rows, skipped by windows
+WINDOW = 7 # default window (days)
+
+_cache = {} # (location, location_type) -> (series stamp, series), see covid_store.series_stamp
+_cache_lock = threading.Lock()
+
+def _build_series(dates: list, columns: dict) -> dict:
+    '''Builds prefix sums and counts from columns of values (oldest first, None
+    or covid_store.MISSING for missing values).'''
+    series = {'dates': dates, 'sums': {}, 'counts': {}}
+    for metric, values in columns.items():
+        present = bytearray(v is not None and v != covid_store.MISSING for v in values)
+        series['sums'][metric], series['counts'][metric] = \
+            covid_data_handler.prefix_sums((values, present))
+    return series
+
+def series_from_rows(rows: list, metrics: list=METRICS) -> dict:
+    '''Builds prefix sums of each metric from api rows, in one pass.
+
+    Args:
+        rows: rows of covid data, newest first - the data of a response from
+            covid_API_request
+        metrics: metrics to be summed
+
+    Returns:
+        Series {dates, sums, counts} - dates (%format YYYY-MM-DD) oldest first,
+        and for each metric, arrays of prefix sums and counts of present values
+        (one longer than dates)
+    '''
+    if not isinstance(rows, list):
+        return None
+    dates = []
+    columns = {metric: [] for metric in metrics}
+    for row in reversed(rows):
+        dates.append(row.get('date'))
+        for metric, column in columns.items():
+            column.append(row.get(metric))
+    return _build_series(dates, columns)
+
+def series_from_store(location: str, location_type: str) -> dict:
+    '''Builds prefix sums of each metric from an area's stored series (read
+    without copying, see covid_store.read_range). Series are cached until
+    more rows are stored.
+
+    Args:
+        location: area name
+        location_type: area type
+
+    Returns:
+        As series_from_rows, or None if nothing is stored for the area
+    '''
+    stamp = covid_store.series_stamp(location, location_type)
+    if stamp is None:
+        return None
+    key = (location, location_type)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    columns = {}
+    for metric in METRICS:
+        dates, columns[metric] = covid_store.read_range(location, location_type, metric)
+    length = min(len(values) for values in columns.values())
+    series = _build_series([date.fromordinal(d).isoformat() for d in dates[:length]],
+                           {metric: values[:length] for metric, values in columns.items()})
+    with _cache_lock:
+        _cache[key] = (stamp, series)
+    return series
+
+def _window_end(series: dict, metric: str) -> int:
+    '''Returns the (exclusive) end of windows of a metric - after the latest
+    row with a value, less any skipped rows. None if the metric has no values.'''
+    counts = series['counts'].get(metric)
+    if not counts or counts[-1] == 0:
+        return None
+    end = len(counts)-1
+    while counts[end] == counts[end-1]: # latest rows without a value
+        end -= 1
+    return max(end-SKIP_LATEST.get(metric, 0), 0)
+
+def window_total(series: dict, metric: str, days: int=WINDOW, offset: int=0) -> int:
+    '''Returns the total of a metric over a window of days.
+
+    Args:
+        series: as returned from series_from_rows
+        metric: metric to total
+        days: length of window
+        offset: days between the end of the window and the latest value
+
+    Returns:
+        Sum of the values in the window, or None if it has no values
+    '''
+    end = _window_end(series, metric)
+    if end is None or days <= 0:
+        return None
+    end = end-offset
+    start = max(end-days, 0)
+    if end <= 0 or series['counts'][metric][end] == series['counts'][metric][start]:
+        return None
+    return series['sums'][metric][end]-series['sums'][metric][start]
+
+def window_average(series: dict, metric: str, days: int=WINDOW, offset: int=0) -> float:
+    '''Returns the daily average of a metric over a window of days (of the days
+    with a value).
+
+    Args:
+        as window_total
+
+    Returns:
+        Average value, or None if the window has no values
+    '''
+    end = _window_end(series, metric)
+    if end is None or days <= 0:
+        return None
+    end = end-offset
+    start = max(end-days, 0)
+    counts = series['counts'][metric]
+    if end <= 0 or counts[end] == counts[start]:
+        return None
+    return (series['sums'][metric][end]-series['sums'][metric][start]) / \
+        (counts[end]-counts[start])
+
+def week_over_week(series: dict, metric: str) -> float:
+    '''Returns the change in a metric's 7 day total from the previous 7 days.
+
+    Args:
+        series: as returned from series_from_rows
+        metric: metric to compare
+
+    Returns:
+        Change as a percentage, or None if either week has no values (or the
+        previous week's total is zero)
+    '''
+    current = window_total(series, metric, 7)
+    previous = window_total(series, metric, 7, offset=7)
+    if current is None or not previous:
+        return None
+    return (current-previous)/previous*100
+
+def per_100k(value: float, population: int) -> float:
+    '''Converts a value to a rate per 100,000 people.
+
+    Args:
+        value: e.g. a 7 day case count
+        population: population of the area
+
+    Returns:
+        Rate per 100,000, or None if either is unknown
+    '''
+    if value is None or not population:
+        return None
+    return value*100_000/population
+
+def summarise(series: dict, days: int=WINDOW, population: int=None) -> dict:
+    '''Returns every stat of every metric in a series.
+
+    Args:
+        series: as returned from series_from_rows
+        days: length of the rolling window
+        population: population of the area, for rates per 100,000
+
+    Returns:
+        Dictionary of metric -> {latest_date, latest, total, average,
+        week_over_week, total_per_100k} (None for unknown stats)
+    '''
+    if not series:
+        return None
+    summary = {}
+    for metric in series['sums']:
+        end = _window_end(series, metric)
+        latest = None
+        if end is not None and end > 0:
+            latest = series['sums'][metric][end]-series['sums'][metric][end-1]
+        total = window_total(series, metric, days)
+        summary[metric] = {
+            'latest_date': series['dates'][end-1] if end else None,
+            'latest': latest,
+            'total': total,
+            'average': window_average(series, metric, days),
+            'week_over_week': week_over_week(series, metric),
+            'total_per_100k': per_100k(total, population)}
+    return summary
+
+def area_analytics(area: str=None, days: int=WINDOW) -> dict:
+    '''Returns the stats of a registered area (see area_registry), from its
+    stored series - so no api requests are made.
+
+    Args:
+        area: name or code of area, None for the main location
+        days: length of the rolling window
+
+    Returns:
+        Dictionary {area, area_type, nation, days, metrics (see summarise),
+        national (the same, for the area's nation)}, or None if the area is not
+        registered
+    '''
+    if area:
+        row = area_registry.find_area(area)
+    else:
+        rows = area_registry.load_areas()
+        row = rows[0] if rows else None
+    if row is None or not isinstance(days, int) or days <= 0:
+        return None
+    name, area_type, _, nation = area_registry.get_area(row)
+    population = area_registry.get_population(row)
+    national_row = area_registry.find_area(nation)
+    return {'area': name, 'area_type': area_type, 'nation': nation, 'days': days,
+            'metrics': summarise(series_from_store(name, area_type), days, population),
+            'national': summarise(series_from_store(nation, 'nation'), days,
+                                  area_registry.get_population(national_row))}
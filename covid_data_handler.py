@@ -6,37 +6,75 @@ Below is a summary of the functions defined within this module
 covid_data_handler
     .parse_csv_data()
         > extracts lines from a csv file
+    .parse_csv_columns()
+        > parses a csv file, in a single pass, into typed columns
+    .latest_value()
+        > returns the latest value in a csv column
+    .window_sum()
+        > sums the latest values in a csv column
+    .prefix_sums()
+        > calculates prefix sums (and counts of present values) of a csv column
+    .rolling_window_sums()
+        > calculates sums over every window of rows in a csv column
+    .process_covid_csv_columns()
+        > extracts the interface stats from csv columns
     .process_csv_data()
-        > used in conjunction with the above function to extract data from a static file
+        > used in conjunction with the above functions to extract data from a static file
+    .stream_csv_data()
+        > reads a csv file lazily, in batches of rows
+    .process_covid_csv_stream()
+        > extracts the interface stats from the above stream, stopping early
     .covid_API_request()
         > utilises the uk_covid19 module to request data
+    .covid_API_requests()
+        > requests data for several areas concurrently, using covid_API_request
     .get_stats_from_json()
         > extracts a specific metric from json returned from the above function
     .get_covid_stats()
         > utilises the previous function to get a set of metrics for the interface
+    .get_stored_covid_stats()
+        > calculates the same metrics from the stored history, without the api
+    .get_area_stats()
+        > fetches and calculates the stats of every configured area, in one pass
     .update_covid_data()
-        > updates a global data structure with the output of the previous function
-    .sched_covid_update_repeat()
-        > recursively schedules update_covid_data every 24 hours
+        > updates a global data structure with the output of get_covid_stats
+    .load_stored_covid_data()
+        > fills the same data structure from the stored history, on startup
     .schedule_covid_updates()
         > schedules update_covid_data after an interval
 '''
 
 ## imports
 import os
+import csv
 import logging
-import sched
-from time import time, sleep
-from json import load
-import uk_covid19 as uk
+from array import array
+from itertools import accumulate, chain, compress, islice, repeat
+from operator import sub
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import date, datetime, timedelta
+from time import time
+import threading
+import api_cache
+import area_registry
+import config_service
+import log_pipeline
+import covid_store
+import dashboard_state
+import metrics
+import update_scheduler
 
 ## logging setup
-FORMAT = '%(levelname)s @ %(name)s [%(asctime)s]: %(message)s'
 logger_cdh = logging.getLogger(__name__)
-with open('config.json','r') as config:
-    logging.basicConfig(filename=os.getcwd()+load(config)['log_file_path'],
-                        filemode='w',format=FORMAT,level=logging.INFO)
+log_pipeline.setup_logging() # queued, and written on a background thread
 
+metrics.describe('dashboard_csv_seconds', 'Time spent reading/processing csv data, by stage')
+metrics.describe('dashboard_upstream_call_seconds', 'Duration of api request functions '
+                 '(including cached responses)')
+metrics.describe('dashboard_update_seconds', 'Duration of stats/news updates')
+
+@metrics.timed('dashboard_csv_seconds', stage='read')
 def parse_csv_data(csv_filename: str) -> list:
     '''Returns list of strings for rows in the file.
 
@@ -50,8 +88,158 @@ def parse_csv_data(csv_filename: str) -> list:
         return
     if not os.path.exists(csv_filename):
         return
-    return [line.strip('\n') for line in open(csv_filename, 'r').readlines()]
+    with open(csv_filename, 'r') as csv_file:
+        return [line.rstrip('\n') for line in csv_file]
+
+CSV_CASES = 'newCasesBySpecimenDate'
+CSV_HOSPITAL_CASES = 'hospitalCases'
+CSV_DEATHS = 'cumDailyNsoDeathsByDeathDate'
+
+def _add_to_column(column: list, value: str) -> type(None):
+    '''Appends a csv field to a column, widening the column type if needed.
+
+    Args:
+        column: [values, present] pair, as stored by parse_csv_columns
+        value: raw csv field
+    '''
+    values, present = column
+    if value == '':
+        present.append(0)
+        values.append('' if isinstance(values, list) else 0)
+        return
+    present.append(1)
+    if isinstance(values, array):
+        try:
+            values.append(int(value) if values.typecode == 'q' else float(value))
+            return
+        except ValueError:
+            pass
+        try: # widen integer column to floats
+            column[0] = array('d', values)
+            column[0].append(float(value))
+        except ValueError: # widen numeric column to strings
+            column[0] = [str(v) if p else '' for v, p in zip(values, present)]
+            column[0].append(value)
+        return
+    values.append(value)
+
+@metrics.timed('dashboard_csv_seconds', stage='parse')
+def parse_csv_columns(covid_csv_data) -> dict:
+    '''Parses csv data, in a single pass, into typed columns keyed by header.
+
+    Integer columns are stored as array('q'), decimal columns as array('d') and
+    any other column as a list of strings. Missing values are stored as 0 (or an
+    empty string), and recorded in a mask.
+
+    Args:
+        covid_csv_data: filename of static csv file, or list of lines from the
+            file - as returned from parse_csv_data
+
+    Returns:
+        Dictionary mapping each header to a (values, present) pair, where
+        present[i] is 1 if row i has a value for the column, else 0
+    '''
+    if isinstance(covid_csv_data, str):
+        if not os.path.exists(covid_csv_data):
+            return
+        with open(covid_csv_data, 'r', newline='') as csv_file:
+            return parse_csv_columns(csv_file)
+    if isinstance(covid_csv_data, list) and len(covid_csv_data) == 0:
+        return
+    rows = csv.reader(covid_csv_data)
+    headers = next(rows, None)
+    if not headers:
+        return
+    columns = [[array('q'), bytearray()] for _ in headers]
+    for row in rows:
+        if not row:
+            continue
+        for column, value in zip(columns, chain(row, repeat(''))):
+            _add_to_column(column, value) # short rows are padded with empty fields
+    return {h: (c[0], c[1]) for h, c in zip(headers, columns)}
+
+def latest_value(column: tuple):
+    '''Returns the first present value in a column (i.e. the latest in the file).
+
+    Args:
+        column: (values, present) pair - as returned from parse_csv_columns
+
+    Returns:
+        The value, or None if the column has no values
+    '''
+    values, present = column
+    i = present.find(1)
+    return values[i] if i >= 0 else None
+
+def window_sum(column: tuple, window: int, skip: int=0) -> int:
+    '''Sums the latest present values in a column.
+
+    Args:
+        column: (values, present) pair - as returned from parse_csv_columns
+        window: number of present values to sum
+        skip: number of (latest) present values to ignore
+
+    Returns:
+        Sum of the values
+    '''
+    values, present = column
+    return sum(islice(compress(values, present), skip, skip+window))
+
+def prefix_sums(column: tuple) -> tuple[array, array]:
+    '''Calculates prefix sums of a numeric column, along with prefix counts of
+    its present values - so the sum (or count) of any window of rows is the
+    difference of two entries (see rolling_window_sums and covid_analytics).
+
+    Args:
+        column: (values, present) pair of a numeric column - as returned from
+            parse_csv_columns
+
+    Returns:
+        Arrays of prefix sums and prefix counts, each one longer than the column
+        (missing values count as 0)
+    '''
+    values, present = column
+    typecode = values.typecode if isinstance(values, array) else 'q'
+    sums = array(typecode, accumulate((v if p else 0 for v, p in zip(values, present)),
+                                      initial=0))
+    return sums, array('q', accumulate(present, initial=0))
+
+def rolling_window_sums(column: tuple, window: int) -> array:
+    '''Calculates the sum of every window of consecutive rows, using prefix sums.
+
+    Args:
+        column: (values, present) pair of a numeric column
+        window: number of rows in each window
+
+    Returns:
+        Array where entry i is the sum of rows i to i+window-1 (missing values
+        count as 0)
+    '''
+    prefix = prefix_sums(column)[0]
+    return array(prefix.typecode, map(sub, prefix[window:], prefix[:-window]))
+
+def process_covid_csv_columns(columns: dict) -> tuple[int, int, int]:
+    '''Extracts covid stats from csv columns.
+
+    Args:
+        columns: csv columns - as returned from parse_csv_columns
+
+    Returns:
+        Three metrics, as detailed in process_covid_csv_data
+    '''
+    if not isinstance(columns, dict):
+        return
+    for header in [CSV_CASES, CSV_HOSPITAL_CASES, CSV_DEATHS]:
+        if header not in columns:
+            return
+    # first non-empty case count is ignored as not accurate
+    last7days_cases_total = window_sum(columns[CSV_CASES], 7, 1)
+    current_hospital_cases = latest_value(columns[CSV_HOSPITAL_CASES])
+    total_deaths = latest_value(columns[CSV_DEATHS])
+    # cases for last 7 days, current hospital cases, cumulative death toll
+    return last7days_cases_total, current_hospital_cases, total_deaths
 
+@metrics.timed('dashboard_csv_seconds', stage='process')
 def process_covid_csv_data(covid_csv_data: list) -> tuple[int, int, int]:
     '''Extracts covid stats from csv format.
 
@@ -65,49 +253,222 @@ def process_covid_csv_data(covid_csv_data: list) -> tuple[int, int, int]:
         current_hospital_cases: Current hospital cases
         total_deaths: Latest death toll
     '''
-    if not isinstance(covid_csv_data,list):
+    if not isinstance(covid_csv_data,list) or len(covid_csv_data) == 0:
         return
-    if len(covid_csv_data) == 0:
+    rows = csv.DictReader(covid_csv_data, restval='')
+    if not {CSV_CASES, CSV_HOSPITAL_CASES, CSV_DEATHS} <= set(rows.fieldnames or ()):
         return
+    # only the latest rows are parsed, whole columns are parsed by parse_csv_columns
+    return _settle_covid_stats(rows)
+
+def stream_csv_data(csv_filename: str, batch_size: int=1000):
+    '''Reads a csv file lazily, yielding batches of parsed rows.
+
+    Only one batch is held in memory at a time, so memory use does not
+    depend on the size of the file.
+
+    Args:
+        csv_filename: Filename of static csv file
+        batch_size: number of rows in each batch
+
+    Yields:
+        Lists of (up to batch_size) rows, each a dictionary keyed by header
+    '''
+    if not isinstance(csv_filename,str) or not os.path.exists(csv_filename):
+        return
+    if batch_size < 1:
+        return
+    with open(csv_filename, 'r', newline='') as csv_file:
+        rows = csv.DictReader(csv_file, restval='')
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+def _settle_covid_stats(rows) -> tuple[int, int, int]:
+    '''Extracts covid stats from csv rows (dictionaries keyed by header, latest
+    first), stopping as soon as all three are settled.'''
     last7days_cases = []
-    i = 1
-    prev_empty = True
-    # get list of 7 latest daily case counts
-    # first non-zero is ignored as not accurate
-    while len(last7days_cases) < 7:
-        print(i)
-        daily_cases = covid_csv_data[i].split(',')[6]
-        if len(daily_cases) > 0:
-            if prev_empty:
-                prev_empty = False
+    skip = True # first non-empty case count is ignored as not accurate
+    current_hospital_cases, total_deaths = None, None
+    for row in rows:
+        if len(last7days_cases) < 7 and row.get(CSV_CASES):
+            if skip:
+                skip = False
             else:
-                last7days_cases.append(int(daily_cases))
-        i += 1
-    last7days_cases_total = sum(last7days_cases)
-    current_hospital_cases = ''
-    i = 1
-    # get first non-zero value for hospital case count
-    while current_hospital_cases == '':
-        current_hospital_cases = covid_csv_data[i].split(',')[5]
-        i += 1
-    current_hospital_cases = int(current_hospital_cases)
-    total_deaths = ''
-    i = 1
-    # get first non-zero value for total deaths to date
-    while total_deaths == '':
-        total_deaths = covid_csv_data[i].split(',')[4]
-        i += 1
-    total_deaths = int(total_deaths)
-     # cases for last 7 days, current hospital cases, cumulative death toll
-    return last7days_cases_total, current_hospital_cases, total_deaths
+                last7days_cases.append(int(row[CSV_CASES]))
+        if current_hospital_cases is None and row.get(CSV_HOSPITAL_CASES):
+            current_hospital_cases = int(row[CSV_HOSPITAL_CASES])
+        if total_deaths is None and row.get(CSV_DEATHS):
+            total_deaths = int(row[CSV_DEATHS])
+        if (len(last7days_cases) == 7 and current_hospital_cases is not None
+                and total_deaths is not None):
+            break
+    if not last7days_cases and current_hospital_cases is None and total_deaths is None:
+        return # no stats found
+    return sum(last7days_cases), current_hospital_cases, total_deaths
+
+@metrics.timed('dashboard_csv_seconds', stage='stream')
+def process_covid_csv_stream(batches) -> tuple[int, int, int]:
+    '''Extracts covid stats from a stream of csv row batches.
+
+    The stats are updated incrementally, and the stream is closed as soon as
+    all three are settled (rows are ordered latest first).
+
+    Args:
+        batches: iterable of row batches - as yielded from stream_csv_data
+
+    Returns:
+        Three metrics, as detailed in process_covid_csv_data
+    '''
+    stats = _settle_covid_stats(chain.from_iterable(batches))
+    if hasattr(batches, 'close'):
+        batches.close() # stops reading the file early
+    return stats
 
 # arguments will be stored in config file
-def covid_API_request(location: str=None, location_type: str=None) -> dict:
+OVERLAP_DAYS = 7 # stored days re-fetched by incremental requests, to pick up revisions
+COVID_TIMEOUT = (3.05, 30) # connect and read timeouts (seconds)
+# uk_covid19.Cov19API.endpoint, overridden by covid_api_url in config.json
+COVID_API_URL = 'https://api.coronavirus.data.gov.uk/v1/data'
+
+# pooled session, so connections to the covid api are kept alive between requests -
+# created on first use (see __getattr__), so requests is not imported on startup
+_covid_session = None
+_session_lock = threading.Lock()
+
+def _get_covid_session():
+    '''Returns the pooled session, creating it on first use.'''
+    global _covid_session
+    if _covid_session is None:
+        with _session_lock:
+            if _covid_session is None:
+                import requests
+                import api_transport
+                _covid_session = api_transport.mount(requests.Session(), 'covid')
+    return _covid_session
+
+def __getattr__(name: str):
+    '''Provides covid_session, which is only created when first used.'''
+    if name == 'covid_session':
+        return _get_covid_session()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _covid_API_pages(api: 'uk_covid19.Cov19API'):
+    '''Requests pages of data from the api (latest first), until none are left.
+
+    Args:
+        api: api object, providing the endpoint and request parameters
+
+    Yields:
+        Tuples of (rows, last modified header) for each page
+    '''
+    params = dict(api.api_params, format='json', page=1)
+    while True:
+        response = _get_covid_session().get(api.endpoint, params=params,
+                                            timeout=COVID_TIMEOUT)
+        response.raise_for_status()
+        if response.status_code == 204: # no content, past the final page
+            return
+        yield response.json()['data'], response.headers.get('Last-Modified')
+        params['page'] += 1
+
+def _covid_last_update(api: 'uk_covid19.Cov19API') -> str:
+    '''Requests the time of the latest update to an area's data (a HEAD
+    request, sent with the pooled session rather than by uk_covid19).
+
+    Returns:
+        Time of latest update, in the lastUpdate format used by uk_covid19
+    '''
+    response = _get_covid_session().head(api.endpoint, params=api.api_params,
+                                         timeout=COVID_TIMEOUT)
+    response.raise_for_status()
+    return _format_last_update(response.headers.get('Last-Modified'))
+
+def _format_last_update(last_modified: str) -> str:
+    '''Converts a Last-Modified header to the lastUpdate format used by uk_covid19.'''
+    if not last_modified:
+        return None
+    timestamp = datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S GMT')
+    return timestamp.isoformat()+'.000000Z'
+
+def _revised(location: str, location_type: str, rows: list, day: str) -> bool:
+    '''Checks if fetched rows for a date differ from the stored values.'''
+    fetched = [r for r in rows if r['date'] == day]
+    if not fetched:
+        return False
+    for metric in covid_store.METRICS:
+        values = covid_store.read_range(location, location_type, metric, day, day)[1]
+        if len(values) == 0:
+            return False
+        value = fetched[0].get(metric)
+        if values[0] != (covid_store.MISSING if value is None else value):
+            return True
+    return False
+
+def _fetch_covid_data(api: 'uk_covid19.Cov19API', location: str, location_type: str,
+                      incremental: bool=True) -> dict:
+    '''Fetches data for an area, merging it with the stored history.
+
+    Incremental fetches stop paginating once the rows reach OVERLAP_DAYS before
+    the latest stored date. The api cannot filter rows by date, so the first
+    page (about 1000 rows, the whole history of most areas) is always fetched -
+    only the pages after it are saved. The overlapping rows replace the stored
+    rows (so recent revisions are picked up), unless the oldest overlapping row
+    has also been revised, in which case the full history is fetched.
+
+    Args:
+        api: api object for the area
+        location: area name
+        location_type: area type
+        incremental: flag for stopping once the rows reach the stored history
+
+    Returns:
+        Dictionary in the format returned from covid_API_request
+    '''
+    since = covid_store.last_date(location, location_type) if incremental else None
+    overlap_from = None
+    if since:
+        overlap_from = (date.fromisoformat(since)-timedelta(OVERLAP_DAYS)).isoformat()
+    rows, last_modified, pages = [], None, 0
+    for page, page_modified in _covid_API_pages(api):
+        rows.extend(page)
+        last_modified = last_modified or page_modified
+        pages += 1
+        if overlap_from and page and page[-1]['date'] <= overlap_from:
+            break # remaining pages are already stored
+    if not rows and since: # nothing returned, so the stored history is used
+        logger_cdh.warning('no rows returned from covid API [area=%s]', location)
+        rows = covid_store.read_rows(location, location_type)
+        return {'data': rows, 'lastUpdate': _format_last_update(last_modified),
+                'length': len(rows), 'totalPages': pages}
+    if overlap_from and rows and rows[-1]['date'] <= overlap_from:
+        if _revised(location, location_type, rows, overlap_from):
+            logger_cdh.warning('history revised, full fetch [area=%s]', location)
+            return _fetch_covid_data(api, location, location_type, False)
+        covid_store.truncate_from(location, location_type, overlap_from)
+        covid_store.append_rows(location, location_type,
+                                [r for r in rows if r['date'] >= overlap_from])
+        logger_cdh.info('incremental covid API request [%d rows]', len(rows))
+        rows = covid_store.read_rows(location, location_type)
+    else: # full history fetched, replaces anything stored
+        covid_store.clear_area(location, location_type)
+        covid_store.append_rows(location, location_type, rows)
+        logger_cdh.info('full covid API request [%d rows]', len(rows))
+    return {'data': rows, 'lastUpdate': _format_last_update(last_modified),
+            'length': len(rows), 'totalPages': pages}
+
+@metrics.timed('dashboard_upstream_call_seconds', call='covid_API_request')
+def covid_API_request(location: str=None, location_type: str=None,
+                      incremental: bool=True) -> dict:
     '''Returns a json containing the set of metrics.
 
     Args:
         location: Area code for api request
         location_type: Area type for api request
+        incremental: flag for stopping once the rows reach the stored history
+            (see _fetch_covid_data)
 
     Returns:
         A dictionary containing the metrics specified in the metrics[dict] variable.
@@ -123,18 +484,14 @@ def covid_API_request(location: str=None, location_type: str=None) -> dict:
                 hospitalCases[int]: hospital cases
             }
             lastUpdate[str]: time of latest entry, %format YYYY-MM-DDtime
-            length[int]: number of entries fetched from api
+            length[int]: number of entries (fetched and stored)
             totalPages[int]: number of pages fetched from api
         }
     '''
-    with open('config.json','r') as config:
-        config_json = load(config)
-        if not location:
-            location = config_json['location']
-            logger_cdh.info('location fetched from config file')
-        if not location_type:
-            location_type = config_json['location_type']
-            logger_cdh.info('location_type fetched from config file')
+    if not location:
+        location = config_service.get('location')
+    if not location_type:
+        location_type = config_service.get('location_type')
     if not (isinstance(location,str) or isinstance(location_type,str)):
         return
     area = ['areaType='+location_type, 'areaName='+location]
@@ -146,11 +503,64 @@ def covid_API_request(location: str=None, location_type: str=None) -> dict:
         'cumDeaths28DaysByPublishDate': 'cumDeaths28DaysByPublishDate',
         'hospitalCases':'hospitalCases'
         }
+    key = ('covid', location_type, location, tuple(metrics))
+    data = api_cache.cache_get(key)
+    if data is not None:
+        logger_cdh.info('covid API request served from cache')
+        return data
+    import uk_covid19 as uk # imported on first request, rather than on startup
     api = uk.Cov19API(filters=area, structure=metrics)
-    data = api.get_json()
+    api.endpoint = config_service.get('covid_api_url', COVID_API_URL)
+    cached = api_cache.cache_lookup(key)
+    if cached is not None:
+        # expired entry, revalidated with a HEAD request against its lastUpdate
+        if _covid_last_update(api) == cached['last_modified']:
+            logger_cdh.info('covid API request revalidated')
+            return api_cache.cache_refresh(key) or cached['value']
+    data = _fetch_covid_data(api, location, location_type, incremental)
     logger_cdh.info('covid API request')
+    api_cache.cache_put(key, data, last_modified=data.get('lastUpdate'))
     return data # dictionary of covid data fetched from api
 
+API_TIMEOUT = 30 # time limit (seconds) for each area in covid_API_requests
+API_WORKERS = 32 # most concurrent requests, shared by all calls to covid_API_requests
+
+# created once, so each update does not start (and stop) its own threads
+_api_pool = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='covid-api')
+
+def covid_API_requests(areas: list, timeout: float=API_TIMEOUT) -> dict:
+    '''Requests data for several areas at once, using a (shared) thread pool.
+
+    Args:
+        areas: list of (location, location_type) pairs
+        timeout: time limit (seconds) for each area's request, None for no limit
+
+    Returns:
+        A dictionary mapping each (location, location_type) pair to the json
+        returned from covid_API_request. Areas which fail or time out map to None,
+        so one failed area does not affect the others.
+    '''
+    if not isinstance(areas, list) or len(areas) == 0:
+        return
+    areas = list(dict.fromkeys(tuple(a) for a in areas)) # removes duplicates
+    futures = {area: _api_pool.submit(covid_API_request, *area) for area in areas}
+    deadline = time() + timeout if timeout else None
+    out = {}
+    for area, future in futures.items():
+        try:
+            remaining = max(deadline - time(), 0) if deadline else None
+            out[area] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            out[area] = None
+            future.cancel() # timed out requests are abandoned (cancelled, if not started)
+            logger_cdh.warning('covid API request timed out [area=%s]', area)
+        except Exception:
+            out[area] = None
+            logger_cdh.exception('covid API request failed [area=%s]', area)
+    logger_cdh.info('%d/%d concurrent covid API requests complete',
+                    sum(v is not None for v in out.values()), len(areas))
+    return out
+
 ## extra functions ----------------------------------------
 
 def get_stats_from_json(covid_stats_json: dict, metric: str, count: int=1,
@@ -185,11 +595,33 @@ def get_stats_from_json(covid_stats_json: dict, metric: str, count: int=1,
             break
     return covid_stats_list[0]['areaName'], sum(data)
 
+def _covid_stats(local: tuple, national: tuple, api_local: dict,
+                 api_nation: dict) -> tuple[str, int, str, int, int, int]:
+    '''Extracts the interface stats from the data of the local and national areas.'''
+    area, last7days_cases_local = local[0], None
+    if api_local:
+        area, last7days_cases_local = get_stats_from_json(api_local,
+                                                          'newCasesByPublishDate',
+                                                          7, True)
+    nation, last7days_cases_nation = national[0], None
+    hospital_cases, total_deaths = None, None
+    if api_nation:
+        nation, last7days_cases_nation = get_stats_from_json(api_nation,
+                                                             'newCasesByPublishDate',
+                                                             7, True)
+        hospital_cases = get_stats_from_json(api_nation, 'hospitalCases')[1]
+        total_deaths = get_stats_from_json(api_nation,
+                                           'cumDeaths28DaysByPublishDate')[1]
+    out = (area, last7days_cases_local, nation,
+           last7days_cases_nation, hospital_cases, total_deaths)
+    return out
+
 def get_covid_stats() -> tuple[str, int, str, int, int, int]:
     '''Fetches relevant statistics to be displayed in the interface.
 
     Returns:
         Area codes (local and national), along with 4 statistics.
+        Statistics for an area whose request failed are None.
         Detailed below.
         
         area: local area code - stored in config.json
@@ -199,63 +631,151 @@ def get_covid_stats() -> tuple[str, int, str, int, int, int]:
         hospital_cases: current hospital cases
         total_deaths: cumulative death toll
     '''
-    api_local = covid_API_request()
-    api_nation = covid_API_request('England','nation')
+    local = (config_service.get('location'), config_service.get('location_type'))
+    national = (config_service.get('nation', area_registry.DEFAULT_NATION), 'nation')
+    responses = covid_API_requests([local, national]) # fetched concurrently
     logger_cdh.info('api requests complete')
-    area, last7days_cases_local = get_stats_from_json(api_local,
-                                                      'newCasesByPublishDate',
-                                                      7, True)
-    nation, last7days_cases_nation = get_stats_from_json(api_nation,
-                                                         'newCasesByPublishDate',
-                                                         7, True)
-    hospital_cases = get_stats_from_json(api_nation, 'hospitalCases')[1]
-    total_deaths = get_stats_from_json(api_nation,
-                                       'cumDeaths28DaysByPublishDate')[1]
-    out = (area, last7days_cases_local, nation,
-           last7days_cases_nation, hospital_cases, total_deaths)
-    return out
+    return _covid_stats(local, national, responses[local], responses[national])
+
+def get_stored_covid_stats() -> tuple[str, int, str, int, int, int]:
+    '''Calculates the interface stats from the history stored by previous
+    runs (see covid_store), without any api requests.
+
+    Returns:
+        As get_covid_stats, or None if no history is stored
+    '''
+    local = (config_service.get('location'), config_service.get('location_type'))
+    national = (config_service.get('nation', area_registry.DEFAULT_NATION), 'nation')
+    stored = {}
+    for area in (local, national):
+        if not all(isinstance(value, str) for value in area):
+            continue
+        rows = covid_store.read_rows(*area)
+        if rows:
+            stored[area] = {'data': rows, 'length': len(rows)}
+    if not stored:
+        return None
+    return _covid_stats(local, national, stored.get(local), stored.get(national))
+
+AREA_BATCH = 32 # areas requested at once by get_area_stats, bounding the data held
 
-global covid_data, covid_data_sch
+def get_area_stats(rows: list=None) -> tuple:
+    '''Fetches and calculates the stats of many areas (see area_registry) in
+    one pass. The data of each nation is requested once, and shared by all of
+    its areas; local areas are requested concurrently in batches, and only their
+    7 day case counts are kept.
+
+    Args:
+        rows: rows of the areas to be refreshed, defaults to the configured areas
+            (see area_registry.load_areas)
+
+    Returns:
+        Stats table of every registered area (see area_registry.build_table) -
+        areas not refreshed, or whose request failed, have unknown stats
+    '''
+    if rows is None:
+        rows = area_registry.load_areas()
+    areas = {row: area_registry.get_area(row) for row in rows}
+    nations = list(dict.fromkeys(area[3] for area in areas.values()))
+    local_rows = {} # (location, location_type) -> rows
+    for row, area in areas.items():
+        local_rows.setdefault(area[:2], []).append(row)
+    # nations first, then local areas (a nation's data is only requested once)
+    keys = list(dict.fromkeys([(nation, 'nation') for nation in nations]+list(local_rows)))
+    nation_stats, local_cases = {}, {}
+    for i in range(0, len(keys), AREA_BATCH):
+        responses = covid_API_requests(keys[i:i+AREA_BATCH])
+        for key, data in responses.items():
+            if not data:
+                continue
+            if key[1] == 'nation':
+                nation_stats[key[0]] = _covid_stats(key, key, None, data)[3:]
+                cases = nation_stats[key[0]][0]
+            else:
+                cases = get_stats_from_json(data, 'newCasesByPublishDate', 7, True)[1]
+            for row in local_rows.get(key, ()):
+                local_cases[row] = cases
+    logger_cdh.info('area stats calculated [%d areas, %d nations]', len(areas), len(nations))
+    return area_registry.build_table(local_cases, nation_stats)
+
+def _keep_known_stats(stats: tuple, previous: tuple) -> tuple:
+    '''Fills the unknown stats (e.g. of a failed request) from the previously
+    published stats of the same areas.
+
+    Returns:
+        Stats, in the format of get_covid_stats - or None if none are known
+    '''
+    if not stats:
+        return None
+    if previous and (stats[0], stats[2]) == (previous[0], previous[2]):
+        stats = tuple(previous[i] if stat is None else stat for i, stat in enumerate(stats))
+    if all(stats[i] is None for i in (1, 3, 4, 5)):
+        return None
+    return stats
+
+global covid_data
 covid_data = []
-covid_data_sch = {}
 logger_cdh.info('covid data globals initialized')
 
+@metrics.timed('dashboard_update_seconds', update='covid_data')
 def update_covid_data() -> type(None):
-    '''Updates the covid_data data structure (global) with the latest stats.'''
+    '''Updates the covid_data data structure (global) with the latest stats,
+    along with the stats of every configured area (see get_area_stats).'''
     global covid_data
-    covid_data = get_covid_stats()
+    rows = area_registry.load_areas()
+    # fetched before taking the lock, which is only held to publish
+    table = get_area_stats(rows)
+    stats = None if rows else get_covid_stats()
+    with dashboard_state.key_lock('covid_data'):
+        # stats whose request failed keep their last known values
+        table = area_registry.merge_tables(table, dashboard_state.get_value('area_stats'))
+        if table is not None:
+            dashboard_state.publish('area_stats', table)
+        if rows:
+            stats = area_registry.table_stats(table, rows[0])
+        stats = _keep_known_stats(stats, dashboard_state.get_value('covid_data'))
+        if stats is None:
+            logger_cdh.warning('covid stats update failed, keeping the last stats')
+            return
+        covid_data = stats
+        dashboard_state.publish('covid_data', covid_data)
     logger_cdh.info('covid stats updated [covid_data=%s]', covid_data)
 
-def sched_covid_update_repeat(sch: sched.scheduler) -> type(None):
-    '''Uses recursion to implement 24 hour repeating updates.
+def load_stored_covid_data() -> bool:
+    '''Fills the covid_data data structure (global) from the stored history,
+    if it has not yet been updated - so stats can be shown on startup, before
+    the first api requests complete.
 
-    Args:
-        sch: associated scheduler
+    Returns:
+        True if stored stats were loaded
     '''
-    if not isinstance(sch, sched.scheduler):
-        return
-    sch.enter(24*60*60, 1, update_covid_data)
-    sch.enter(24*60*60, 2, sched_covid_update_repeat, argument=(sch,))
-    logger_cdh.info('repeat update scheduled')
+    global covid_data
+    with dashboard_state.key_lock('covid_data'):
+        if dashboard_state.get_value('covid_data'):
+            return False # already updated (or shared by another process)
+        stats = get_stored_covid_stats()
+        if stats is None:
+            return False
+        covid_data = stats
+        dashboard_state.publish('covid_data', covid_data)
+    logger_cdh.info('stored covid stats loaded [covid_data=%s]', covid_data)
+    return True
 
 def schedule_covid_updates(update_interval: float, update_name: str,
                            repeating: bool=False) -> type(None):
-    '''Creates scheduler (stored in covid_data_sch) and schedules news updates.
+    '''Schedules update_covid_data (see update_scheduler) after an interval.
 
     Args:
         update_interval: delay of (initial) scheduled update
-        update_name: label of update in interface - index of scheduler in covid_data_sch
+        update_name: label of update in interface
         repeating: flag for repeating updates (every 24 hours)
     '''
     if not (update_interval > 0 or isinstance(update_name,str)):
         return
-    global covid_data_sch
-    s = sched.scheduler(time, sleep)
-    s.enter(update_interval, 1, update_covid_data)
-    if repeating: # will schedule a repeating update in after the interval
-        s.enter(update_interval, 2, sched_covid_update_repeat, argument=(s,))
-        logger_cdh.info('repeat update scheduled')
-    covid_data_sch[update_name] = s
+    update_scheduler.schedule(update_name, 'covid_data', update_interval, repeating)
+
+# scheduled updates due at (about) the same time share a single update
+update_scheduler.register_target('covid_data', update_covid_data)
 
 if __name__=='__main__':
     print(get_covid_stats()) # current covid stats
@@ -4,43 +4,151 @@ stories and scheduling these news updates.
 Below is a summary of the functions defined within this module
 
 covid_news_handling
+    .news_get()
+        > sends a request using the pooled session, retrying with backoff
     .news_API_request()
         > utilises the requests module to request news stories
+    .article_id()
+        > generates an identifier for an article, from its normalised url
+    .load_dismissed_articles()
+        > loads the index of dismissed articles from file
+    .save_dismissed_articles()
+        > writes the index of dismissed articles to file
+    .flush_dismissed_articles()
+        > writes any dismissals still waiting to be saved
+    .expire_dismissed_articles()
+        > removes expired entries from the index of dismissed articles
     .format_news_article()
         > injects article information into a format compatible with the interface
-    .remove_title()
+    .remove_article()
         > marks an article as "seen"
+    .remove_title()
+        > marks a displayed article as "seen", by its title
     .purge_articles()
-        > calls remove_title on all currently displayed articles
+        > calls remove_article on all currently displayed articles
     .update_news()
         > updates a global data structure with (formatted) news articles
-    .sched_news_update_repeat()
-        > recursively schedules update_news every 24 hours
     .schedule_news_updates()
         > schedules update_news after an interval
 '''
 
 import os
+import atexit
 import logging
-import sched
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from hashlib import sha1
+from urllib.parse import urlsplit, urlunsplit
 from time import time, sleep
-from json import load
-import requests
-from flask import Markup
+from json import load, dump
+from markupsafe import Markup # as flask.Markup, without importing flask
+import api_cache
+import config_service
+import log_pipeline
+import dashboard_state
+import metrics
+import update_scheduler
 
 ## logging setup
-FORMAT = '%(levelname)s @ %(name)s [%(asctime)s]: %(message)s'
 logger_cnh = logging.getLogger(__name__)
-with open('config.json','r') as config:
-    logging.basicConfig(filename=os.getcwd()+load(config)['log_file_path'],
-                        filemode='w',format=FORMAT,level=logging.INFO)
+log_pipeline.setup_logging() # queued, and written on a background thread
+
+NEWS_API_URL = 'https://newsapi.org/v2/everything' # overridden by news_api_url in config.json
+NEWS_PAGE_BLOCK = 20 # granularity of page sizes requested from the news api
+NEWS_TIMEOUT = (3.05, 10) # connect and read timeouts (seconds)
+NEWS_RETRIES = 3 # retries after the initial attempt
+NEWS_BACKOFF = 0.5 # base delay (seconds) of exponential backoff
+NEWS_BACKOFF_MAX = 30 # longest delay (seconds) between attempts
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# pooled session, so connections to the news api are kept alive between requests -
+# created on first use (see __getattr__), so requests is not imported on startup
+_news_session = None
+_session_lock = threading.Lock()
 
-def news_API_request(covid_terms: str=None,page_size: int=20) -> dict:
+def _get_news_session():
+    '''Returns the pooled session, creating it on first use.'''
+    global _news_session
+    if _news_session is None:
+        with _session_lock:
+            if _news_session is None:
+                import requests
+                import api_transport
+                _news_session = api_transport.mount(requests.Session(), 'news')
+    return _news_session
+
+def __getattr__(name: str):
+    '''Provides news_session, which is only created when first used.'''
+    if name == 'news_session':
+        return _get_news_session()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _retry_delay(attempt: int, response: 'requests.Response'=None) -> float:
+    '''Calculates the delay before the next attempt.
+
+    Args:
+        attempt: number of attempts made so far
+        response: failed response, checked for a Retry-After header
+
+    Returns:
+        Delay (seconds) - the Retry-After value if given, otherwise jittered
+        exponential backoff
+    '''
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), NEWS_BACKOFF_MAX)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time()
+                return min(max(delay, 0), NEWS_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(NEWS_BACKOFF*2**attempt, NEWS_BACKOFF_MAX))
+
+def news_get(params: dict, headers: dict=None) -> 'requests.Response':
+    '''Sends a GET request to the news api, retrying failed attempts.
+
+    Attempts which time out, fail to connect or return a status in
+    RETRY_STATUSES are retried (up to NEWS_RETRIES times) after a delay.
+
+    Args:
+        params: query parameters (encoded by requests)
+        headers: extra request headers
+
+    Returns:
+        The final response received
+    '''
+    session = _get_news_session()
+    import requests # already imported when the session was created
+    for attempt in range(NEWS_RETRIES+1):
+        try:
+            response = session.get(config_service.get('news_api_url', NEWS_API_URL),
+                                   params=params,
+                                   headers=headers, timeout=NEWS_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == NEWS_RETRIES:
+                raise
+            logger_cnh.warning('news API request failed, retrying')
+            metrics.inc('dashboard_upstream_retries_total', api='news')
+            sleep(_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or attempt == NEWS_RETRIES:
+            return response
+        logger_cnh.warning('news API returned %d, retrying', response.status_code)
+        metrics.inc('dashboard_upstream_retries_total', api='news')
+        sleep(_retry_delay(attempt, response))
+
+@metrics.timed('dashboard_upstream_call_seconds', call='news_API_request')
+def news_API_request(covid_terms: str=None,page_size: int=20,page: int=1) -> dict:
     '''Fetches covid-related news stories from the news api.
 
     Args:
         covid_terms: search terms for api request
         page_size: number of articles fetched from api
+        page: page of results to fetch (pages hold page_size articles, rounded
+            up to a multiple of NEWS_PAGE_BLOCK)
 
     Returns:
         A dictionary containing news articles returned from the api.
@@ -72,27 +180,136 @@ def news_API_request(covid_terms: str=None,page_size: int=20) -> dict:
             message[str]: error description
         }
     '''
-    with open('config.json','r') as config:
-        config_json = load(config)
-        if not covid_terms:
-            covid_terms = config_json['news_search_terms']
-        _APIkey = config_json['api_keys']['news_api'] # get api key from config.json
-        logger_cnh.info('API key fetched from config file')
+    if not covid_terms:
+        covid_terms = config_service.get('news_search_terms')
+    _APIkey = config_service.get('api_keys', {}).get('news_api') # from config.json
     if not isinstance(covid_terms,str) or _APIkey=='[api-key]':
         return
-    keywords = covid_terms.split(' ')
-    url = 'https://newsapi.org/v2/everything?q='+'+OR+'.join(keywords)
-    url +='&pageSize='+str(page_size)+'&apiKey='+_APIkey
-    response = requests.get(url, auth=('user','pass')) # request related stories from newsAPI
-    logger_cnh.info('news API request [url=%s]',url)
-    return response.json()
-
-global covid_news, removed_titles, covid_news_sch
+    # page sizes are rounded up, so nearby sizes share a cached response
+    fetch_size = -(-page_size//NEWS_PAGE_BLOCK)*NEWS_PAGE_BLOCK
+    key = ('news', covid_terms, fetch_size, page)
+    data = api_cache.cache_get(key)
+    if data is None:
+        keywords = covid_terms.split(' ')
+        params = {'q': ' OR '.join(keywords), 'pageSize': fetch_size, 'page': page}
+        headers = {'X-Api-Key': _APIkey}
+        cached = api_cache.cache_lookup(key)
+        if cached is not None: # conditional request, to revalidate expired entry
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = news_get(params, headers) # request related stories from newsAPI
+        logger_cnh.info('news API request [params=%s]',params)
+        if response.status_code == 304 and cached is not None:
+            data = api_cache.cache_refresh(key) or cached['value']
+            logger_cnh.info('news API response not modified')
+        else:
+            data = response.json()
+            if data.get('status') == 'ok': # errors are not cached
+                api_cache.cache_put(key, data, etag=response.headers.get('ETag'),
+                                    last_modified=response.headers.get('Last-Modified'))
+    else:
+        logger_cnh.info('news API request served from cache')
+    if 'articles' in data and len(data['articles']) > page_size:
+        data = dict(data, articles=data['articles'][:page_size])
+    return data
+
+DISMISSAL_TTL = 7*24*60*60 # time (seconds) dismissed articles stay hidden
+MAX_NEWS_PAGES = 5 # most pages fetched when looking for unseen articles
+
+global covid_news, dismissed_articles
 covid_news = []
-removed_titles = []
-covid_news_sch = {}
+dismissed_articles = {} # article id -> time dismissed
+_dismissed_lock = threading.Lock() # held while modifying dismissed_articles
+SAVE_DELAY = 5 # dismissals within this time (seconds) are saved in a single write
+_save_timer = None # pending write of dismissed articles, see _queue_save
+_save_lock = threading.Lock()
+# optional file, so dismissed articles stay hidden after a restart
+dismissed_path = config_service.get('dismissed_articles_path')
 logger_cnh.info('covid news globals initialized')
 
+def article_id(url: str) -> str:
+    '''Generates an identifier for an article, from its normalised url.
+
+    Args:
+        url: link to article
+
+    Returns:
+        Hex digest of the url, ignoring case of the host, any fragment and
+        any trailing slash
+    '''
+    if not isinstance(url,str):
+        return
+    parts = urlsplit(url.strip())
+    normalised = urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                             parts.path.rstrip('/'), parts.query, ''))
+    return sha1(normalised.encode()).hexdigest()
+
+def load_dismissed_articles() -> type(None):
+    '''Loads dismissed articles from dismissed_path (if set), ignoring expired ones.'''
+    global dismissed_articles
+    if not dismissed_path or not os.path.exists(dismissed_path):
+        return
+    try:
+        with open(dismissed_path,'r') as dismissed_file:
+            loaded = load(dismissed_file)
+    except (OSError, ValueError):
+        logger_cnh.exception('dismissed articles file could not be read')
+        return
+    cutoff = time()-DISMISSAL_TTL
+    with _dismissed_lock:
+        dismissed_articles = {a: t for a, t in loaded.items() if t > cutoff}
+    logger_cnh.info('%d dismissed articles loaded', len(dismissed_articles))
+
+def save_dismissed_articles() -> type(None):
+    '''Writes dismissed articles to dismissed_path (if set), replacing it atomically.'''
+    if not dismissed_path:
+        return
+    with _dismissed_lock:
+        with open(dismissed_path+'.tmp','w') as dismissed_file:
+            dump(dismissed_articles, dismissed_file)
+        os.replace(dismissed_path+'.tmp', dismissed_path)
+
+def _queue_save() -> type(None):
+    '''Saves dismissed articles on a timer thread after SAVE_DELAY (unless a
+    write is already pending), so dismissals do not wait for the file.'''
+    global _save_timer
+    if not dismissed_path:
+        return
+    with _save_lock:
+        if _save_timer is not None:
+            return # picked up by the pending write
+        _save_timer = threading.Timer(SAVE_DELAY, flush_dismissed_articles)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+def flush_dismissed_articles() -> type(None):
+    '''Writes dismissed articles now, if a write is pending (called on exit).'''
+    global _save_timer
+    with _save_lock:
+        if _save_timer is None:
+            return
+        _save_timer.cancel() # no-op if called by the timer itself
+        _save_timer = None
+    save_dismissed_articles()
+
+atexit.register(flush_dismissed_articles)
+
+def expire_dismissed_articles() -> type(None):
+    '''Removes dismissals older than DISMISSAL_TTL, so the index does not grow forever.'''
+    global dismissed_articles
+    cutoff = time()-DISMISSAL_TTL
+    with _dismissed_lock:
+        kept = {a: t for a, t in dismissed_articles.items() if t > cutoff}
+        if len(kept) == len(dismissed_articles):
+            return
+        dismissed_articles = kept
+    logger_cnh.info('expired dismissals removed')
+    _queue_save()
+
+load_dismissed_articles()
+
 def format_news_article(article_json: dict) -> dict:
     '''Formats news article into a dictionary which can be input into the flask template.
 
@@ -104,6 +321,7 @@ def format_news_article(article_json: dict) -> dict:
         The format of the returned dictionary, along with types, it detailed below.
 
         {
+            id[str]: identifier of article, see article_id
             title[str]: title of article
             content[str]: short description and ling (formatted with flask.Markup)
         }
@@ -117,90 +335,113 @@ def format_news_article(article_json: dict) -> dict:
         return
     url=article_json['url']
     source=article_json['source']['name']
-    return {'title':article_json['title'],
+    return {'id':article_id(url),'title':article_json['title'],
             'content':Markup(article_json['description']+
             f'<a href=\"{url}\">{source}</a>')}
 
-def remove_title(title: str) -> type(None):
-    '''Adds article to (global) list of removed articles,
+def remove_article(identifier: str) -> type(None):
+    '''Adds article to (global) index of dismissed articles,
     so it is not redisplayed when the interface is updated.
 
     Args:
-        title: title of article to be removed
+        identifier: id of article to be removed (or its title, if currently displayed)
     '''
-    if not isinstance(title,str):
+    if not isinstance(identifier,str):
         return
-    global removed_titles
-    if title not in removed_titles:
-        removed_titles.append(title)
-        logger_cnh.info('news story removed')
+    for a in covid_news: # titles are matched to the ids of displayed articles
+        if identifier == a['title']:
+            identifier = a['id']
+            break
+    with _dismissed_lock:
+        if identifier in dismissed_articles:
+            return
+        dismissed_articles[identifier] = time()
+    logger_cnh.info('news story removed')
+    _queue_save() # written in the background, batched with other dismissals
+
+def remove_title(title: str) -> type(None):
+    '''Marks a displayed article as seen, by its title (see remove_article).
+
+    Args:
+        title: title of article to be removed
+    '''
+    remove_article(title)
 
 def purge_articles() -> type(None):
     '''Removes all currently displayed articles (i.e. marked as seen, not redisplayed).'''
     for a in covid_news:
-        remove_title(a['title'])
+        remove_article(a['id'])
 
+@metrics.timed('dashboard_update_seconds', update='news')
 def update_news(covid_terms: str=None, article_count: int=10,
                 sch: bool=True) -> type(None):
     '''Updates the covid_news data structure (global) with the latest articles.
+    If a request fails (or no api key is set), the articles displayed are kept.
 
     Args:
         covid_terms: search terms for news_api request - stored in config.json
         article_count: number of articles to be displayed in the interface
         sch: flag for scheduled (over intermittent) updates
     '''
-    with open('config.json','r') as config:
-        if not covid_terms:
-            covid_terms = load(config)['news_search_terms']
+    if not covid_terms:
+        covid_terms = config_service.get('news_search_terms')
     if not isinstance(covid_terms,str):
         return
     global covid_news
-    if sch:
-        purge_articles()
-    api = news_API_request(covid_terms,article_count+len(removed_titles))['articles']
-    covid_news = []
-    i = 0
-    while len(covid_news) < article_count:
-        if i >= len(api):
+    with dashboard_state.key_lock('covid_news'): # one update at a time
+        expire_dismissed_articles()
+        dismissed = set(dismissed_articles)
+        if sch: # displayed articles are only dismissed once the update succeeds
+            dismissed.update(a['id'] for a in covid_news)
+        # fetch size does not depend on the number of dismissed articles,
+        # further pages are only requested if too many have been dismissed
+        page_size = -(-article_count//NEWS_PAGE_BLOCK)*NEWS_PAGE_BLOCK
+        news = [] # built separately, so readers never see a partial list
+        for page in range(1, MAX_NEWS_PAGES+1):
+            data = news_API_request(covid_terms,page_size,page)
+            # errors (e.g. rate limited) keep the news already displayed
+            if data is None:
+                logger_cnh.error('news API key not set, news not updated')
+                return
+            if data.get('status') != 'ok':
+                logger_cnh.error('news API request failed, news not updated [code=%s, message=%s]',
+                                 data.get('code'), data.get('message'))
+                return
+            api = data.get('articles', [])
+            for article in api:
+                formatted = format_news_article(article)
+                if formatted and formatted['id'] not in dismissed:
+                    news.append(formatted)
+                    if len(news) == article_count:
+                        break
+            if len(news) == article_count or len(api) < page_size:
+                break
+        else:
+            logger_cnh.warning('unseen articles not found within %d pages', MAX_NEWS_PAGES)
+        if len(news) < article_count:
             logger_cnh.warning('articles list exhasted')
-            break
-        if api[i]['title'] not in removed_titles:
-            covid_news.append(format_news_article(api[i]))
-        i += 1
+        if sch:
+            purge_articles()
+        covid_news = news
+        dashboard_state.publish('covid_news', tuple(news))
     logger_cnh.info('covid news updated')
 
-def sched_news_update_repeat(sch: sched.scheduler) -> type(None):
-    '''Uses recursion to implement 24 hour repeating updates.
-
-    Args:
-        sch: associated scheduler
-    '''
-    if not isinstance(sch, sched.scheduler):
-        return
-    sch.enter(24*60*60, 1, update_news)
-    sch.enter(24*60*60, 2, sched_news_update_repeat, argument=(sch,))
-    logger_cnh.info('repeat update scheduled')
-
 def schedule_news_updates(update_interval: float, update_name: str,
                           repeating: bool=False) -> type(None):
-    '''Creates scheduler (stored in covid_news_sch) and schedules news updates.
+    '''Schedules update_news (see update_scheduler) after an interval.
 
     Args:
         update_interval: delay of (initial) scheduled update
-        update_name: label of update in interface, index of scheduler in covid_news_sch
+        update_name: label of update in interface
         repeating: flag for repeating updates (every 24 hours)
     '''
     if not (update_interval > 0 or isinstance(update_name,str)):
         return
-    global covid_news_sch
-    s = sched.scheduler(time, sleep)
-    s.enter(update_interval, 1, update_news)
-    if repeating: # will schedule a repeating update in after the interval
-        s.enter(update_interval, 2, sched_news_update_repeat, argument=(s,))
-        logger_cnh.info('repeat update scheduled')
-    covid_news_sch[update_name] = s
+    update_scheduler.schedule(update_name, 'news', update_interval, repeating)
+
+# scheduled updates due at (about) the same time share a single update
+update_scheduler.register_target('news', update_news)
 
 if __name__=='__main__':
-    with open('config.json','r') as config:
-        api = news_API_request(load(config)['news_search_terms'])
-        print(api['articles'][0]) # first article
+    api = news_API_request(config_service.get('news_search_terms'))
+    print(api['articles'][0]) # first article
@@ -0,0 +1,283 @@
+'''This module handles: storing fetched covid metrics on disk, as an append-only
+time series for each area, so history can be read without the api.
+
+Each area has a directory (within STORE_DIR) holding fixed-width binary
+columns: dates.bin (int32 day ordinals, ascending) and one <metric>.bin file
+(int64 values) per metric. Files use the native byte order, and are
+memory-mapped for reads, so range queries return views of the mapped files
+rather than copies. Missing values are stored as MISSING.
+
+Below is a summary of the functions defined within this module
+
+covid_store
+    .append_rows()
+        > appends api rows newer than the latest stored date
+    .last_date()
+        > returns the latest date stored for an area
+    .series_stamp()
+        > returns a stamp which changes whenever an area's series is written
+    .read_range()
+        > returns (zero-copy) views of the dates and values for a date range
+    .read_rows()
+        > returns the stored series for an area, in the api's row format
+    .truncate_from()
+        > removes stored rows from a date onwards (so revised rows can be re-appended)
+    .clear_area()
+        > deletes the stored series for an area
+'''
+
+import os
+import re
+import mmap
+import shutil
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+logger_cs = logging.getLogger(__name__)
+
+STORE_DIR = '__store__'
+METRICS = ['newCasesByPublishDate', 'cumDeaths28DaysByPublishDate', 'hospitalCases']
+MISSING = -2**63 # sentinel for missing values
+DATE_TYPE, VALUE_TYPE = 'i', 'q' # array typecodes of the date and value columns
+
+_write_lock = threading.Lock()
+_maps = {} # path -> ((inode, size), mmap) of currently mapped files
+
+def _area_dir(location: str, location_type: str) -> str:
+    '''Returns the directory storing the series for an area.'''
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', f'{location_type}_{location}')
+    return os.path.join(STORE_DIR, name)
+
+def _column_path(location: str, location_type: str, column: str) -> str:
+    '''Returns the path of a column file.'''
+    return os.path.join(_area_dir(location, location_type), column+'.bin')
+
+def _map_column(path: str, typecode: str) -> memoryview:
+    '''Memory-maps a column file, returning a typed view of its contents.
+
+    Mappings are reused until the file grows (i.e. is appended to) or is replaced
+    (mappings of replaced or deleted files are closed first, see _unmap).
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+    if stat is None or stat.st_size == 0:
+        return memoryview(array(typecode))
+    size = stat.st_size
+    mapped = _maps.get(path)
+    if mapped is None or mapped[0] != (stat.st_ino, size):
+        with open(path, 'rb') as column_file:
+            # the old mapping is closed once any views of it are released
+            mapped = ((stat.st_ino, size), mmap.mmap(column_file.fileno(), size,
+                                                     access=mmap.ACCESS_READ))
+        _maps[path] = mapped
+    itemsize = array(typecode).itemsize
+    # any partially written trailing item is ignored
+    return memoryview(mapped[1])[:size-size%itemsize].cast(typecode)
+
+def _unmap(path: str) -> type(None):
+    '''Closes the mapping of a file (held with _write_lock), so it can be replaced
+    or deleted - which fails on Windows while the file is mapped.'''
+    mapped = _maps.pop(path, None)
+    if mapped is None:
+        return
+    try:
+        mapped[1].close()
+    except BufferError: # views are still held by a reader, closed once released
+        logger_cs.warning('column file still mapped [path=%s]', path)
+
+def _to_ordinal(day: str) -> int:
+    '''Converts a date (%format YYYY-MM-DD) to a day ordinal.'''
+    return date.fromisoformat(day).toordinal()
+
+def last_date(location: str, location_type: str) -> str:
+    '''Returns the latest date stored for an area.
+
+    Args:
+        location: area name
+        location_type: area type
+
+    Returns:
+        Date (%format YYYY-MM-DD), or None if nothing is stored
+    '''
+    dates = _map_column(_column_path(location, location_type, 'dates'), DATE_TYPE)
+    if len(dates) == 0:
+        return None
+    return date.fromordinal(dates[-1]).isoformat()
+
+def series_stamp(location: str, location_type: str) -> tuple:
+    '''Returns a stamp which changes whenever an area's series is written (so
+    values calculated from the series can be cached).
+
+    Args:
+        location: area name
+        location_type: area type
+
+    Returns:
+        (inode, size, modification time) of the dates column - written last
+        by append_rows, and replaced by truncate_from - or None if nothing is stored
+    '''
+    try:
+        stat = os.stat(_column_path(location, location_type, 'dates'))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def append_rows(location: str, location_type: str, rows: list) -> int:
+    '''Appends rows newer than the latest stored date to an area's series.
+
+    Args:
+        location: area name
+        location_type: area type
+        rows: list of dictionaries (with a date and metric values), in any
+            order - e.g. the data list returned from covid_API_request
+
+    Returns:
+        Number of rows appended
+    '''
+    if not isinstance(rows, list):
+        return 0
+    with _write_lock:
+        latest = last_date(location, location_type)
+        latest = _to_ordinal(latest) if latest else -1
+        new_rows = {}
+        for row in rows:
+            if 'date' in row and _to_ordinal(row['date']) > latest:
+                new_rows[_to_ordinal(row['date'])] = row
+        if not new_rows:
+            return 0
+        os.makedirs(_area_dir(location, location_type), exist_ok=True)
+        days = sorted(new_rows)
+        count = os.path.getsize(_column_path(location, location_type, 'dates'))\
+            // array(DATE_TYPE).itemsize if latest >= 0 else 0
+        # metric columns are written before dates, as the dates column
+        # determines how many rows readers see
+        for metric in METRICS:
+            path = _column_path(location, location_type, metric)
+            values = array(VALUE_TYPE)
+            stored = os.path.getsize(path)//values.itemsize if os.path.exists(path) else 0
+            values.extend([MISSING]*(count-stored)) # pads columns missing rows
+            for day in days:
+                value = new_rows[day].get(metric)
+                values.append(MISSING if value is None else int(value))
+            with open(path, 'r+b' if stored else 'wb') as column_file:
+                if stored > count: # drops rows left by an interrupted append
+                    column_file.truncate(count*values.itemsize)
+                column_file.seek(0, os.SEEK_END)
+                column_file.write(values.tobytes())
+        with open(_column_path(location, location_type, 'dates'), 'ab') as dates_file:
+            dates_file.write(array(DATE_TYPE, days).tobytes())
+    logger_cs.info('%d rows stored [area=%s]', len(days), location)
+    return len(days)
+
+def read_range(location: str, location_type: str, metric: str,
+               start: str=None, end: str=None) -> tuple[memoryview, memoryview]:
+    '''Reads the stored series of a metric, between two dates (inclusive).
+
+    Args:
+        location: area name
+        location_type: area type
+        metric: metric to read, one of METRICS
+        start: earliest date (%format YYYY-MM-DD), None for no limit
+        end: latest date (%format YYYY-MM-DD), None for no limit
+
+    Returns:
+        Views of the day ordinals and values, in ascending date order. These
+        share memory with the mapped files, so are not copied.
+    '''
+    if metric not in METRICS:
+        return
+    dates = _map_column(_column_path(location, location_type, 'dates'), DATE_TYPE)
+    values = _map_column(_column_path(location, location_type, metric), VALUE_TYPE)
+    lo = bisect_left(dates, _to_ordinal(start)) if start else 0
+    hi = bisect_right(dates, _to_ordinal(end)) if end else len(dates)
+    hi = min(hi, len(values))
+    return dates[lo:hi], values[lo:hi]
+
+def read_rows(location: str, location_type: str) -> list:
+    '''Returns the stored series for an area, formatted as api rows.
+
+    Args:
+        location: area name
+        location_type: area type
+
+    Returns:
+        List of dictionaries {date, areaName, areaType, *METRICS} in
+        descending date order (as returned from the api), with missing
+        values as None
+    '''
+    dates = _map_column(_column_path(location, location_type, 'dates'), DATE_TYPE)
+    columns = [_map_column(_column_path(location, location_type, metric), VALUE_TYPE)
+               for metric in METRICS]
+    rows = []
+    for i in range(min([len(dates)]+[len(c) for c in columns])-1, -1, -1):
+        row = {'date': date.fromordinal(dates[i]).isoformat(),
+               'areaName': location, 'areaType': location_type}
+        for metric, column in zip(METRICS, columns):
+            row[metric] = None if column[i] == MISSING else column[i]
+        rows.append(row)
+    return rows
+
+def truncate_from(location: str, location_type: str, day: str) -> int:
+    '''Removes stored rows dated on or after a date. Files which cannot be
+    replaced are logged, and the error raised.
+
+    Args:
+        location: area name
+        location_type: area type
+        day: earliest date removed (%format YYYY-MM-DD)
+
+    Returns:
+        Number of rows kept
+    '''
+    with _write_lock:
+        dates = _map_column(_column_path(location, location_type, 'dates'), DATE_TYPE)
+        keep = bisect_left(dates, _to_ordinal(day))
+        if keep == len(dates):
+            return keep
+        del dates
+        # columns are rewritten and replaced (not truncated in place), so
+        # readers never see a partly truncated file
+        columns = [('dates', DATE_TYPE)]+[(metric, VALUE_TYPE) for metric in METRICS]
+        for column, typecode in columns:
+            path = _column_path(location, location_type, column)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as column_file:
+                kept = column_file.read(keep*array(typecode).itemsize)
+            with open(path+'.tmp', 'wb') as column_file:
+                column_file.write(kept)
+            _unmap(path)
+            try:
+                os.replace(path+'.tmp', path)
+            except OSError:
+                logger_cs.exception('column file could not be replaced [path=%s]', path)
+                raise
+    logger_cs.info('stored series truncated from %s [area=%s]', day, location)
+    return keep
+
+def clear_area(location: str, location_type: str) -> type(None):
+    '''Deletes the stored series for an area (e.g. when history is revised).
+    Files which cannot be deleted are logged, and the error raised.
+
+    Args:
+        location: area name
+        location_type: area type
+    '''
+    with _write_lock:
+        path = _area_dir(location, location_type)
+        for column_path in list(_maps):
+            if column_path.startswith(path+os.sep):
+                _unmap(column_path)
+        if not os.path.exists(path):
+            return
+        try:
+            shutil.rmtree(path)
+        except OSError:
+            logger_cs.exception('stored series could not be cleared [area=%s]', location)
+            raise
+    logger_cs.info('stored series cleared [area=%s]', location)
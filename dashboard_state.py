@@ -0,0 +1,171 @@
+'''This module handles: the dashboard snapshot - a versioned copy of the values
+displayed in the interface, which is replaced whenever one of them changes.
+
+Readers take the whole snapshot at once, without locking, and can compare its
+version with that of an earlier snapshot to tell if anything has changed (e.g.
+to reuse a rendered page). Writers replace the snapshot (copy-on-write) while
+holding a lock, and hold a per-value lock across a read-modify-write.
+
+If shared_backend is enabled, values are also written to the shared database,
+the snapshot version is the shared version, and the snapshot is reloaded
+(at most every SYNC_INTERVAL) when another process has changed it. Per-value
+locks then also hold a lock file, so they apply across processes.
+
+Below is a summary of the functions defined within this module
+
+dashboard_state
+    .publish()
+        > replaces a value in the snapshot, creating a new version
+    .get_snapshot()
+        > returns the current version, along with the values displayed
+    .get_value()
+        > returns a single value from the current snapshot
+    .key_lock()
+        > returns the lock to hold while modifying a value
+    .sync()
+        > reloads the snapshot, if changed by another process
+    .on_change()
+        > adds a function to be called whenever the snapshot is replaced
+'''
+
+import logging
+import threading
+from time import time
+import shared_backend
+
+logger_ds = logging.getLogger(__name__)
+
+global _snapshot
+# version, values - replaced as a whole, so readers never see a partial update
+_snapshot = (0, {'covid_data': (), 'covid_news': (), 'updates': (), 'area_stats': None})
+_swap_lock = threading.Lock()
+_key_locks = {key: threading.RLock() for key in _snapshot[1]}
+_shared_locks = {}
+change_callbacks = []
+_last_sync = 0
+
+SYNC_INTERVAL = 1 # longest time (seconds) before changes by other processes are seen
+
+class _SharedLock:
+    '''Lock held by one thread, across all processes (see key_lock).'''
+
+    def __init__(self, key: str):
+        self.key = key
+        self.local_lock = _key_locks[key]
+        self.lock_file = shared_backend.file_lock(key)
+        self.depth = 0
+
+    def __enter__(self):
+        self.local_lock.acquire()
+        if self.depth == 0:
+            shared_backend.acquire_file_lock(self.lock_file)
+            sync(force=True) # value may have been changed by another process
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            shared_backend.release_file_lock(self.lock_file)
+        self.local_lock.release()
+
+def publish(key: str, value) -> int:
+    '''Replaces a value in the snapshot.
+
+    Args:
+        key: name of value - covid_data, covid_news, updates or area_stats
+        value: new (immutable) value, e.g. a tuple
+
+    Returns:
+        Version of the new snapshot
+    '''
+    global _snapshot
+    with _swap_lock:
+        previous = _snapshot
+        version, values = previous
+        values = dict(values, **{key: value})
+        version += 1
+        if shared_backend.is_enabled():
+            shared_version = shared_backend.write_value(key, value)
+            if shared_version != version: # other values changed since the last sync
+                version, shared_values = shared_backend.read_values()
+                values.update(shared_values)
+        _snapshot = (version, values)
+        _notify(previous, _snapshot)
+    logger_ds.info('dashboard snapshot updated [key=%s, version=%d]', key, version)
+    return version
+
+def get_snapshot() -> tuple[int, dict]:
+    '''Returns the current snapshot.
+
+    Returns:
+        The version of the snapshot, along with a dictionary of the values
+        displayed in the interface {covid_data, covid_news, updates, area_stats}
+    '''
+    sync()
+    return _snapshot
+
+def get_value(key: str):
+    '''Returns a single value from the current snapshot.
+
+    Args:
+        key: name of value - covid_data, covid_news, updates or area_stats
+    '''
+    sync()
+    return _snapshot[1].get(key)
+
+def key_lock(key: str) -> threading.RLock:
+    '''Returns the lock for a value, to be held while reading, modifying and
+    republishing it (so concurrent writers do not overwrite each other).
+
+    Args:
+        key: name of value - covid_data, covid_news, updates or area_stats
+    '''
+    if shared_backend.is_enabled():
+        if key not in _shared_locks:
+            _shared_locks[key] = _SharedLock(key)
+        return _shared_locks[key]
+    return _key_locks[key]
+
+def sync(force: bool=False) -> type(None):
+    '''Reloads the snapshot from the shared database, if another process has
+    changed it (does nothing if shared_backend is disabled).
+
+    Args:
+        force: flag for checking immediately, rather than every SYNC_INTERVAL
+    '''
+    global _snapshot, _last_sync
+    if not shared_backend.is_enabled():
+        return
+    if not force and time()-_last_sync < SYNC_INTERVAL:
+        return
+    _last_sync = time()
+    if shared_backend.read_version() == _snapshot[0]:
+        return
+    version, values = shared_backend.read_values()
+    with _swap_lock:
+        if version > _snapshot[0]:
+            previous = _snapshot
+            _snapshot = (version, dict(previous[1], **values))
+            _notify(previous, _snapshot)
+    logger_ds.info('dashboard snapshot reloaded [version=%d]', version)
+
+def on_change(callback) -> type(None):
+    '''Adds a function to be called whenever the snapshot is replaced (by
+    publish, or by sync). Callbacks are called in version order, while the
+    snapshot lock is held, so should return quickly.
+
+    Args:
+        callback: function taking the previous and new snapshots, each a
+            (version, values) tuple as returned from get_snapshot
+    '''
+    if callback not in change_callbacks:
+        change_callbacks.append(callback)
+
+def _notify(previous: tuple, snapshot: tuple) -> type(None):
+    '''Calls the change callbacks for a new snapshot.'''
+    for callback in change_callbacks:
+        try:
+            callback(previous, snapshot)
+        except Exception:
+            logger_ds.exception('snapshot change callback failed')
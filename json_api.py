@@ -0,0 +1,219 @@
+'''This module handles: the read-only json api - the current stats, news and
+scheduled updates, as compact (and compressed) json for machine clients.
+
+Each response is serialised once per dashboard snapshot (see dashboard_state),
+along with its compressed forms, so polling clients cost a dictionary lookup.
+Responses carry a strong etag (one for each encoding), so clients whose copy
+is current get an empty 304. Stats carry a Cache-Control max-age lasting until
+their next scheduled refresh (at most MAX_AGE); news and updates, which any
+client can change, are sent as no-cache, so are always revalidated.
+
+orjson (serialising) and brotli (compression) are used if installed; otherwise
+the json module and gzip are used.
+
+Below is a summary of the functions defined within this module
+
+json_api
+    .encode()
+        > serialises a value as compact json
+    .build_payload()
+        > returns the value served by an endpoint, from a dashboard snapshot
+    .choose_encoding()
+        > picks the compression for a response, from an Accept-Encoding header
+    .cache_control()
+        > returns the Cache-Control header of an endpoint
+    .etag_matches()
+        > checks if an If-None-Match header matches an etag
+    .respond()
+        > returns the status, body and headers of a response to an endpoint
+'''
+
+import gzip
+import json
+import logging
+import threading
+from hashlib import sha1
+from time import time
+import area_registry
+import dashboard_state
+import live_updates
+import metrics
+import update_scheduler
+try:
+    import orjson
+except ImportError: # optional, falls back to json
+    orjson = None
+try:
+    import brotli
+except ImportError: # optional, falls back to gzip
+    brotli = None
+
+logger_ja = logging.getLogger(__name__)
+
+# name -> update target, None for endpoints changed by any client (dismissing
+# articles, or scheduling updates), which are always revalidated
+ENDPOINTS = {'stats': 'covid_data', 'news': None, 'updates': None}
+MAX_AGE = 300 # longest time (seconds) clients may reuse a response
+COMPRESS_MIN_SIZE = 256 # smaller bodies (bytes) are sent uncompressed
+
+_responses = {} # (endpoint, row) -> (snapshot version, {encoding -> (body, etag)})
+_responses_lock = threading.Lock() # held while serialising and storing a response
+
+metrics.describe('dashboard_api_requests_total', 'Requests to the json api, '
+                 'by endpoint, encoding and status')
+
+def encode(value) -> bytes:
+    '''Serialises a value as compact json.
+
+    Args:
+        value: json serialisable value (strings may be subclasses, e.g. Markup)
+
+    Returns:
+        Encoded json
+    '''
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+def build_payload(endpoint: str, values: dict, row: int=None):
+    '''Returns the value served by an endpoint.
+
+    Args:
+        endpoint: stats, news or updates
+        values: values displayed in the interface - as returned from
+            dashboard_state.get_snapshot
+        row: row of area for stats (see area_registry), None for the main location
+
+    Returns:
+        Stats as a dictionary (of live_updates.COVID_FIELDS), news and updates
+        as lists of dictionaries (as displayed in the interface)
+    '''
+    if endpoint == 'stats':
+        if row is None:
+            covid_data = values.get('covid_data')
+        else:
+            covid_data = area_registry.table_stats(values.get('area_stats'), row)
+        fields = live_updates.COVID_FIELDS
+        return dict(zip(fields, covid_data or (None,)*len(fields)))
+    if endpoint == 'news':
+        return [dict(article) for article in values.get('covid_news') or ()]
+    return [dict(update) for update in values.get('updates') or ()]
+
+def _encodings(body: bytes) -> dict:
+    '''Returns the body of a response in each encoding, along with its etag.'''
+    digest = sha1(body).hexdigest()[:24]
+    bodies = {'identity': (body, f'"{digest}"')}
+    if len(body) >= COMPRESS_MIN_SIZE:
+        bodies['gzip'] = (gzip.compress(body, 6, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            bodies['br'] = (brotli.compress(body), f'"{digest}-br"')
+    return bodies
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    '''Picks the compression for a response.
+
+    Args:
+        accept_encoding: Accept-Encoding header of the request
+        available: encodings the body is held in
+
+    Returns:
+        br or gzip (if accepted and available), otherwise identity
+    '''
+    accepted = {}
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
+
+def cache_control(endpoint: str, values: dict) -> str:
+    '''Returns the Cache-Control header of an endpoint - stats may be reused
+    until their next scheduled refresh (at most MAX_AGE seconds), while news
+    and updates (changed by any client) are always revalidated.
+
+    Args:
+        endpoint: stats, news or updates
+        values: values of the snapshot being served
+
+    Returns:
+        Cache-Control header value
+    '''
+    target = ENDPOINTS.get(endpoint)
+    if target is None or (endpoint == 'stats' and not values.get('covid_data')):
+        return 'no-cache' # changed by any client, or still loading
+    now = time()
+    next_refresh = min((t for t, _, job_target, _ in update_scheduler.scheduled_jobs()
+                        if job_target == target), default=now+MAX_AGE)
+    return f'max-age={int(min(max(next_refresh-now, 0), MAX_AGE))}'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    '''Checks if an If-None-Match header matches an etag, using the weak
+    comparison (so W/ prefixes are ignored).
+
+    Args:
+        if_none_match: If-None-Match header of the request - *, or a list of etags
+        etag: etag of the current response
+
+    Returns:
+        True if the client's copy is current
+    '''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def respond(endpoint: str, row: int=None, accept_encoding: str=None,
+            if_none_match: str=None) -> tuple[int, bytes, list]:
+    '''Returns the response to a request to an endpoint, serialising (and
+    compressing) the payload only if the snapshot has changed.
+
+    Args:
+        endpoint: stats, news or updates
+        row: row of area for stats (see area_registry), None for the main location
+        accept_encoding: Accept-Encoding header of the request
+        if_none_match: If-None-Match header of the request
+
+    Returns:
+        Status code, body (empty for 304 and unknown endpoints) and a list of
+        (name, value) headers
+    '''
+    if endpoint not in ENDPOINTS:
+        return 404, b'', []
+    version, values = dashboard_state.get_snapshot()
+    key = (endpoint, row)
+    with _responses_lock: # flask runs threaded, so each response is serialised once
+        cached = _responses.get(key)
+        if cached is None or cached[0] != version:
+            stored = cached
+            cached = (version, _encodings(encode(build_payload(endpoint, values, row))))
+            if stored is None or stored[0] < version:
+                # responses of earlier snapshots (e.g. of other areas) are dropped
+                for stale in [k for k, (v, _) in _responses.items() if v < version]:
+                    del _responses[stale]
+                _responses[key] = cached
+            logger_ja.debug('api response serialised [endpoint=%s, version=%d]',
+                            endpoint, version)
+    encoding = choose_encoding(accept_encoding, cached[1])
+    body, etag = cached[1][encoding]
+    headers = [('ETag', etag), ('Cache-Control', cache_control(endpoint, values)),
+               ('Vary', 'Accept-Encoding')]
+    if etag_matches(if_none_match, etag):
+        metrics.inc('dashboard_api_requests_total', endpoint=endpoint,
+                    encoding=encoding, status='304')
+        return 304, b'', headers
+    headers.append(('Content-Type', 'application/json'))
+    if encoding != 'identity':
+        headers.append(('Content-Encoding', encoding))
+    metrics.inc('dashboard_api_requests_total', endpoint=endpoint,
+                encoding=encoding, status='200')
+    return 200, body, headers
@@ -0,0 +1,254 @@
+'''This module handles: pushing changes to the dashboard to open interfaces, as
+a stream of Server-Sent Events (served at /events), instead of full-page reloads.
+
+Whenever the dashboard snapshot is replaced, the difference from the previous
+snapshot is serialised (once) into an event, and kept in a short history.
+Each open stream waits for events newer than the last one it sent, so every
+update costs a single diff however many interfaces are open. A stream which
+has fallen behind the history is sent a reload event instead.
+
+Below is a summary of the functions defined within this module
+
+live_updates
+    .diff_values()
+        > returns the (json serialisable) changes between two sets of dashboard values
+    .format_event()
+        > formats a Server-Sent Event
+    .events_since()
+        > returns the stored events newer than a version
+    .wait_for_events()
+        > blocks until there are events newer than a version
+    .wait_for_events_async()
+        > awaitable version of wait_for_events, for asyncio servers
+    .event_stream()
+        > generates the Server-Sent Events sent to a single interface
+    .event_stream_async()
+        > asynchronous version of event_stream, for asyncio servers
+'''
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from json import dumps
+import dashboard_state
+import shared_backend
+
+logger_lu = logging.getLogger(__name__)
+
+EVENT_HISTORY = 64 # number of events kept, for streams which fall behind
+KEEPALIVE = 15 # time (seconds) between comments sent on an idle stream
+RETRY = 3000 # time (milliseconds) before a closed stream is reopened
+COVID_FIELDS = ['location', 'local_7day_infections', 'nation_location',
+                'national_7day_infections', 'hospital_cases', 'deaths_total']
+LIST_KEYS = {'covid_news': 'id', 'updates': 'title'} # identifying key of list items
+
+_events = deque(maxlen=EVENT_HISTORY) # (version, formatted event)
+_condition = threading.Condition()
+_async_waiters = set() # (event loop, asyncio.Event) of waiting async streams
+_history_start = None # events cover all changes after this version
+
+def _diff_list(before: tuple, after: tuple, key: str) -> dict:
+    '''Returns the changes between two lists of items, identified by key.
+
+    Returns:
+        {removed, added} - keys of removed items, and [index, item] pairs of
+        added items (in the new list); or {items} if the order of the
+        remaining items has changed
+    '''
+    after_keys = {item[key] for item in after}
+    before_keys = {item[key] for item in before}
+    kept_before = [item[key] for item in before if item[key] in after_keys]
+    kept_after = [item[key] for item in after if item[key] in before_keys]
+    if kept_before != kept_after:
+        return {'items': [dict(item) for item in after]}
+    return {'removed': [item[key] for item in before if item[key] not in after_keys],
+            'added': [[i, dict(item)] for i, item in enumerate(after)
+                      if item[key] not in before_keys]}
+
+def diff_values(before: dict, after: dict) -> dict:
+    '''Returns the changes between two sets of dashboard values.
+
+    Args:
+        before: previous values, as returned from dashboard_state.get_snapshot
+        after: new values, as returned from dashboard_state.get_snapshot
+
+    Returns:
+        Dictionary of changed values (json serialisable). covid_data is sent as
+        a dictionary of its fields; covid_news and updates as list diffs
+        {removed, added} (see _diff_list); area_stats as true, if changed
+    '''
+    changes = {}
+    if before.get('covid_data') != after.get('covid_data'):
+        covid_data = after.get('covid_data') or (None,)*len(COVID_FIELDS)
+        changes['covid_data'] = dict(zip(COVID_FIELDS, covid_data))
+    if before.get('area_stats') != after.get('area_stats'):
+        changes['area_stats'] = True # too large to send, pages of other areas reload
+    for name, key in LIST_KEYS.items():
+        if before.get(name) != after.get(name):
+            changes[name] = _diff_list(before.get(name) or (), after.get(name) or (), key)
+    return changes
+
+def format_event(data: str, event: str=None, event_id: int=None) -> bytes:
+    '''Formats a Server-Sent Event.
+
+    Args:
+        data: event data, e.g. json (may not contain newlines)
+        event: event type, None for the default (message)
+        event_id: id of event, sent back by the browser on reconnecting
+
+    Returns:
+        Encoded event, ready to be written to a stream
+    '''
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {data}')
+    return ('\n'.join(lines)+'\n\n').encode()
+
+def _on_change(previous: tuple, snapshot: tuple) -> type(None):
+    '''Stores the diff of a new snapshot as an event, and wakes waiting streams.'''
+    global _history_start
+    changes = diff_values(previous[1], snapshot[1])
+    if changes: # serialised once, and shared by every stream
+        event = format_event(dumps(changes, default=str), event_id=snapshot[0])
+    with _condition:
+        if _history_start is None:
+            _history_start = previous[0]
+        if not changes:
+            return
+        if len(_events) == _events.maxlen:
+            _history_start = _events[0][0] # oldest event is dropped
+        _events.append((snapshot[0], event))
+        _condition.notify_all()
+    for loop, waiter in list(_async_waiters):
+        try:
+            loop.call_soon_threadsafe(waiter.set)
+        except RuntimeError: # event loop closed
+            _async_waiters.discard((loop, waiter))
+
+def events_since(version: int) -> list:
+    '''Returns the stored events newer than a version.
+
+    Args:
+        version: version of the snapshot last seen by the interface
+
+    Returns:
+        List of (version, event) tuples, or None if changes made since the
+        version are no longer stored (so the page should be reloaded)
+    '''
+    with _condition:
+        start = _history_start
+        events = [(v, event) for v, event in _events if v > version]
+    if start is None: # no changes since this process started
+        start = dashboard_state.get_snapshot()[0]
+    if version < start:
+        return None
+    return events
+
+def wait_for_events(version: int, timeout: float=KEEPALIVE) -> list:
+    '''Blocks until there are events newer than a version, or timeout.
+
+    Args:
+        version: version of the snapshot last seen by the interface
+        timeout: maximum time (seconds) to wait
+
+    Returns:
+        As events_since (an empty list on timeout)
+    '''
+    if shared_backend.is_enabled(): # changes by other processes are seen on sync
+        timeout = min(timeout, dashboard_state.SYNC_INTERVAL)
+        dashboard_state.sync()
+    with _condition:
+        _condition.wait_for(lambda: _events and _events[-1][0] > version, timeout)
+    return events_since(version)
+
+async def wait_for_events_async(version: int, timeout: float=KEEPALIVE) -> list:
+    '''Waits (without blocking the event loop) until there are events newer
+    than a version, or timeout.
+
+    Args:
+        version: version of the snapshot last seen by the interface
+        timeout: maximum time (seconds) to wait
+
+    Returns:
+        As events_since (an empty list on timeout)
+    '''
+    if shared_backend.is_enabled():
+        timeout = min(timeout, dashboard_state.SYNC_INTERVAL)
+        await asyncio.to_thread(dashboard_state.sync)
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    _async_waiters.add(waiter)
+    try:
+        if not _events or _events[-1][0] <= version:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _async_waiters.discard(waiter)
+    return events_since(version)
+
+def _stream_start(since: str) -> tuple[int, list]:
+    '''Returns the version a new stream starts from, and its first events.'''
+    start = [f'retry: {RETRY}\n\n'.encode()]
+    if since is None or not str(since).isdigit():
+        return dashboard_state.get_snapshot()[0], start
+    version = int(since)
+    events = events_since(version) # changes since the page was rendered
+    if events is None:
+        start.append(format_event('', event='reload'))
+        return None, start
+    if events:
+        version = events[-1][0]
+        start.extend(event for _, event in events)
+    return version, start
+
+def event_stream(since: str=None):
+    '''Generates the Server-Sent Events sent to a single interface.
+
+    Args:
+        since: version of the snapshot last seen by the interface - the
+            Last-Event-ID header (sent by the browser when reconnecting), or
+            the version the page was rendered from. None to only send new events
+
+    Yields:
+        Encoded events (or keepalive comments)
+    '''
+    version, start = _stream_start(since)
+    yield from start
+    if version is None: # interface is reloaded
+        return
+    logger_lu.info('event stream opened [version=%d]', version)
+    while True:
+        events = wait_for_events(version)
+        if events is None:
+            yield format_event('', event='reload')
+            return
+        if not events:
+            yield b': keepalive\n\n'
+            continue
+        for version, event in events:
+            yield event
+
+async def event_stream_async(since: str=None):
+    '''Asynchronous version of event_stream, for asyncio servers (see asgi_main).'''
+    version, start = _stream_start(since)
+    for event in start:
+        yield event
+    if version is None:
+        return
+    logger_lu.info('event stream opened [version=%d]', version)
+    while True:
+        events = await wait_for_events_async(version)
+        if events is None:
+            yield format_event('', event='reload')
+            return
+        if not events:
+            yield b': keepalive\n\n'
+            continue
+        for version, event in events:
+            yield event
+
+dashboard_state.on_change(_on_change)
@@ -0,0 +1,235 @@
+'''This module handles: writing the dashboard log without blocking the threads
+which log - records are queued, and written to the log file in batches by a
+background thread.
+
+The file is rotated once it reaches MAX_BYTES, keeping BACKUP_COUNT old files
+(e.g. dashboard_log.log.1). Messages below WARNING are rate limited: each
+distinct message (per logger) may be logged at RATE_LIMIT per second, after
+an initial burst, and the number of suppressed messages is added to the next
+one which is written.
+
+Below is a summary of the functions defined within this module
+
+log_pipeline
+    .setup_logging()
+        > sends all log records through the queue, and starts the writer thread
+    .set_rate_limit()
+        > sets the rate limit of a logger's messages
+    .flush_logging()
+        > waits until all queued records have been written
+    .stop_logging()
+        > writes any queued records, and stops the writer thread
+'''
+
+import os
+import sys
+import copy
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler
+from queue import SimpleQueue, Empty
+from time import monotonic
+import config_service
+import metrics
+
+FORMAT = '%(levelname)s @ %(name)s [%(asctime)s]: %(message)s'
+BATCH_SIZE = 512 # most records written at once
+MAX_BYTES = 5*1024*1024 # size (bytes, utf-8 encoded) of log file before it is rotated
+BACKUP_COUNT = 3 # rotated files kept
+RATE_LIMIT = (10, 50) # default (messages per second, burst) of each message
+rate_limits = {} # logger name -> (messages per second, burst), None for no limit
+
+_queue = SimpleQueue() # unbounded, so putting a record never blocks
+_writer_thread = None
+_setup_lock = threading.Lock()
+_STOP = object() # queued to stop the writer thread
+
+metrics.describe('dashboard_log_suppressed_total', 'Log messages dropped by rate limiting')
+
+class _RateLimitFilter(logging.Filter):
+    '''Drops messages (below WARNING) logged faster than their rate limit.'''
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {} # (logger, message) -> [tokens, last refill, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        limit = rate_limits.get(record.name, RATE_LIMIT)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = monotonic()
+        key = (record.name, record.msg) # unformatted, so arguments do not matter
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [burst, now, 0]
+            bucket[0] = min(burst, bucket[0]+(now-bucket[1])*rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                suppressed = None
+            else:
+                bucket[0] -= 1
+                suppressed, bucket[2] = bucket[2], 0
+        if suppressed is None:
+            metrics.inc('dashboard_log_suppressed_total', logger=record.name)
+            return False
+        if suppressed: # noted by _QueueHandler, as the record is shared with other handlers
+            record.suppressed = suppressed
+        return True
+
+class _QueueHandler(QueueHandler):
+    '''Queues records, leaving formatting to the writer thread.'''
+
+    def prepare(self, record):
+        # only the message is formatted here, as its arguments may change - on a
+        # copy, as the record is shared with any other handlers of the logger
+        message = record.getMessage()
+        if getattr(record, 'suppressed', None):
+            message = f'{message} [{record.suppressed} similar messages suppressed]'
+        record = copy.copy(record)
+        record.msg, record.args = message, None
+        return record
+
+class _LogWriter:
+    '''Writes batches of records to a file, rotating it by size.'''
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.formatter = logging.Formatter(FORMAT)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.file = open(filename, 'wb') # log starts empty for each run
+        self.size = 0
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backup_count-1, 0, -1):
+            if os.path.exists(f'{self.filename}.{i}'):
+                os.replace(f'{self.filename}.{i}', f'{self.filename}.{i+1}')
+        if self.backup_count:
+            os.replace(self.filename, f'{self.filename}.1')
+        self.file = open(self.filename, 'wb')
+        self.size = 0
+
+    def write(self, records: list):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record)+'\n')
+            except Exception:
+                lines.append(f'log record could not be formatted: {record.msg!r}\n')
+        data = ''.join(lines).encode('utf-8', 'backslashreplace') # sized in bytes
+        try:
+            if self.size and self.size+len(data) > self.max_bytes:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush() # one write per batch
+            self.size += len(data)
+        except OSError as error:
+            print(f'log could not be written: {error}', file=sys.stderr)
+
+    def close(self):
+        self.file.close()
+
+def _write_batches(writer: _LogWriter) -> type(None):
+    '''Main loop of the writer thread.'''
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except Empty:
+                break
+        records = [r for r in batch if isinstance(r, logging.LogRecord)]
+        if records:
+            writer.write(records)
+        for item in batch:
+            if isinstance(item, threading.Event): # see flush_logging
+                item.set()
+        if any(item is _STOP for item in batch):
+            writer.close()
+            return
+
+def setup_logging(filename: str=None, level: int=logging.INFO,
+                  max_bytes: int=MAX_BYTES, backup_count: int=BACKUP_COUNT) -> bool:
+    '''Sends all log records (of the root logger) through the queue, and
+    starts the writer thread. Does nothing if logging is already set up.
+
+    Args:
+        filename: log file, defaults to log_file_path in config.json
+            (relative to the working directory)
+        level: lowest level logged
+        max_bytes: size of log file before it is rotated
+        backup_count: rotated files kept
+
+    Returns:
+        True if logging was set up by this call
+    '''
+    global _writer_thread
+    with _setup_lock:
+        if _writer_thread is not None:
+            return False
+        if filename is None:
+            filename = os.getcwd()+config_service.get('log_file_path')
+        writer = _LogWriter(filename, max_bytes, backup_count)
+        handler = _QueueHandler(_queue)
+        handler.addFilter(_RateLimitFilter())
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level)
+        _writer_thread = threading.Thread(target=_write_batches, args=(writer,),
+                                          name='log-writer', daemon=True)
+        _writer_thread.start()
+    atexit.register(stop_logging)
+    return True
+
+def set_rate_limit(logger_name: str, rate: float=None, burst: int=None) -> type(None):
+    '''Sets the rate limit of a logger's messages (each distinct message is
+    limited separately).
+
+    Args:
+        logger_name: name of logger, e.g. covid_data_handler
+        rate: messages per second, None for no limit
+        burst: messages which may be logged at once, before the rate applies
+    '''
+    rate_limits[logger_name] = None if rate is None else (rate, burst or max(rate, 1))
+
+def flush_logging(timeout: float=None) -> bool:
+    '''Waits until all records queued so far have been written.
+
+    Args:
+        timeout: maximum time (seconds) to wait
+
+    Returns:
+        True if the records were written
+    '''
+    if _writer_thread is None:
+        return True
+    written = threading.Event()
+    _queue.put(written)
+    return written.wait(timeout)
+
+def stop_logging(timeout: float=5) -> type(None):
+    '''Writes any queued records, and stops the writer thread.
+
+    Args:
+        timeout: maximum time (seconds) to wait for the thread to finish
+    '''
+    global _writer_thread
+    with _setup_lock:
+        if _writer_thread is None:
+            return
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, _QueueHandler):
+                root.removeHandler(handler)
+        _queue.put(_STOP)
+        _writer_thread.join(timeout)
+        _writer_thread = None
@@ -3,141 +3,510 @@ This module handles:
     > the main flask application
     > incoming client requests
         (leading to scheduling/cancelling updates)
-    > updates to the interface (by passing values into the template)
+    > updates to the interface (by passing values into the template, and
+        pushing changes to open interfaces - see live_updates)
+
+If shared_backend is enabled (see shared_state_path in config.json), only the
+elected leader process fetches data and runs scheduled updates; requests to
+other processes which change the schedule are queued for the leader.
 '''
 
 ## imports
 import os
 import logging
-from json import load
-from time import localtime
-from flask import Flask, render_template, request
+import threading
+from time import localtime, time
+from hashlib import sha1
+from json import dumps
+from flask import Flask, Response, make_response, render_template, request
 ## handler modules
 import covid_data_handler
 import covid_news_handling
+import update_scheduler
+import schedule_journal
+import dashboard_state
+import shared_backend
+import config_service
+import log_pipeline
+import live_updates
+import metrics
+import api_cache
+import area_registry
+import covid_analytics
+import covid_store
+import json_api
 
 ## logging setup
-FORMAT = '%(levelname)s @ %(name)s [%(asctime)s]: %(message)s'
 logger_main = logging.getLogger('dashboard')
-with open('config.json','r') as config:
-    logging.basicConfig(filename=os.getcwd()+load(config)['log_file_path'],
-                        filemode='w',format=FORMAT,level=logging.INFO)
+log_pipeline.setup_logging() # queued, and written on a background thread
 # debug, info, warning, error, critical
 
-covid_data_handler.update_covid_data()
-covid_news_handling.update_news(sch=False)
+def remove_update(label: str) -> type(None):
+    '''Removes a scheduled update from the interface.
 
-updates = []
-news_articles = []
+    Args:
+        label: label of update in interface
+    '''
+    schedule_journal.delete_entry(label)
+    with dashboard_state.key_lock('updates'):
+        updates = dashboard_state.get_value('updates')
+        remaining = tuple(u for u in updates if u['title'] != label)
+        if remaining != updates:
+            dashboard_state.publish('updates', remaining)
+            logger_main.info('scheduled update removed from interface')
 
-app = Flask('dashboard',static_folder=os.getcwd()+'\\static')
+def apply_command(command: str, args: dict) -> bool:
+    '''Applies a change to the schedule, or dismisses a news article.
 
+    Args:
+        command: one of schedule, cancel or dismiss
+        args: arguments of command, detailed below
+            schedule: label, time (of update, in seconds since the epoch),
+                covid (flag), news (flag), repeating (flag), content
+                (description in interface, journalled with the update)
+            cancel: label
+            dismiss: id (of article)
 
-@app.route('/index')
-def index():
-    '''Handles incoming client requests, and injects values into the interface'''
-    global updates, news_articles
-    update_args = request.args # gets request
-    ## adding scheduled update to interface
-    valid = update_args.get('update') # schedule update time
-    if update_args.get('two'): # update label
-        if update_args.get('two') in [u['title'] for u in updates]:
-            logger_main.warning('label %s already in use',update_args.get('two'))
-            valid = False
-        content = ':'.join(update_args.get('update').split(':')) + ' ~ '
-        if update_args.get('covid-data'):
-            content += 'Covid Data'
-            if update_args.get('news'):
-                content += ' and News'
-        elif update_args.get('news'):
-            content += 'News'
-        else:
-            valid = False # invalid if neither data or news update
-        content += ' Updates'
-        if update_args.get('repeat'):
-            content += ' (repeating)'
-        if valid:
-            update = {'title':update_args.get('two'),'content':content}
-            updates.append(update) # adds to list of updates in interface
-            updates = sorted(updates, key = lambda u : u['content'])
-            # sorts updates by time in interface
-        else:
-            logger_main.warning('invalid update - no sched time or selected target')
-    ## scheduling updates
-    if valid:
-        u = update_args.get('update').split(':')
-        update_t_s = (int(u[0])*60 + int(u[1]) - 0.5)*60
-        # coverts scheduled update time to seconds
-        t = localtime()
-        current_t_s = (t[3]*60 + t[4])*60 + t[5] # converts current time to seconds
-        time_diff_s = (update_t_s-current_t_s)%(24*60*60)
-        # calculates the interval using the difference
-        r = bool(update_args.get('repeat'))
-        # checks if update should be repeated
-        label = update_args.get('two')
-        if update_args.get('covid-data'):
-            covid_data_handler.schedule_covid_updates(time_diff_s,label,r)
+    Returns:
+        False if a scheduled update to be cancelled was not found, else True
+    '''
+    if command == 'schedule':
+        interval = max(args['time']-time(), 0)
+        if args['covid']:
+            covid_data_handler.schedule_covid_updates(interval,args['label'],
+                                                      args['repeating'])
             logger_main.info('covid stats update scheduled')
             # schedules covid data updates
-        if update_args.get('news'):
-            covid_news_handling.schedule_news_updates(time_diff_s,label,r)
+        if args['news']:
+            covid_news_handling.schedule_news_updates(interval,args['label'],
+                                                      args['repeating'])
             logger_main.info('covid news update scheduled')
             # schedules covid news story updates
-    ## cancelling news stories
-    if update_args.get('notif'):
-        covid_news_handling.remove_title(update_args.get('notif')) # add title to removed_titles
+        if args.get('content') and update_scheduler.is_scheduled(args['label']):
+            schedule_journal.save_entry(args['label'], args['content'])
+    elif command == 'cancel':
+        if not update_scheduler.cancel(args['label']): # cancels stats and news updates
+            logger_main.warning('scheduled update not found')
+            return False
+        logger_main.info('scheduled update cancelled')
+    elif command == 'dismiss':
+        covid_news_handling.remove_article(args['id']) # add id to dismissed_articles
         logger_main.info('news story removed from interface')
         covid_news_handling.update_news(sch=False) # updates to fill article list
-    ## cancelling scheduled updates
-    if update_args.get('update_item'):
-        s = None
-        for scheduler in [covid_data_handler.covid_data_sch,
-                          covid_news_handling.covid_news_sch]:
-            if update_args.get('update_item') in scheduler:
-                s = scheduler[update_args.get('update_item')]
-                # get scheduler from list by label
-                list(map(s.cancel, s.queue)) # cancels all events in queue
-        if s:
-            logger_main.info('scheduled update cancelled')
-            for i in range(len(updates)): # removes from list of updates in interface
-                if updates[i]['title'] == update_args.get('update_item'):
-                    updates.pop(i)
-                    logging.info('scheduled update removed from interface')
-                    break
+    return True
+
+def dispatch_command(command: str, args: dict) -> bool:
+    '''Applies a command in this process, or queues it for the leader process.
+
+    Args:
+        command: see apply_command
+        args: see apply_command
+
+    Returns:
+        As apply_command, or None if the command was queued
+    '''
+    if shared_backend.is_leader():
+        return apply_command(command, args)
+    shared_backend.submit_command(command, args)
+    return None
+
+def refresh_changed_config(changes: set, config: dict) -> type(None):
+    '''Refreshes only the values affected by a change to config.json.
+
+    Args:
+        changes: keys of config.json which have changed
+        config: new config (see config_service.on_change)
+    '''
+    if changes & {'location', 'location_type', 'nation', 'areas'}:
+        logger_main.info('location changed, refreshing covid stats')
+        covid_data_handler.update_covid_data()
+    if changes & {'news_search_terms', 'api_keys'}:
+        logger_main.info('news search changed, refreshing news')
+        covid_news_handling.update_news(sch=False)
+
+def fetch_initial_values() -> type(None):
+    '''Fetches the initial stats and news.'''
+    try:
+        covid_data_handler.update_covid_data()
+    except Exception:
+        logger_main.exception('initial covid stats update failed')
+    try:
+        covid_news_handling.update_news(sch=False)
+    except Exception:
+        logger_main.exception('initial news update failed')
+    logger_main.info('initial values fetched')
+
+def restore_schedule() -> type(None):
+    '''Restores the scheduled updates (and their entries in the interface) kept
+    by the schedule journal, if enabled (see schedule_journal_path in config.json) -
+    on startup, or when elected leader (taking over the previous leader's updates).'''
+    if not schedule_journal.configure():
+        return
+    update_scheduler.restore()
+    restored, stale = [], set()
+    for entry in schedule_journal.load_entries():
+        if update_scheduler.is_scheduled(entry['title']):
+            restored.append(entry)
+        else: # e.g. a one-off update missed while stopped
+            schedule_journal.delete_entry(entry['title'])
+            stale.add(entry['title'])
+    with dashboard_state.key_lock('updates'):
+        # shared updates of a previous leader which will not run are removed
+        updates = [u for u in dashboard_state.get_value('updates')
+                   if u['title'] not in stale]
+        titles = {u['title'] for u in updates}
+        updates += [entry for entry in restored if entry['title'] not in titles]
+        updates = sorted(updates, key = lambda u : u['content'])
+        if tuple(updates) != dashboard_state.get_value('updates'):
+            dashboard_state.publish('updates', tuple(updates))
+    logger_main.info('scheduled updates restored [updates=%d]', len(restored))
+
+def start_leader() -> type(None):
+    '''Fetches the initial stats and news, and starts running scheduled updates.
+
+    Unless deferred_startup is false in config.json, the stored stats are shown
+    immediately and the initial values are fetched on a background thread, so
+    requests can be served before the api requests complete.
+    '''
+    update_scheduler.on_complete(remove_update) # completed updates leave the interface
+    restore_schedule() # missed updates run once the scheduler starts
+    update_scheduler.start() # scheduled updates run on a background thread
+    config_service.on_change(refresh_changed_config, ['location', 'location_type',
+                                                      'nation', 'areas',
+                                                      'news_search_terms', 'api_keys'])
+    if config_service.get('deferred_startup', True):
+        covid_data_handler.load_stored_covid_data() # no api requests
+        threading.Thread(target=fetch_initial_values, name='initial-fetch',
+                         daemon=True).start()
+    else:
+        fetch_initial_values()
+
+def toggle_profiler(changes: set=None, config: dict=None) -> type(None):
+    '''Starts or stops the sampling profiler, as set by sampling_profiler in config.json.
+
+    Args:
+        changes: keys of config.json which have changed (see config_service.on_change)
+        config: new config
+    '''
+    if config_service.get('sampling_profiler'):
+        metrics.start_profiler()
+    else:
+        metrics.stop_profiler()
+
+def invalidate_pages(changes: set=None, config: dict=None) -> type(None):
+    '''Marks every rendered page as stale, when config.json changes (e.g.
+    show_analytics) - see page_version.
+
+    Args:
+        changes: keys of config.json which have changed (see config_service.on_change)
+        config: new config
+    '''
+    global config_version
+    config_version += 1
+
+def collect_metrics() -> type(None):
+    '''Copies values held by other modules into metrics, when they are rendered.'''
+    for event, count in api_cache.get_cache_stats().items():
+        if event == 'size':
+            metrics.set_gauge('dashboard_api_cache_entries', count)
         else:
-            logger_main.warning('scheduler not found')
-    ## running (refreshing) all schedulers
-    for schedulers in [covid_data_handler.covid_data_sch,
-                       covid_news_handling.covid_news_sch]:
-        for s in list(schedulers):
-            next_event_time = schedulers[s].run(blocking=False)
-            if next_event_time:
-                logger_main.info('time remaining for %s: %.2f', s, next_event_time)
-            else:# removes from list of updates if queue empty (i.e. update done)
-                schedulers.pop(s)
-                logger_main.info('scheduler %s removed',s)
-                i = 0
-                while i < len(updates):
-                    if updates[i]['title'] == s:
-                        updates.pop(i)
-                    else:
-                        i += 1
-            logger_main.info('scheduler %s refreshed',s)
+            metrics.set_counter('dashboard_api_cache_events_total', count, event=event)
+    version, values = dashboard_state.get_snapshot()
+    metrics.set_gauge('dashboard_snapshot_version', version)
+    metrics.set_gauge('dashboard_scheduled_updates', len(values['updates']))
+    metrics.set_gauge('dashboard_areas', len(area_registry.areas))
+
+metrics.describe('dashboard_index_seconds', 'Duration of /index requests')
+metrics.describe('dashboard_index_stage_seconds', 'Duration of each stage of /index requests')
+metrics.describe('dashboard_api_cache_events_total', 'Api cache hits, misses, '
+                 'revalidations and evictions')
+metrics.describe('dashboard_api_cache_entries', 'Responses held in the api cache')
+metrics.describe('dashboard_snapshot_version', 'Version of the dashboard snapshot')
+metrics.describe('dashboard_scheduled_updates', 'Updates shown as scheduled in the interface')
+metrics.describe('dashboard_areas', 'Areas whose stats are served (see area_registry)')
+metrics.add_collector(collect_metrics)
+config_service.on_change(toggle_profiler, ['sampling_profiler'])
+config_service.on_change(invalidate_pages)
+toggle_profiler()
+config_service.start() # changes to config.json are picked up while running
+
+if shared_backend.configure():
+    shared_backend.start(start_leader, apply_command) # leader elected in background
+else:
+    start_leader()
+
+area_registry.load_areas() # areas can be requested before the first update
+rendered_pages = {} # area row (None for the main location) -> (page version, html, etag)
+config_version = 0 # changed with config.json, see invalidate_pages
+LOADING = 'loading...' # shown in place of stats before the first update
+
+app = Flask('dashboard',static_folder=os.getcwd()+'\\static')
+
+
+@app.route('/index')
+def index():
+    '''Handles incoming client requests, and injects values (of the main location,
+    or of ?area=) into the interface'''
+    with metrics.timed('dashboard_index_seconds'):
+        with metrics.timed('dashboard_index_stage_seconds', stage='request_args'):
+            handle_request_args(request.args) # gets request
+        html, etag = get_rendered_page(request.args.get('area'))
+        response = make_response(html)
+        response.set_etag(etag)
+        return response.make_conditional(request) # 304 if client's copy is current
+
+@app.route('/analytics')
+def analytics():
+    '''Returns rolling-window and trend stats of an area (?area=, ?days=), as json'''
+    status, body = get_analytics(request.args)
+    return Response(body, status=status, content_type='application/json')
+
+@app.route('/api/<endpoint>')
+def api(endpoint: str):
+    '''Returns the current stats (of the main location, or of ?area=), news or
+    scheduled updates, as json (see json_api)'''
+    status, body, headers = get_api_response(endpoint, request.args,
+                                             request.headers.get('Accept-Encoding'),
+                                             request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    '''Returns the dashboard's metrics, in the Prometheus text format'''
+    return Response(metrics.render_metrics(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/profile')
+def profile():
+    '''Returns the stacks sampled by the profiler (see sampling_profiler in config.json)'''
+    return Response(metrics.profile_report(bool(request.args.get('clear'))),
+                    content_type='text/plain; charset=utf-8')
+
+@app.route('/events')
+def events():
+    '''Streams changes to the interface, as Server-Sent Events (see live_updates)'''
+    since = request.headers.get('Last-Event-ID') or request.args.get('version')
+    return Response(live_updates.event_stream(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def handle_request_args(update_args) -> type(None):
+    '''Schedules/cancels updates and dismisses news stories, as requested by a client.
+
+    Args:
+        update_args: request arguments (dictionary-like, supporting .get)
+    '''
+    ## cancelling news stories
+    if update_args.get('notif'):
+        dispatch_command('dismiss', {'id': update_args.get('notif')})
+    # updates list is read, modified and republished while holding its lock,
+    # so concurrent requests cannot overwrite each other's changes
+    with dashboard_state.key_lock('updates'):
+        updates_before = dashboard_state.get_value('updates')
+        updates = list(updates_before)
+        ## adding scheduled update to interface
+        valid = update_args.get('update') # schedule update time
+        content = None # description of update in interface
+        if update_args.get('two'): # update label
+            if update_args.get('two') in [u['title'] for u in updates]:
+                logger_main.warning('label %s already in use',update_args.get('two'))
+                valid = False
+            content = ':'.join(update_args.get('update').split(':')) + ' ~ '
+            if update_args.get('covid-data'):
+                content += 'Covid Data'
+                if update_args.get('news'):
+                    content += ' and News'
+            elif update_args.get('news'):
+                content += 'News'
+            else:
+                valid = False # invalid if neither data or news update
+            content += ' Updates'
+            if update_args.get('repeat'):
+                content += ' (repeating)'
+            if valid:
+                update = {'title':update_args.get('two'),'content':content}
+                updates.append(update) # adds to list of updates in interface
+                updates = sorted(updates, key = lambda u : u['content'])
+                # sorts updates by time in interface
+            else:
+                logger_main.warning('invalid update - no sched time or selected target')
+        ## scheduling updates
+        if valid:
+            u = update_args.get('update').split(':')
+            update_t_s = (int(u[0])*60 + int(u[1]) - 0.5)*60
+            # coverts scheduled update time to seconds
+            t = localtime()
+            current_t_s = (t[3]*60 + t[4])*60 + t[5] # converts current time to seconds
+            time_diff_s = (update_t_s-current_t_s)%(24*60*60)
+            # calculates the interval using the difference
+            dispatch_command('schedule', {'label': update_args.get('two'),
+                                          'time': time()+time_diff_s,
+                                          'covid': bool(update_args.get('covid-data')),
+                                          'news': bool(update_args.get('news')),
+                                          'repeating': bool(update_args.get('repeat')),
+                                          'content': content})
+        ## cancelling scheduled updates
+        if update_args.get('update_item'):
+            if dispatch_command('cancel', {'label': update_args.get('update_item')}) is not False:
+                updates = [u for u in updates
+                           if u['title'] != update_args.get('update_item')]
+                # removes from list of updates in interface
+        # completed updates are removed by remove_update, once their last job has run
+        if tuple(updates) != updates_before:
+            dashboard_state.publish('updates', tuple(updates))
+
+def get_analytics(args) -> tuple[int, str]:
+    '''Returns the stats of an area, calculated from its stored series (see
+    covid_analytics.area_analytics).
+
+    Args:
+        args: request arguments (dictionary-like, supporting .get) - area (name
+            or code, defaults to the main location) and days (rolling window)
+
+    Returns:
+        Status code, and json body - the stats, or an error message
+    '''
+    try:
+        days = int(args.get('days', covid_analytics.WINDOW))
+    except ValueError:
+        days = None
+    data = covid_analytics.area_analytics(args.get('area'), days)
+    if data is None:
+        logger_main.warning('invalid analytics request [args=%s]', dict(args))
+        return 404, dumps({'error': 'area not found, or invalid days'})
+    return 200, dumps(data)
+
+def get_api_response(endpoint: str, args, accept_encoding: str=None,
+                     if_none_match: str=None) -> tuple[int, bytes, list]:
+    '''Returns the response to a request to the json api (see json_api.respond).
+
+    Args:
+        endpoint: stats, news or updates
+        args: request arguments (dictionary-like, supporting .get) - area (name
+            or code, for stats)
+        accept_encoding: Accept-Encoding header of the request
+        if_none_match: If-None-Match header of the request
+
+    Returns:
+        Status code, body and a list of (name, value) headers
+    '''
+    area = args.get('area')
+    if area and area_registry.find_area(area) is None:
+        return 404, dumps({'error': 'area not found'}).encode(), \
+            [('Content-Type', 'application/json')]
+    return json_api.respond(endpoint, area_page_key(area), accept_encoding, if_none_match)
+
+def area_page_key(area: str=None) -> int:
+    '''Returns the key of an area's page in rendered_pages.
+
+    Args:
+        area: name or code of area (see area_registry), None for the main location
+
+    Returns:
+        Row of the area, or None for the main location (also used for areas
+        which are not configured)
+    '''
+    if not area:
+        return None
+    row = area_registry.find_area(area)
+    if row is None:
+        logger_main.warning('area not configured [area=%s]', area)
+        return None
+    if area_registry.get_area(row)[0] == config_service.get('location'):
+        return None
+    return row
+
+def page_version(version: int, row: int=None) -> tuple:
+    '''Returns the version of an area's page, which changes with the snapshot,
+    with config.json and (if show_analytics is set) with the stored series the
+    analytics are calculated from.
+
+    Args:
+        version: version of the dashboard snapshot
+        row: row of area (see area_registry), None for the main location
+
+    Returns:
+        Version of the page, as held in rendered_pages
+    '''
+    if not config_service.get('show_analytics'):
+        return version, config_version
+    if row is None:
+        rows = area_registry.load_areas()
+        row = rows[0] if rows else None
+    if row is None:
+        return version, config_version
+    name, area_type, _, nation = area_registry.get_area(row)
+    return (version, config_version, covid_store.series_stamp(name, area_type),
+            covid_store.series_stamp(nation, 'nation'))
+
+def get_rendered_page(area: str=None) -> tuple[str, str]:
+    '''Returns the interface, re-rendered only if the page has changed (see
+    page_version).
+
+    Args:
+        area: name or code of area, None for the main location
+
+    Returns:
+        Rendered html of the interface, along with its etag
+    '''
     ## fills interface with values
-    area, last7days_cases_local, nation = covid_data_handler.covid_data[:3]
-    last7days_cases_nation, hospital_cases, total_deaths = covid_data_handler.covid_data[3:]
+    row = area_page_key(area)
+    with metrics.timed('dashboard_index_stage_seconds', stage='state_read'):
+        version, values = dashboard_state.get_snapshot()
+    page = rendered_pages.get(row)
+    stamp = page_version(version, row)
+    if page is None or page[0] != stamp:
+        with app.app_context(), \
+                metrics.timed('dashboard_index_stage_seconds', stage='render'):
+            # app context also allows rendering outside flask requests
+            html = render_dashboard(values, version, row)
+        page = (stamp, html, sha1(html.encode()).hexdigest())
+        rendered_pages[row] = page
+        logger_main.info('interface rendered [version=%d]', version)
+    return page[1], page[2]
+
+def render_dashboard(values: dict, version: int=0, row: int=None) -> str:
+    '''Injects values from a dashboard snapshot into the interface.
+
+    Args:
+        values: values displayed in the interface - as returned from
+            dashboard_state.get_snapshot
+        version: version of the snapshot, from which the interface's
+            live updates start
+        row: row of area (see area_registry), None for the main location
+
+    Returns:
+        Rendered html of the interface
+    '''
+    if row is None:
+        covid_data = values['covid_data']
+        location = config_service.get('location')
+        nation = config_service.get('nation', area_registry.DEFAULT_NATION)
+    else: # stats of other areas are read from the area table
+        covid_data = area_registry.table_stats(values.get('area_stats'), row)
+        location, _, _, nation = area_registry.get_area(row)
+    covid_data = covid_data or (location, LOADING, nation, LOADING, LOADING, LOADING)
+    # shown as loading until the first update (see start_leader)
+    area, last7days_cases_local, nation = covid_data[:3]
+    last7days_cases_nation, hospital_cases, total_deaths = covid_data[3:]
     # extracts covid data from covid_data object
-    news_articles = covid_news_handling.covid_news
+    news_articles = list(values['covid_news'])
     # extracts covid-related news articles from covid_news object
+    analytics = None
+    if config_service.get('show_analytics'):
+        # rolling stats of local cases, from the stored series
+        data = covid_analytics.area_analytics(None if row is None else location)
+        if data and data['metrics']:
+            analytics = data['metrics']['newCasesByPublishDate']
     return render_template('index.html',title='Covid Dashboard',
                            location=area,
                            local_7day_infections=last7days_cases_local,
                            nation_location=nation,
                            national_7day_infections=last7days_cases_nation,
-                           hospital_cases='Hospital Cases: '+str(hospital_cases),
-                           deaths_total='Total Deaths: '+str(total_deaths),
-                           image='nhs_logo.png', updates=updates,
-                           news_articles=news_articles)
+                           hospital_cases=hospital_cases,
+                           deaths_total=total_deaths, version=version,
+                           image='nhs_logo.png', updates=list(values['updates']),
+                           news_articles=news_articles, analytics=analytics,
+                           area=None if row is None else location)
 
 if __name__=='__main__':
     app.run()
@@ -0,0 +1,280 @@
+'''This module handles: instrumenting the dashboard - counters and latency
+histograms recorded in memory, and exposed in the Prometheus text format (on
+/metrics) - along with an optional sampling profiler.
+
+Timings are recorded with timed, either as a decorator or a context manager:
+    @metrics.timed('dashboard_update_seconds', update='news')
+    with metrics.timed('dashboard_index_stage_seconds', stage='render'):
+Each timed block also counts its failures, in <name without _seconds>_errors_total.
+
+The profiler (enabled by "sampling_profiler" in config.json) periodically
+samples the stack of every thread, and counts each distinct stack; its report
+is in the collapsed-stack format read by flame graph tools.
+
+Below is a summary of the functions defined within this module
+
+metrics
+    .describe()
+        > sets the help text of a metric
+    .inc()
+        > increments a counter
+    .set_counter()
+        > sets the value of a counter maintained elsewhere
+    .set_gauge()
+        > sets the value of a gauge
+    .observe()
+        > records a value in a histogram
+    .timed()
+        > times a block (or function), recording the duration in a histogram
+    .add_collector()
+        > adds a function supplying values when metrics are rendered
+    .render_metrics()
+        > returns all metrics, in the Prometheus text format
+    .reset_metrics()
+        > removes all recorded values
+    .start_profiler()
+        > starts the sampling profiler thread
+    .stop_profiler()
+        > stops the sampling profiler thread
+    .profile_report()
+        > returns the sampled stacks, in the collapsed-stack format
+'''
+
+import os
+import sys
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+logger_m = logging.getLogger(__name__)
+
+# upper bounds (seconds) of histogram buckets, as the Prometheus client default
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_INTERVAL = 0.01 # time (seconds) between profiler samples
+MAX_STACKS = 10_000 # distinct stacks kept by the profiler
+
+_lock = threading.Lock()
+_help = {} # name -> help text
+_counters = {} # name -> {labels -> value}
+_gauges = {} # name -> {labels -> value}
+_histograms = {} # name -> {labels -> [bucket counts, sum, count]}
+collectors = []
+_samples = {} # collapsed stack -> count
+_samples_lock = threading.Lock()
+_profiler_stop = threading.Event()
+_profiler_thread = None
+
+def _labels(labels: dict) -> tuple:
+    '''Returns labels as a (hashable) sorted tuple of pairs.'''
+    return tuple(sorted(labels.items())) if labels else ()
+
+def describe(name: str, help_text: str) -> type(None):
+    '''Sets the help text of a metric.
+
+    Args:
+        name: metric name, e.g. dashboard_update_seconds
+        help_text: description of metric
+    '''
+    _help[name] = help_text
+
+def inc(name: str, amount: float=1, **labels) -> type(None):
+    '''Increments a counter.
+
+    Args:
+        name: metric name, ending _total
+        amount: increment
+        **labels: label values, e.g. api='news'
+    '''
+    key = _labels(labels)
+    with _lock:
+        values = _counters.setdefault(name, {})
+        values[key] = values.get(key, 0)+amount
+
+def set_counter(name: str, value: float, **labels) -> type(None):
+    '''Sets the value of a counter maintained elsewhere (e.g. by a collector).
+
+    Args:
+        name: metric name, ending _total
+        value: current total
+        **labels: label values
+    '''
+    with _lock:
+        _counters.setdefault(name, {})[_labels(labels)] = value
+
+def set_gauge(name: str, value: float, **labels) -> type(None):
+    '''Sets the value of a gauge.
+
+    Args:
+        name: metric name
+        value: current value
+        **labels: label values
+    '''
+    with _lock:
+        _gauges.setdefault(name, {})[_labels(labels)] = value
+
+def observe(name: str, value: float, **labels) -> type(None):
+    '''Records a value (e.g. a duration in seconds) in a histogram.
+
+    Args:
+        name: metric name, ending _seconds for durations
+        value: observed value
+        **labels: label values
+    '''
+    key = _labels(labels)
+    with _lock:
+        values = _histograms.setdefault(name, {})
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = [[0]*len(BUCKETS), 0, 0]
+        i = bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            histogram[0][i] += 1 # made cumulative when rendered
+        histogram[1] += value
+        histogram[2] += 1
+
+@contextmanager
+def timed(name: str, **labels):
+    '''Times a block, or each call of a decorated function, recording the
+    duration in a histogram. Exceptions are counted and re-raised.
+
+    Args:
+        name: histogram name, ending _seconds
+        **labels: label values
+    '''
+    start = perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc(name.removesuffix('_seconds')+'_errors_total', **labels)
+        raise
+    finally:
+        observe(name, perf_counter()-start, **labels)
+
+def add_collector(collector) -> type(None):
+    '''Adds a function called whenever metrics are rendered, e.g. to set gauges
+    from values held elsewhere.
+
+    Args:
+        collector: function taking no arguments
+    '''
+    if collector not in collectors:
+        collectors.append(collector)
+
+def _format_labels(key: tuple, extra: tuple=()) -> str:
+    '''Formats labels, e.g. {api="news",le="0.5"}.'''
+    pairs = key+extra
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{'+','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped))+'}'
+
+def render_metrics() -> str:
+    '''Returns all metrics, in the Prometheus text exposition format.'''
+    for collector in collectors:
+        try:
+            collector()
+        except Exception:
+            logger_m.exception('metrics collector failed')
+    with _lock: # copied, so formatting does not hold the lock
+        counters = {name: dict(values) for name, values in _counters.items()}
+        gauges = {name: dict(values) for name, values in _gauges.items()}
+        histograms = {name: {key: (list(h[0]), h[1], h[2]) for key, h in values.items()}
+                      for name, values in _histograms.items()}
+    lines = []
+    for kind, metrics in (('counter', counters), ('gauge', gauges)):
+        for name in sorted(metrics):
+            if name in _help:
+                lines.append(f'# HELP {name} {_help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(metrics[name].items()):
+                lines.append(f'{name}{_format_labels(key)} {value}')
+    for name in sorted(histograms):
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, (buckets, total, count) in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{_format_labels(key, (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(key, (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{name}_count{_format_labels(key)} {count}')
+    return '\n'.join(lines)+'\n'
+
+def reset_metrics() -> type(None):
+    '''Removes all recorded values (help texts and collectors are kept).'''
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def _sample(own_id: int) -> type(None):
+    '''Counts the current stack of every other thread.'''
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id == own_id:
+            continue
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        collapsed = ';'.join(reversed(stack))
+        if collapsed in _samples or len(_samples) < MAX_STACKS:
+            _samples[collapsed] = _samples.get(collapsed, 0)+1
+
+def _profile(interval: float) -> type(None):
+    '''Main loop of the profiler thread.'''
+    own_id = threading.get_ident()
+    while not _profiler_stop.wait(interval):
+        with _samples_lock:
+            _sample(own_id)
+
+def start_profiler(interval: float=PROFILE_INTERVAL) -> type(None):
+    '''Starts sampling the stacks of all threads (if not already running).
+
+    Args:
+        interval: time (seconds) between samples (previous samples are discarded)
+    '''
+    global _profiler_thread
+    if _profiler_thread is not None and _profiler_thread.is_alive():
+        return
+    with _samples_lock:
+        _samples.clear()
+    _profiler_stop.clear()
+    _profiler_thread = threading.Thread(target=_profile, args=(interval,),
+                                        name='sampling-profiler', daemon=True)
+    _profiler_thread.start()
+    logger_m.info('sampling profiler started [interval=%s]', interval)
+
+def stop_profiler(timeout: float=None) -> type(None):
+    '''Stops the profiler thread (samples are kept until the next start).
+
+    Args:
+        timeout: maximum time (seconds) to wait for the thread to finish
+    '''
+    global _profiler_thread
+    _profiler_stop.set()
+    if _profiler_thread is not None:
+        _profiler_thread.join(timeout)
+        _profiler_thread = None
+        logger_m.info('sampling profiler stopped')
+
+def profile_report(clear: bool=False) -> str:
+    '''Returns the sampled stacks, most frequent first.
+
+    Args:
+        clear: flag for discarding the samples once reported
+
+    Returns:
+        One line per distinct stack, "file:function;...;file:function count"
+        (outermost call first)
+    '''
+    with _samples_lock:
+        samples = sorted(_samples.items(), key=lambda item: -item[1])
+        if clear:
+            _samples.clear()
+    return ''.join(f'{stack} {count}\n' for stack, count in samples)
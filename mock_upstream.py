@@ -0,0 +1,258 @@
+'''This module handles: a local stand-in for the uk-covid-19 and news apis, so
+the dashboard can be run, load-tested and benchmarked without the network.
+
+Generated (deterministic) payloads are served by default; with a recordings
+directory (see api_transport) recorded responses are served instead. Latency,
+error rates (e.g. 429/500), pagination and payload size are configurable, and
+requests are counted, so concurrency, caching and retries can be stress-tested.
+
+To use, run e.g. "python mock_upstream.py --port 8001 --latency 0.05
+--error-rate 0.1", then set "covid_api_url" to "http://127.0.0.1:8001/v1/data"
+and "news_api_url" to "http://127.0.0.1:8001/v2/everything" in config.json.
+
+Below is a summary of the functions defined within this module
+
+mock_upstream
+    .covid_rows()
+        > generates rows of covid data for an area, newest first
+    .news_articles()
+        > generates news articles
+    .start_server()
+        > starts a server on a background thread
+    .stop_server()
+        > stops a server started with start_server
+    .main()
+        > command line entry point
+'''
+
+import json
+import random
+import logging
+import argparse
+import threading
+from time import sleep
+from datetime import date, timedelta
+from email.utils import formatdate
+from hashlib import sha1
+from zlib import crc32
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import api_transport
+
+logger_mu = logging.getLogger(__name__)
+
+COVID_PATH = '/v1/data'
+NEWS_PATH = '/v2/everything'
+LATEST_DATE = date(2021, 10, 28)
+MAX_DAYS = 700_000 # days before LATEST_DATE, within the range of datetime.date
+LAST_MODIFIED = formatdate(1635433200, usegmt=True) # time of latest covid data
+DEFAULT_OPTIONS = {
+    'latency': 0, # delay (seconds) before each response
+    'jitter': 0, # largest random delay (seconds) added to latency
+    'error_rate': 0, # fraction of requests answered with an error
+    'error_statuses': [429, 500], # statuses of errors, chosen at random
+    'retry_after': 1, # Retry-After (seconds) sent with 429 errors
+    'covid_rows': 700, # rows of covid data for each area
+    'covid_page_size': 1000, # rows per page of covid data
+    'news_articles': 100, # articles matching any search
+    'recordings': None, # directory of recorded responses, served if set
+    'seed': 0, # seed of errors and delays
+}
+
+def covid_rows(location: str, location_type: str, count: int, start: int=0) -> list:
+    '''Generates rows of covid data for an area, newest first, in the format
+    returned from the api (see covid_API_request).
+
+    Args:
+        location: area name
+        location_type: area type
+        count: number of rows
+        start: index of first row (so a single page can be generated)
+
+    Returns:
+        List of row dictionaries
+    '''
+    seed = crc32(f'{location_type}/{location}'.encode())
+    scale = 20 if location_type == 'nation' else 1
+    rows = []
+    for i in range(start, start+count):
+        # values vary deterministically with the row, so pages are consistent
+        # dates repeat after MAX_DAYS, so any number of rows can be generated
+        rows.append({'date': (LATEST_DATE-timedelta(days=i%MAX_DAYS)).isoformat(),
+                     'areaName': location, 'areaType': location_type,
+                     'newCasesByPublishDate': (500+(seed+i*7919)%2000)*scale,
+                     'cumDeaths28DaysByPublishDate': None if i < 3 else 7000*scale-i,
+                     'hospitalCases': None if i < 2 else (200+(seed+i*104729)%250)*scale})
+    return rows
+
+def news_articles(start: int, count: int) -> list:
+    '''Generates news articles, in the format returned from the api.
+
+    Args:
+        start: index of first article (so pages hold distinct articles)
+        count: number of articles
+
+    Returns:
+        List of article dictionaries
+    '''
+    return [{'source': {'id': None, 'name': f'Source {i%7}'},
+             'author': f'Author {i%13}', 'title': f'Covid article {i}',
+             'description': f'Description of article {i}. ',
+             'url': f'https://news.example.com/articles/{i}',
+             'urlToImage': None, 'publishedAt': '2021-10-28T12:00:00Z',
+             'content': f'Content of article {i}'}
+            for i in range(start, start+count)]
+
+class _Handler(BaseHTTPRequestHandler):
+    '''Handles a single request to the mock apis.'''
+
+    protocol_version = 'HTTP/1.1' # keep-alive, as with the real apis
+
+    def log_message(self, format, *args):
+        logger_mu.debug(format, *args)
+
+    def _send(self, status: int, body: bytes=b'', headers: dict=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict, headers: dict=None):
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        self._send(status, json.dumps(data).encode(), headers)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        options = server.options
+        path = urlsplit(self.path).path
+        with server.stats_lock:
+            server.stats['requests'] += 1
+            delay = options['latency']+server.rng.uniform(0, options['jitter'])
+            failed = server.rng.random() < options['error_rate']
+            status = server.rng.choice(options['error_statuses'])
+        if delay:
+            sleep(delay)
+        if failed:
+            with server.stats_lock:
+                server.stats['errors'] += 1
+            headers = {'Retry-After': str(options['retry_after'])} if status == 429 else {}
+            self._send_json(status, {'status': 'error', 'code': 'mockError',
+                                     'message': f'mock error {status}'}, headers)
+        elif options['recordings']:
+            self._replay()
+        elif path == COVID_PATH:
+            self._covid()
+        elif path == NEWS_PATH:
+            self._news()
+        else:
+            self._send_json(404, {'status': 'error', 'message': 'not found'})
+
+    def _replay(self):
+        key = api_transport.recording_key(self.command, self.path)
+        recording = api_transport.load_recording(self.server.options['recordings'], key)
+        if recording is None:
+            self._send_json(404, {'status': 'error', 'message': f'not recorded: {key}'})
+            return
+        self._send(recording['status'], recording['body'].encode(), recording['headers'])
+
+    def _covid(self):
+        options = self.server.options
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        filters = dict(f.split('=', 1) for f in params.get('filters', '').split(';') if '=' in f)
+        page = int(params.get('page', 1))
+        page_size = options['covid_page_size']
+        start = (page-1)*page_size
+        rows = covid_rows(filters.get('areaName', 'England'), filters.get('areaType', 'nation'),
+                          max(min(page_size, options['covid_rows']-start), 0), start)
+        headers = {'Last-Modified': LAST_MODIFIED}
+        if not rows:
+            self._send(204, headers=headers) # past the final page
+            return
+        structure = json.loads(params.get('structure', 'null')) or {}
+        if structure: # only the requested metrics, renamed as in the structure
+            rows = [{name: row.get(metric) for name, metric in structure.items()}
+                    for row in rows]
+        self._send_json(200, {'length': len(rows), 'maxPageLimit': page_size,
+                              'totalRecords': options['covid_rows'], 'data': rows,
+                              'requestPayload': {'page': page}, 'pagination': {}},
+                        headers)
+
+    def _news(self):
+        options = self.server.options
+        if not self.headers.get('X-Api-Key') and 'apiKey' not in self.path:
+            self._send_json(401, {'status': 'error', 'code': 'apiKeyMissing',
+                                  'message': 'api key missing'})
+            return
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        page_size = min(int(params.get('pageSize', 20)), 100)
+        start = (int(params.get('page', 1))-1)*page_size
+        count = max(min(page_size, options['news_articles']-start), 0)
+        body = json.dumps({'status': 'ok', 'totalResults': options['news_articles'],
+                           'articles': news_articles(start, count)}).encode()
+        etag = '"'+sha1(body).hexdigest()+'"'
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers={'ETag': etag})
+            return
+        self._send(200, body, {'Content-Type': 'application/json', 'ETag': etag})
+
+def start_server(host: str='127.0.0.1', port: int=0, **options) -> ThreadingHTTPServer:
+    '''Starts a mock api server on a background (daemon) thread.
+
+    Args:
+        host: address to listen on
+        port: port to listen on, 0 for any free port
+        **options: see DEFAULT_OPTIONS
+
+    Returns:
+        The server - with server_address, options (which may be changed while
+        running) and stats {requests, errors}
+    '''
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.options = dict(DEFAULT_OPTIONS, **options)
+    server.rng = random.Random(server.options['seed'])
+    server.stats = {'requests': 0, 'errors': 0}
+    server.stats_lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, name='mock-upstream', daemon=True)
+    thread.start()
+    logger_mu.info('mock upstream started [port=%d]', server.server_address[1])
+    return server
+
+def stop_server(server: ThreadingHTTPServer) -> type(None):
+    '''Stops a server started with start_server.'''
+    server.shutdown()
+    server.server_close()
+
+def main(args: list=None) -> type(None):
+    '''Runs a mock api server from the command line, until interrupted.'''
+    parser = argparse.ArgumentParser(description='Mock uk-covid-19 and news apis')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-statuses', type=int, nargs='+', default=[429, 500])
+    parser.add_argument('--covid-rows', type=int, default=DEFAULT_OPTIONS['covid_rows'])
+    parser.add_argument('--covid-page-size', type=int,
+                        default=DEFAULT_OPTIONS['covid_page_size'])
+    parser.add_argument('--news-articles', type=int,
+                        default=DEFAULT_OPTIONS['news_articles'])
+    parser.add_argument('--recordings', help='directory of recorded responses to serve')
+    options = vars(parser.parse_args(args))
+    host, port = options.pop('host'), options.pop('port')
+    server = start_server(host, port, **options)
+    print(f'mock apis at http://{host}:{server.server_address[1]}{COVID_PATH} '
+          f'and http://{host}:{server.server_address[1]}{NEWS_PATH}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stop_server(server)
+
+if __name__=='__main__':
+    main()
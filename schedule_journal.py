@@ -0,0 +1,178 @@
+'''This module handles: keeping the update schedule on disk, so scheduled (and
+repeating) updates survive a restart of the dashboard.
+
+The queued jobs of update_scheduler, along with the entries shown for them in
+the interface, are stored in a SQLite database (in WAL mode, each change in
+its own transaction, so a crash loses at most the change being written). The
+scheduler rebuilds its heap from the journal on startup (see
+update_scheduler.restore).
+
+The journal is enabled by setting "schedule_journal_path" in config.json, and
+is always kept when state is shared between processes (see shared_backend) -
+in the shared database, unless a path is set - so a newly elected leader takes
+over the scheduled updates. Otherwise every function does nothing.
+
+Below is a summary of the functions defined within this module
+
+schedule_journal
+    .configure()
+        > opens the journal, if enabled in config.json (or state is shared)
+    .is_enabled()
+        > checks if the schedule is journalled
+    .save_job()
+        > stores (or replaces) a queued job
+    .delete_jobs()
+        > removes the stored jobs of a label
+    .load_jobs()
+        > returns every stored job
+    .save_entry()
+        > stores the interface entry of a label
+    .delete_entry()
+        > removes the interface entry of a label
+    .load_entries()
+        > returns every stored interface entry
+'''
+
+import logging
+import sqlite3
+import threading
+import config_service
+import shared_backend
+
+logger_sj = logging.getLogger(__name__)
+
+global db_path
+db_path = None
+_local = threading.local() # sqlite connections are not shared between threads
+
+def configure(path: str=None) -> bool:
+    '''Opens the journal, creating its tables if needed.
+
+    Args:
+        path: database filename, defaults to schedule_journal_path in config.json,
+            or the shared database if state is shared between processes
+
+    Returns:
+        True if the schedule is journalled
+    '''
+    global db_path
+    if path is None:
+        path = config_service.get('schedule_journal_path')
+        if not path and shared_backend.is_enabled():
+            path = shared_backend.db_path
+    if not path:
+        db_path = None
+        return False
+    db_path = path
+    try:
+        with _connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs '
+                               '(label TEXT, target TEXT, time REAL, repeating INTEGER, '
+                               'PRIMARY KEY (label, target))')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(label TEXT PRIMARY KEY, content TEXT)')
+    except sqlite3.Error:
+        logger_sj.exception('schedule journal could not be opened [path=%s]', path)
+        db_path = None
+        return False
+    logger_sj.info('schedule journal enabled [path=%s]', path)
+    return True
+
+def is_enabled() -> bool:
+    '''Checks if the schedule is journalled.'''
+    return db_path is not None
+
+def _connection() -> sqlite3.Connection:
+    '''Returns this thread's connection to the journal.'''
+    connection = getattr(_local, 'connection', None)
+    if connection is None or getattr(_local, 'path', None) != db_path:
+        connection = sqlite3.connect(db_path, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        _local.connection, _local.path = connection, db_path
+    return connection
+
+def _write(statement: str, parameters: tuple) -> type(None):
+    '''Runs a statement in its own transaction (if the journal is enabled),
+    logging rather than raising errors - the schedule in memory is unaffected.'''
+    if db_path is None:
+        return
+    try:
+        with _connection() as connection:
+            connection.execute(statement, parameters)
+    except sqlite3.Error:
+        logger_sj.exception('schedule journal write failed')
+
+def save_job(label: str, target: str, fire_time: float, repeating: bool) -> type(None):
+    '''Stores a queued job, replacing any job of the same label and target.
+
+    Args:
+        label: label of update in interface
+        target: name of update target, e.g. news
+        fire_time: time of the (next) update, in seconds since the epoch
+        repeating: flag for repeating updates
+    '''
+    _write('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)',
+           (label, target, fire_time, int(repeating)))
+
+def delete_jobs(label: str, target: str=None) -> type(None):
+    '''Removes the stored jobs of a label.
+
+    Args:
+        label: label of update in interface
+        target: name of update target, None for every target
+    '''
+    if target is None:
+        _write('DELETE FROM jobs WHERE label = ?', (label,))
+    else:
+        _write('DELETE FROM jobs WHERE label = ? AND target = ?', (label, target))
+
+def load_jobs() -> list:
+    '''Returns every stored job.
+
+    Returns:
+        List of (time, label, target, repeating) tuples, oldest first - empty if
+        the journal is disabled (or cannot be read)
+    '''
+    if db_path is None:
+        return []
+    try:
+        rows = _connection().execute('SELECT time, label, target, repeating FROM jobs '
+                                     'ORDER BY time').fetchall()
+    except sqlite3.Error:
+        logger_sj.exception('schedule journal read failed')
+        return []
+    return [(fire_time, label, target, bool(repeating))
+            for fire_time, label, target, repeating in rows]
+
+def save_entry(label: str, content: str) -> type(None):
+    '''Stores the interface entry of a label (see main.handle_request_args).
+
+    Args:
+        label: label of update in interface
+        content: description of update in interface
+    '''
+    _write('INSERT OR REPLACE INTO entries VALUES (?, ?)', (label, content))
+
+def delete_entry(label: str) -> type(None):
+    '''Removes the interface entry of a label.
+
+    Args:
+        label: label of update in interface
+    '''
+    _write('DELETE FROM entries WHERE label = ?', (label,))
+
+def load_entries() -> list:
+    '''Returns every stored interface entry.
+
+    Returns:
+        List of {title, content} dictionaries, as held in the interface's updates
+    '''
+    if db_path is None:
+        return []
+    try:
+        rows = _connection().execute('SELECT label, content FROM entries').fetchall()
+    except sqlite3.Error:
+        logger_sj.exception('schedule journal read failed')
+        return []
+    return [{'title': label, 'content': content} for label, content in rows]
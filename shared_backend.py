@@ -0,0 +1,251 @@
+'''This module handles: sharing the dashboard between worker processes (e.g.
+when main.app is run under gunicorn with several workers).
+
+Values displayed in the interface are stored in a SQLite database in WAL mode
+(so readers do not block the writer), along with a shared version number.
+Requests which change the schedule (or dismiss articles) are queued in the
+database as commands. A lock file elects a single leader process, which runs
+the scheduler, makes all upstream api requests and applies queued commands;
+if the leader exits, another process takes over its lock.
+
+Sharing is enabled by setting "shared_state_path" in config.json, and requires
+fcntl (i.e. is not available on Windows).
+
+Below is a summary of the functions defined within this module
+
+shared_backend
+    .configure()
+        > opens the database, if sharing is enabled in config.json
+    .is_enabled()
+        > checks if state is shared between processes
+    .is_leader()
+        > checks if this process is the elected leader
+    .write_value()
+        > stores a value, returning the new shared version
+    .read_version()
+        > returns the current shared version
+    .read_values()
+        > returns the shared version, along with all stored values
+    .file_lock()
+        > returns a lock file, held (across processes) with acquire_file_lock
+    .acquire_file_lock()
+        > blocks until a lock file is held
+    .release_file_lock()
+        > releases a lock file
+    .submit_command()
+        > queues a command, to be applied by the leader
+    .start()
+        > starts the election/command thread
+    .stop()
+        > stops the election/command thread
+'''
+
+import os
+import pickle
+import logging
+import sqlite3
+import threading
+import config_service
+from json import dumps, loads
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+logger_sb = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5 # time (seconds) between leader election/command checks
+
+global db_path
+db_path = None
+_leader = threading.Event()
+_stop_event = threading.Event()
+_local = threading.local() # sqlite connections are not shared between threads
+_leader_file = None
+_thread = None
+
+def configure(path: str=None) -> bool:
+    '''Opens the shared database, creating its tables if needed.
+
+    Args:
+        path: database filename, defaults to shared_state_path in config.json
+
+    Returns:
+        True if state is shared between processes
+    '''
+    global db_path
+    if path is None:
+        path = config_service.get('shared_state_path')
+    if not path:
+        return False
+    if fcntl is None:
+        logger_sb.warning('shared state requires fcntl, running as a single process')
+        return False
+    db_path = path
+    with _connection() as connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS state '
+                           '(key TEXT PRIMARY KEY, value BLOB)')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta '
+                           '(name TEXT PRIMARY KEY, number INTEGER)')
+        connection.execute('CREATE TABLE IF NOT EXISTS commands '
+                           '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'command TEXT, args TEXT)')
+        connection.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+    logger_sb.info('shared state enabled [path=%s]', path)
+    return True
+
+def is_enabled() -> bool:
+    '''Checks if state is shared between processes.'''
+    return db_path is not None
+
+def is_leader() -> bool:
+    '''Checks if this process is the leader (always True if sharing is disabled).'''
+    return db_path is None or _leader.is_set()
+
+def _connection() -> sqlite3.Connection:
+    '''Returns this thread's connection to the database.'''
+    connection = getattr(_local, 'connection', None)
+    if connection is None or getattr(_local, 'path', None) != db_path:
+        connection = sqlite3.connect(db_path, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        _local.connection, _local.path = connection, db_path
+    return connection
+
+def write_value(key: str, value) -> int:
+    '''Stores a value, and increments the shared version.
+
+    Args:
+        key: name of value
+        value: value to be stored (pickled)
+
+    Returns:
+        The new shared version
+    '''
+    with _connection() as connection: # single transaction
+        connection.execute("UPDATE meta SET number = number+1 WHERE name = 'version'")
+        connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                           (key, pickle.dumps(value)))
+        return connection.execute("SELECT number FROM meta "
+                                  "WHERE name = 'version'").fetchone()[0]
+
+def read_version() -> int:
+    '''Returns the current shared version.'''
+    return _connection().execute("SELECT number FROM meta "
+                                 "WHERE name = 'version'").fetchone()[0]
+
+def read_values() -> tuple[int, dict]:
+    '''Reads all stored values.
+
+    Returns:
+        The shared version, along with a dictionary of stored values
+    '''
+    with _connection() as connection: # consistent read of version and values
+        version = connection.execute("SELECT number FROM meta "
+                                     "WHERE name = 'version'").fetchone()[0]
+        rows = connection.execute('SELECT key, value FROM state').fetchall()
+    return version, {key: pickle.loads(value) for key, value in rows}
+
+def file_lock(name: str):
+    '''Opens a lock file alongside the database.
+
+    Args:
+        name: name of lock, e.g. the key of the value it protects
+
+    Returns:
+        Open file, to be passed to acquire_file_lock and release_file_lock
+    '''
+    return open(f'{db_path}.{name}.lock', 'a')
+
+def acquire_file_lock(lock_file, blocking: bool=True) -> bool:
+    '''Acquires an exclusive lock on a lock file (across processes).
+
+    Args:
+        lock_file: file returned from file_lock
+        blocking: flag for waiting until the lock is available
+
+    Returns:
+        True if the lock is now held
+    '''
+    try:
+        fcntl.flock(lock_file.fileno(),
+                    fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def release_file_lock(lock_file) -> type(None):
+    '''Releases a lock acquired with acquire_file_lock.'''
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def submit_command(command: str, args: dict) -> type(None):
+    '''Queues a command, to be applied by the leader process.
+
+    Args:
+        command: name of command, e.g. schedule
+        args: json serialisable arguments of command
+    '''
+    with _connection() as connection:
+        connection.execute('INSERT INTO commands (command, args) VALUES (?, ?)',
+                           (command, dumps(args)))
+    logger_sb.info('command queued for leader [command=%s]', command)
+
+def _apply_commands(handler) -> type(None):
+    '''Applies (and removes) all queued commands, in order.'''
+    with _connection() as connection:
+        rows = connection.execute('SELECT id, command, args FROM commands '
+                                  'ORDER BY id').fetchall()
+        if rows:
+            connection.execute('DELETE FROM commands WHERE id <= ?', (rows[-1][0],))
+    for _, command, args in rows:
+        try:
+            handler(command, loads(args))
+        except Exception:
+            logger_sb.exception('queued command failed [command=%s]', command)
+
+def _run(on_leader, handler) -> type(None):
+    '''Main loop of the election/command thread.'''
+    global _leader_file
+    _leader_file = file_lock('leader')
+    while not _stop_event.is_set():
+        if not _leader.is_set() and acquire_file_lock(_leader_file, blocking=False):
+            _leader.set()
+            logger_sb.info('elected leader [pid=%d]', os.getpid())
+            try:
+                on_leader()
+            except Exception:
+                logger_sb.exception('leader start up failed')
+        if _leader.is_set():
+            _apply_commands(handler)
+        _stop_event.wait(POLL_INTERVAL)
+    if _leader.is_set():
+        release_file_lock(_leader_file)
+        _leader.clear()
+    _leader_file.close()
+
+def start(on_leader, handler) -> type(None):
+    '''Starts the thread which elects the leader, and applies queued commands.
+
+    Args:
+        on_leader: called (once) if this process becomes the leader
+        handler: called with (command, args) for each queued command, by the leader
+    '''
+    global _thread
+    if not is_enabled() or (_thread is not None and _thread.is_alive()):
+        return
+    _stop_event.clear()
+    _thread = threading.Thread(target=_run, args=(on_leader, handler),
+                               name='shared-backend', daemon=True)
+    _thread.start()
+
+def stop(timeout: float=None) -> type(None):
+    '''Stops the election/command thread, giving up leadership.
+
+    Args:
+        timeout: maximum time (seconds) to wait for the thread to finish
+    '''
+    global _thread
+    _stop_event.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
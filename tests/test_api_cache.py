@@ -0,0 +1,28 @@
+import api_cache
+
+def test_cache_hit_and_miss():
+    api_cache.clear_cache()
+    assert api_cache.cache_get(('news', 'covid', 20)) is None
+    api_cache.cache_put(('news', 'covid', 20), {'status': 'ok'})
+    assert api_cache.cache_get(('news', 'covid', 20)) == {'status': 'ok'}
+    stats = api_cache.get_cache_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['size'] == 1
+
+def test_cache_expiry(monkeypatch):
+    api_cache.clear_cache()
+    monkeypatch.setitem(api_cache.CACHE_TTLS, 'news', 0)
+    api_cache.cache_put(('news', 'covid', 20), {'status': 'ok'}, etag='"abc"')
+    assert api_cache.cache_get(('news', 'covid', 20)) is None
+    assert api_cache.cache_lookup(('news', 'covid', 20))['etag'] == '"abc"'
+    assert api_cache.cache_refresh(('news', 'covid', 20)) == {'status': 'ok'}
+
+def test_cache_lru_eviction(monkeypatch):
+    api_cache.clear_cache()
+    monkeypatch.setattr(api_cache, 'MAX_ENTRIES', 2)
+    api_cache.cache_put(('covid', 1), 1)
+    api_cache.cache_put(('covid', 2), 2)
+    api_cache.cache_get(('covid', 1)) # 2 is now least recently used
+    api_cache.cache_put(('covid', 3), 3)
+    assert api_cache.cache_lookup(('covid', 2)) is None
+    assert api_cache.cache_get(('covid', 1)) == 1
+    assert api_cache.get_cache_stats()['evictions'] == 1
@@ -0,0 +1,71 @@
+import area_registry
+import covid_data_handler
+import mock_upstream
+
+def test_register_and_find_area():
+    row = area_registry.register_area('Registry Test', 'ltla', 'E00000001', 'Wales')
+    assert area_registry.register_area('registry test', 'ltla', nation='Wales') == row
+    assert area_registry.find_area('REGISTRY TEST') == row
+    assert area_registry.find_area('e00000001') == row
+    assert area_registry.get_area(row) == ('Registry Test', 'ltla', 'E00000001', 'Wales')
+    assert area_registry.find_area('Not Registered') is None
+    assert area_registry.register_area(None, 'ltla') is None
+
+def test_changed_area_details():
+    row = area_registry.register_area('Changed Test', 'ltla', 'E00000004', 'Wales')
+    changed = area_registry.register_area('Changed Test', 'utla', nation='Wales')
+    assert changed != row # stats of the old type are not reused
+    assert area_registry.find_area('changed test') == changed
+    assert area_registry.find_area('E00000004') == changed
+    assert area_registry.get_area(changed) == ('Changed Test', 'utla', 'E00000004', 'Wales')
+
+def test_build_table():
+    row = area_registry.register_area('Table Test', 'ltla', nation='Scotland')
+    table = area_registry.build_table({row: 120}, {'Scotland': (4000, 300, None)})
+    assert area_registry.table_stats(table, row) == ('Table Test', 120, 'Scotland',
+                                                     4000, 300, None)
+    assert area_registry.table_stats(table, len(table[0])) is None # registered later
+    assert area_registry.table_stats(None, row) is None
+
+def test_get_area_stats(monkeypatch):
+    rows = [area_registry.register_area(f'Batch Test {i}', 'ltla', nation='England')
+            for i in range(3)]
+    requested = []
+    def fake_requests(areas, **kwargs):
+        requested.extend(areas)
+        return {area: None if area[0] == 'Batch Test 2' else
+                {'data': mock_upstream.covid_rows(*area, 30)} for area in areas}
+    monkeypatch.setattr(covid_data_handler, 'covid_API_requests', fake_requests)
+    monkeypatch.setattr(covid_data_handler, 'AREA_BATCH', 2)
+    table = covid_data_handler.get_area_stats(rows)
+    assert requested.count(('England', 'nation')) == 1 # shared by every area
+    assert len(requested) == 4
+    nation = covid_data_handler.get_stats_from_json(
+        {'data': mock_upstream.covid_rows('England', 'nation', 30)},
+        'newCasesByPublishDate', 7, True)[1]
+    stats = area_registry.table_stats(table, rows[0])
+    assert stats[:4] == ('Batch Test 0', covid_data_handler.get_stats_from_json(
+        {'data': mock_upstream.covid_rows('Batch Test 0', 'ltla', 30)},
+        'newCasesByPublishDate', 7, True)[1], 'England', nation)
+    assert area_registry.table_stats(table, rows[2])[1] is None # request failed
+
+def test_merge_tables():
+    row = area_registry.register_area('Merge Test', 'ltla', nation='Scotland')
+    previous = area_registry.build_table({row: 120}, {'Scotland': (4000, 300, 10)})
+    table = area_registry.build_table({}, {'Scotland': (4100, None, None)}) # partly failed
+    merged = area_registry.merge_tables(table, previous)
+    assert area_registry.table_stats(merged, row) == ('Merge Test', 120, 'Scotland',
+                                                      4100, 300, 10)
+    assert area_registry.merge_tables(area_registry.build_table({}, {}), previous) is None
+
+def test_get_area_stats_configured(monkeypatch):
+    row = area_registry.register_area('Configured Test', 'ltla', nation='England')
+    area_registry.register_area('Unconfigured Test', 'ltla', nation='England')
+    monkeypatch.setattr(area_registry, 'load_areas', lambda config=None: [row])
+    requested = []
+    def fake_requests(areas, **kwargs):
+        requested.extend(areas)
+        return {area: None for area in areas}
+    monkeypatch.setattr(covid_data_handler, 'covid_API_requests', fake_requests)
+    covid_data_handler.get_area_stats()
+    assert requested == [('England', 'nation'), ('Configured Test', 'ltla')]
@@ -0,0 +1,99 @@
+import asyncio
+import covid_data_handler
+import covid_news_handling
+
+def call_app(app, path, query=b'', headers=(), method='GET'):
+    sent = []
+    async def receive():
+        return {'type': 'http.request'}
+    async def send(message):
+        sent.append(message)
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query, 'headers': list(headers)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+def test_asgi_index(monkeypatch):
+    monkeypatch.setattr(covid_data_handler, 'update_covid_data', lambda: None)
+    monkeypatch.setattr(covid_news_handling, 'update_news', lambda *a, **k: None)
+    import asgi_main
+    status, headers, body = call_app(asgi_main.app, '/index')
+    assert status == 200 and b'Covid Dashboard' in body
+    status, _, body = call_app(asgi_main.app, '/index',
+                               headers=[(b'if-none-match', headers[b'etag'])])
+    assert status == 304 and body == b''
+    status, _, body = call_app(asgi_main.app, '/index', headers=[
+        (b'if-none-match', b'"other", W/' + headers[b'etag'])]) # weak, in a list
+    assert status == 304
+    length = headers[b'content-length']
+    status, headers, body = call_app(asgi_main.app, '/index', method='HEAD')
+    assert status == 200 and body == b'' and headers[b'content-length'] == length
+    status, headers, body = call_app(asgi_main.app, '/static/images/nhs_logo.png')
+    assert status == 200 and headers[b'content-type'] == b'image/png'
+    assert call_app(asgi_main.app, '/static/../main.py')[0] == 404
+
+def test_asgi_events(monkeypatch):
+    monkeypatch.setattr(covid_data_handler, 'update_covid_data', lambda: None)
+    monkeypatch.setattr(covid_news_handling, 'update_news', lambda *a, **k: None)
+    import asgi_main
+    import dashboard_state
+    sent = []
+    async def run():
+        disconnect = asyncio.Event()
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+        async def send(message):
+            sent.append(message)
+            if b'"title": "live"' in message.get('body', b''):
+                disconnect.set()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/events',
+                 'query_string': b'', 'headers': []}
+        app = asyncio.ensure_future(asgi_main.app(scope, receive, send))
+        await asyncio.sleep(0.1)
+        dashboard_state.publish('updates', ({'title': 'live', 'content': ''},))
+        await asyncio.wait_for(app, 5)
+    asyncio.run(run())
+    dashboard_state.publish('updates', ())
+    assert sent[0]['headers'][0] == (b'content-type', b'text/event-stream')
+    assert b'"added": [[0, {"title": "live"' in sent[-1]['body']
+
+def test_asgi_index_area(monkeypatch):
+    monkeypatch.setattr(covid_data_handler, 'update_covid_data', lambda: None)
+    monkeypatch.setattr(covid_news_handling, 'update_news', lambda *a, **k: None)
+    import asgi_main
+    import area_registry
+    import dashboard_state
+    row = area_registry.register_area('Page Test', 'ltla', 'E00000002', 'England')
+    status, _, body = call_app(asgi_main.app, '/index', b'area=E00000002')
+    assert status == 200 and b'Page Test' in body and b'loading...' in body
+    dashboard_state.publish('area_stats', area_registry.build_table(
+        {row: 4321}, {'England': (10, 20, 30)}))
+    status, _, body = call_app(asgi_main.app, '/index', b'area=page%20test')
+    assert b'4321' in body and b'name="area" value="Page Test"' in body
+
+def test_asgi_analytics(monkeypatch, tmp_path):
+    monkeypatch.setattr(covid_data_handler, 'update_covid_data', lambda: None)
+    monkeypatch.setattr(covid_news_handling, 'update_news', lambda *a, **k: None)
+    import asgi_main
+    import area_registry
+    import covid_store
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    area_registry.register_area('Analytics Page Test', 'ltla', 'E00000003', 'England')
+    status, headers, body = call_app(asgi_main.app, '/analytics', b'area=E00000003&days=14')
+    assert status == 200 and b'"days": 14' in body and b'"metrics": null' in body
+    assert call_app(asgi_main.app, '/analytics', b'area=E00000003&days=x')[0] == 404
+    assert call_app(asgi_main.app, '/analytics', b'area=nowhere')[0] == 404
+
+def test_asgi_api(monkeypatch):
+    monkeypatch.setattr(covid_data_handler, 'update_covid_data', lambda: None)
+    monkeypatch.setattr(covid_news_handling, 'update_news', lambda *a, **k: None)
+    import asgi_main
+    import dashboard_state
+    dashboard_state.publish('covid_data', ('Exeter', 10, 'England', 20, 30, 40))
+    status, headers, body = call_app(asgi_main.app, '/api/stats')
+    assert status == 200 and b'"local_7day_infections":10' in body
+    etag = dict(headers)[b'etag']
+    assert call_app(asgi_main.app, '/api/stats', headers=[(b'if-none-match', etag)])[0] == 304
+    assert call_app(asgi_main.app, '/api/stats', b'area=nowhere')[0] == 404
+    assert call_app(asgi_main.app, '/api/nothing')[0] == 404
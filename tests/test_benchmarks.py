@@ -0,0 +1,19 @@
+import sys
+sys.path.insert(0, 'benchmarks')
+import run_benchmarks
+import fixtures
+
+def test_compare():
+    baseline = {'results': {'a': {'median': 1.0}, 'b': {'median': 1.0}}}
+    results = {'results': {'a': {'median': 1.1}, 'b': {'median': 1.5},
+                           'c': {'median': 9.0}}} # c is not in the baseline
+    assert run_benchmarks.compare(results, baseline, 0.2) == [('b', 1.0, 1.5, 1.5)]
+
+def test_csv_fixture(tmp_path):
+    import covid_data_handler
+    filename = str(tmp_path/'covid.csv')
+    fixtures.write_csv_fixture(filename, 100)
+    stats = covid_data_handler.process_covid_csv_data(
+        covid_data_handler.parse_csv_data(filename))
+    assert len(stats) == 3 and all(isinstance(stat, int) for stat in stats)
+    assert run_benchmarks.measure(lambda: None, rounds=5)['rounds'] == 5
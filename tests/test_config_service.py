@@ -0,0 +1,65 @@
+import os
+import config_service
+
+def test_validate_config():
+    with open('config.json') as config:
+        from json import load
+        assert config_service.validate_config(load(config)) == []
+    problems = config_service.validate_config({'location': 1, 'api_keys': {}})
+    assert 'location is not a str' in problems
+    assert 'api_keys.news_api is missing' in problems
+
+def test_reload_on_change(tmp_path, monkeypatch):
+    path = tmp_path/'config.json'
+    valid = ('{"location": "%s", "location_type": "ltla", "news_search_terms": "Covid",'
+             ' "api_keys": {"news_api": "key"}, "log_file_path": "/log.log"}')
+    path.write_text(valid % 'Exeter')
+    monkeypatch.setattr(config_service, 'CONFIG_PATH', str(path))
+    monkeypatch.setattr(config_service, '_config', None)
+    monkeypatch.setattr(config_service, '_file_state', None)
+    monkeypatch.setattr(config_service, 'change_callbacks', [])
+    changes = []
+    config_service.on_change(lambda keys, config: changes.append(keys), ['location'])
+    assert config_service.get('location') == 'Exeter'
+    config = config_service.load_config()
+    assert config_service.load_config(force=True) is config # unchanged, not reparsed
+    path.write_text(valid % 'Plymouth!') # size changes, as mtime may not
+    assert config_service.load_config(force=True)['location'] == 'Plymouth!'
+    assert changes == [{'location'}]
+    path.write_text('{"location": 1}') # invalid, so ignored
+    assert config_service.load_config(force=True)['location'] == 'Plymouth!'
+
+def test_override(tmp_path, monkeypatch):
+    path = tmp_path/'config.json'
+    valid = ('{"location": "%s", "location_type": "ltla", "news_search_terms": "Covid",'
+             ' "api_keys": {"news_api": "key"}, "log_file_path": "/log.log"}')
+    path.write_text(valid % 'Exeter')
+    monkeypatch.setattr(config_service, 'CONFIG_PATH', str(path))
+    monkeypatch.setattr(config_service, '_config', None)
+    monkeypatch.setattr(config_service, '_file_config', None)
+    monkeypatch.setattr(config_service, '_file_state', None)
+    monkeypatch.setattr(config_service, '_overrides', {})
+    monkeypatch.setattr(config_service, 'change_callbacks', [])
+    config_service.override({'news_api_url': 'http://127.0.0.1/news'})
+    assert config_service.get('news_api_url') == 'http://127.0.0.1/news'
+    path.write_text(valid % 'Plymouth!')
+    assert config_service.load_config(force=True)['location'] == 'Plymouth!'
+    assert config_service.get('news_api_url') == 'http://127.0.0.1/news' # kept on reload
+    config_service.override(None)
+    assert config_service.get('news_api_url') is None
+    assert config_service.get('location') == 'Plymouth!'
+
+def test_invalid_first_config(tmp_path, monkeypatch):
+    path = tmp_path/'config.json'
+    path.write_text('{"location": 1}')
+    monkeypatch.setattr(config_service, 'CONFIG_PATH', str(path))
+    monkeypatch.setattr(config_service, '_config', None)
+    monkeypatch.setattr(config_service, '_file_config', None)
+    monkeypatch.setattr(config_service, '_file_state', None)
+    monkeypatch.setattr(config_service, 'change_callbacks', [])
+    assert config_service.get('location') == 'Exeter' # template defaults
+    assert config_service.get('api_keys') == {'news_api': '[api-key]'}
+    monkeypatch.setattr(config_service, 'TEMPLATE_PATH', str(tmp_path/'missing.json'))
+    monkeypatch.setattr(config_service, '_config', None)
+    monkeypatch.setattr(config_service, '_file_state', None)
+    assert config_service.load_config(force=True) is None
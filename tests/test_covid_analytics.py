@@ -0,0 +1,73 @@
+import area_registry
+import covid_analytics
+import covid_store
+import mock_upstream
+
+def test_window_stats():
+    rows = mock_upstream.covid_rows('Analytics Test', 'ltla', 30)
+    series = covid_analytics.series_from_rows(rows)
+    cases = [row['newCasesByPublishDate'] for row in rows] # newest first
+    # the latest (incomplete) day is skipped
+    assert covid_analytics.window_total(series, 'newCasesByPublishDate') == sum(cases[1:8])
+    assert covid_analytics.window_total(series, 'newCasesByPublishDate', 7, offset=7) \
+        == sum(cases[8:15])
+    assert covid_analytics.window_average(series, 'newCasesByPublishDate', 14) \
+        == sum(cases[1:15])/14
+    assert covid_analytics.week_over_week(series, 'newCasesByPublishDate') \
+        == (sum(cases[1:8])-sum(cases[8:15]))/sum(cases[8:15])*100
+    assert covid_analytics.window_total(series, 'newCasesByPublishDate', 0) is None
+    assert covid_analytics.per_100k(50, 200_000) == 25
+    assert covid_analytics.per_100k(50, None) is None
+    assert covid_analytics.series_from_rows(None) is None
+
+def test_area_analytics(monkeypatch, tmp_path):
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    row = area_registry.register_area('Analytics Store Test', 'ltla', nation='England',
+                                      population=100_000)
+    rows = mock_upstream.covid_rows('Analytics Store Test', 'ltla', 30)
+    covid_store.append_rows('Analytics Store Test', 'ltla', rows[::-1])
+    data = covid_analytics.area_analytics('analytics store test', 7)
+    cases = data['metrics']['newCasesByPublishDate']
+    assert data['area'] == 'Analytics Store Test' and data['nation'] == 'England'
+    assert cases['total'] == sum(r['newCasesByPublishDate'] for r in rows[1:8])
+    assert cases['total_per_100k'] == cases['total']
+    assert cases['latest_date'] == rows[1]['date']
+    assert covid_analytics.series_from_store('Analytics Store Test', 'ltla') \
+        is covid_analytics.series_from_store('Analytics Store Test', 'ltla') # cached
+    assert covid_analytics.area_analytics('Not Registered') is None
+    assert covid_analytics.area_analytics('Analytics Store Test', 0) is None
+    assert area_registry.get_population(row) == 100_000
+
+def test_render_analytics(monkeypatch, tmp_path):
+    import config_service
+    import main
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    row = area_registry.register_area('Analytics Render Test', 'ltla', nation='England')
+    rows = mock_upstream.covid_rows('Analytics Render Test', 'ltla', 30)
+    covid_store.append_rows('Analytics Render Test', 'ltla', rows[::-1])
+    get = config_service.get
+    monkeypatch.setattr(config_service, 'get', lambda key, default=None:
+                        True if key == 'show_analytics' else get(key, default))
+    values = {'covid_data': None, 'covid_news': [], 'updates': [], 'area_stats': None}
+    with main.app.app_context():
+        page = main.render_dashboard(values, 0, row)
+    assert 'week-over-week change' in page
+
+def test_page_version(monkeypatch, tmp_path):
+    import config_service
+    import main
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    row = area_registry.register_area('Analytics Page Test', 'ltla', nation='England')
+    settings = {'show_analytics': False}
+    get = config_service.get
+    monkeypatch.setattr(config_service, 'get', lambda key, default=None:
+                        settings[key] if key in settings else get(key, default))
+    version = main.page_version(1, row)
+    assert main.page_version(1, row) == version
+    main.invalidate_pages({'show_analytics'}, None) # config changes re-render
+    assert main.page_version(1, row) != version
+    settings['show_analytics'] = True
+    version = main.page_version(1, row)
+    rows = mock_upstream.covid_rows('Analytics Page Test', 'ltla', 10)
+    covid_store.append_rows('Analytics Page Test', 'ltla', rows[::-1])
+    assert main.page_version(1, row) != version # new analytics data re-renders
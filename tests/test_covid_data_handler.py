@@ -21,3 +21,25 @@ def test_covid_API_request():
 
 def test_schedule_covid_updates():
     schedule_covid_updates(update_interval=10, update_name='update test')
+
+def test_parse_csv_columns():
+    from covid_data_handler import parse_csv_columns
+    columns = parse_csv_columns('nation_2021-10-28.csv')
+    values, present = columns['hospitalCases']
+    assert len(values) == len(present) == 638
+    assert values.typecode == 'q'
+    assert columns['areaName'][0][0] == 'England'
+    assert columns['newCasesBySpecimenDate'][1][0] == 0 # first value missing
+
+def test_rolling_window_sums():
+    from covid_data_handler import parse_csv_columns, prefix_sums, rolling_window_sums
+    columns = parse_csv_columns(['date,cases,rate', 'd3,1,0.5', 'd2,,1', 'd1,3,2'])
+    assert list(rolling_window_sums(columns['cases'], 2)) == [1, 3]
+    assert list(columns['rate'][0]) == [0.5, 1.0, 2.0] # widened to floats
+    sums, counts = prefix_sums(columns['cases'])
+    assert list(sums) == [0, 1, 1, 4] and list(counts) == [0, 1, 1, 2]
+
+def test_process_covid_csv_stream():
+    from covid_data_handler import stream_csv_data, process_covid_csv_stream
+    batches = stream_csv_data('nation_2021-10-28.csv', batch_size=5)
+    assert process_covid_csv_stream(batches) == (240_299, 7_019, 141_544)
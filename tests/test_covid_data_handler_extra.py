@@ -18,4 +18,130 @@ def test_get_covid_stats():
     assert data[1] > 0
     assert data[3] > 0
     assert data[4] > 0
-    assert data[5] > 0
\ No newline at end of file
+    assert data[5] > 0
+
+def test_covid_API_requests_partial_failure(monkeypatch):
+    import covid_data_handler
+    from time import sleep
+    def fake_request(location=None, location_type=None):
+        if location == 'Broken':
+            raise ValueError('request failed')
+        if location == 'Slow':
+            sleep(1)
+        return {'data': [{'areaName': location}]}
+    monkeypatch.setattr(covid_data_handler, 'covid_API_request', fake_request)
+    data = covid_data_handler.covid_API_requests(
+        [('Exeter', 'ltla'), ('Broken', 'ltla'), ('Slow', 'ltla')], timeout=0.5)
+    assert data[('Exeter', 'ltla')]['data'][0]['areaName'] == 'Exeter'
+    assert data[('Broken', 'ltla')] is None
+    assert data[('Slow', 'ltla')] is None
+
+def test_covid_API_request_incremental(tmp_path, monkeypatch):
+    import api_cache
+    import covid_store
+    import covid_data_handler
+    from datetime import date, timedelta
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    days = [(date(2021, 10, 28)-timedelta(i)).isoformat() for i in range(60)]
+    upstream = [{'date': d, 'areaName': 'Exeter', 'areaType': 'ltla',
+                 'newCasesByPublishDate': i, 'cumDeaths28DaysByPublishDate': 100-i,
+                 'hospitalCases': None} for i, d in enumerate(days)]
+    requested = []
+    class FakeResponse:
+        headers = {'Last-Modified': 'Thu, 28 Oct 2021 15:00:00 GMT'}
+        def __init__(self, page):
+            self.rows = upstream[(page-1)*10:page*10]
+            self.status_code = 200 if self.rows else 204
+        def raise_for_status(self):
+            pass
+        def json(self):
+            return {'data': self.rows}
+    def fake_get(url, params=None, **kwargs):
+        requested.append(params['page'])
+        return FakeResponse(params['page'])
+    monkeypatch.setattr(covid_data_handler.covid_session, 'get', fake_get)
+    api_cache.clear_cache()
+    data = covid_data_handler.covid_API_request('Exeter', 'ltla')
+    assert data['length'] == 60 and len(requested) == 7
+    # two new days upstream, and a revision within the overlap window
+    upstream[1]['hospitalCases'] = 5
+    upstream[:0] = [dict(upstream[0], date='2021-10-30'), dict(upstream[0], date='2021-10-29')]
+    requested.clear()
+    api_cache.clear_cache()
+    data = covid_data_handler.covid_API_request('Exeter', 'ltla')
+    assert len(requested) == 1 # stops paginating once stored rows are reached
+    assert data['length'] == 62 and data['data'][0]['date'] == '2021-10-30'
+    assert data['data'][3]['hospitalCases'] == 5
+    # revision older than the overlap window leads to a full fetch
+    upstream[7]['newCasesByPublishDate'] = -1
+    requested.clear()
+    api_cache.clear_cache()
+    data = covid_data_handler.covid_API_request('Exeter', 'ltla')
+    assert len(requested) == 1+8 # incremental page, then full fetch
+    assert data['data'][7]['newCasesByPublishDate'] == -1
+    assert data['lastUpdate'] == '2021-10-28T15:00:00.000000Z'
+
+def test_get_stored_covid_stats(tmp_path, monkeypatch):
+    import covid_store
+    import covid_data_handler
+    import mock_upstream
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    assert covid_data_handler.get_stored_covid_stats() is None # nothing stored
+    local = ('Exeter', 'ltla')
+    monkeypatch.setattr(covid_data_handler.config_service, 'get',
+                        lambda key, default=None: dict(zip(('location', 'location_type'),
+                                                           local)).get(key, default))
+    for area in (local, ('England', 'nation')):
+        covid_store.append_rows(*area, mock_upstream.covid_rows(*area, 30)[::-1])
+    stats = covid_data_handler.get_stored_covid_stats()
+    rows = mock_upstream.covid_rows('England', 'nation', 30)
+    assert stats[0] == 'Exeter' and stats[2] == 'England'
+    assert stats[4] == rows[2]['hospitalCases'] # latest reported value
+    assert stats[5] == rows[3]['cumDeaths28DaysByPublishDate']
+
+def test_update_covid_data_keeps_known_stats(monkeypatch):
+    import area_registry
+    import covid_data_handler
+    import dashboard_state
+    import mock_upstream
+    rows = [area_registry.register_area('Kept Test', 'ltla', nation='Wales')]
+    monkeypatch.setattr(area_registry, 'load_areas', lambda config=None: rows)
+    failing = set()
+    def fake_requests(areas, **kwargs):
+        return {area: None if area in failing or 'all' in failing else
+                {'data': mock_upstream.covid_rows(*area, 30)} for area in areas}
+    monkeypatch.setattr(covid_data_handler, 'covid_API_requests', fake_requests)
+    covid_data_handler.update_covid_data()
+    known = dashboard_state.get_value('covid_data')
+    assert known[0] == 'Kept Test' and None not in known
+    failing.add(('Wales', 'nation')) # national stats keep their last values
+    covid_data_handler.update_covid_data()
+    assert dashboard_state.get_value('covid_data') == known
+    version = dashboard_state.get_snapshot()[0]
+    failing.add('all') # nothing fetched, nothing published
+    covid_data_handler.update_covid_data()
+    assert dashboard_state.get_snapshot()[0] == version
+
+def test_update_covid_data_fetches_unlocked(monkeypatch):
+    import threading
+    import area_registry
+    import covid_data_handler
+    import dashboard_state
+    import mock_upstream
+    rows = [area_registry.register_area('Unlocked Test', 'ltla', nation='Wales')]
+    monkeypatch.setattr(area_registry, 'load_areas', lambda config=None: rows)
+    held = []
+    def try_lock():
+        lock = dashboard_state.key_lock('covid_data')
+        held.append(not lock.acquire(blocking=False))
+        if not held[-1]:
+            lock.release()
+    def fake_requests(areas, **kwargs):
+        checker = threading.Thread(target=try_lock)
+        checker.start()
+        checker.join()
+        return {area: {'data': mock_upstream.covid_rows(*area, 30)} for area in areas}
+    monkeypatch.setattr(covid_data_handler, 'covid_API_requests', fake_requests)
+    covid_data_handler.update_covid_data()
+    assert held == [False] # lock only taken to publish
+    assert dashboard_state.get_value('covid_data')[0] == 'Unlocked Test'
@@ -0,0 +1,41 @@
+import covid_store
+
+def test_append_and_read_range(tmp_path, monkeypatch):
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    rows = [{'date': '2021-10-03', 'newCasesByPublishDate': 30, 'hospitalCases': None},
+            {'date': '2021-10-02', 'newCasesByPublishDate': 20, 'hospitalCases': 2},
+            {'date': '2021-10-01', 'newCasesByPublishDate': 10, 'hospitalCases': 1}]
+    assert covid_store.append_rows('Exeter', 'ltla', rows) == 3
+    assert covid_store.append_rows('Exeter', 'ltla', rows) == 0 # already stored
+    assert covid_store.last_date('Exeter', 'ltla') == '2021-10-03'
+    dates, values = covid_store.read_range('Exeter', 'ltla', 'newCasesByPublishDate',
+                                           '2021-10-02')
+    assert list(values) == [20, 30]
+    dates, values = covid_store.read_range('Exeter', 'ltla', 'hospitalCases')
+    assert list(values) == [1, 2, covid_store.MISSING]
+    covid_store.append_rows('Exeter', 'ltla',
+                            [{'date': '2021-10-04', 'newCasesByPublishDate': 40}])
+    dates, values = covid_store.read_range('Exeter', 'ltla', 'newCasesByPublishDate')
+    assert list(values) == [10, 20, 30, 40]
+    del dates, values
+    covid_store.clear_area('Exeter', 'ltla')
+    assert covid_store.last_date('Exeter', 'ltla') is None
+
+def test_replaced_files_unmapped(tmp_path, monkeypatch):
+    import pytest
+    import shutil
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path))
+    rows = [{'date': f'2021-10-0{d}', 'newCasesByPublishDate': d} for d in range(1, 6)]
+    covid_store.append_rows('Exeter', 'ltla', rows)
+    covid_store.read_range('Exeter', 'ltla', 'newCasesByPublishDate') # maps the files
+    mapped = [m for path, (_, m) in covid_store._maps.items()
+              if path.startswith(str(tmp_path))]
+    assert mapped
+    assert covid_store.truncate_from('Exeter', 'ltla', '2021-10-04') == 3
+    assert all(m.closed for m in mapped) # closed before the files were replaced
+    assert covid_store.last_date('Exeter', 'ltla') == '2021-10-03'
+    def fail(path):
+        raise PermissionError(path)
+    monkeypatch.setattr(shutil, 'rmtree', fail)
+    with pytest.raises(PermissionError): # not ignored, so later appends are not stale
+        covid_store.clear_area('Exeter', 'ltla')
@@ -0,0 +1,25 @@
+import dashboard_state
+
+def test_publish():
+    version, values = dashboard_state.get_snapshot()
+    assert dashboard_state.publish('updates', ({'title': 'test'},)) == version+1
+    new_version, new_values = dashboard_state.get_snapshot()
+    assert new_version == version+1
+    assert new_values['updates'] == ({'title': 'test'},)
+    assert values is not new_values # previous snapshot is left unchanged
+
+def test_concurrent_modify():
+    import threading
+    dashboard_state.publish('updates', ())
+    def add_updates(n):
+        for i in range(200):
+            with dashboard_state.key_lock('updates'):
+                updates = dashboard_state.get_value('updates')
+                dashboard_state.publish('updates', updates+((n, i),))
+    threads = [threading.Thread(target=add_updates, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(dashboard_state.get_value('updates')) == 800
+    dashboard_state.publish('updates', ())
@@ -0,0 +1,50 @@
+import gzip
+import json
+import dashboard_state
+import json_api
+
+def test_respond():
+    dashboard_state.publish('covid_news', tuple(
+        {'id': str(i), 'title': f'Article {i}', 'content': 'x'*100} for i in range(5)))
+    status, body, headers = json_api.respond('news')
+    headers = dict(headers)
+    assert status == 200 and 'Content-Encoding' not in headers
+    assert [a['title'] for a in json.loads(body)] == [f'Article {i}' for i in range(5)]
+    status, gzipped, gzip_headers = json_api.respond('news', accept_encoding='gzip, br;q=0')
+    assert dict(gzip_headers)['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped) == body and len(gzipped) < len(body)
+    assert dict(gzip_headers)['ETag'] != headers['ETag'] # one etag per encoding
+    assert json_api.respond('news', if_none_match=headers['ETag'])[:2] == (304, b'')
+    dashboard_state.publish('covid_news', ())
+    assert json_api.respond('news', if_none_match=headers['ETag'])[:2] == (200, b'[]')
+    assert json_api.respond('nothing')[0] == 404
+
+def test_etag_matches():
+    assert json_api.etag_matches('"a", W/"b"', '"b"') # weak validators match
+    assert json_api.etag_matches('W/"a"', '"a"')
+    assert json_api.etag_matches('*', '"a"')
+    assert not json_api.etag_matches('"ab"', '"a"')
+    assert not json_api.etag_matches(None, '"a"')
+
+def test_stale_responses_dropped():
+    json_api.respond('stats')
+    json_api.respond('news')
+    dashboard_state.publish('covid_news', ())
+    json_api.respond('news')
+    version = dashboard_state.get_snapshot()[0]
+    assert {v for v, _ in json_api._responses.values()} == {version}
+    assert ('stats', None) not in json_api._responses
+
+def test_cache_control():
+    assert json_api.cache_control('updates', {}) == 'no-cache'
+    assert json_api.cache_control('news', {}) == 'no-cache' # changed by dismissals
+    assert json_api.cache_control('stats', {'covid_data': ()}) == 'no-cache' # loading
+    max_age = int(json_api.cache_control('stats', {'covid_data': ('Exeter',)})[8:])
+    assert 0 <= max_age <= json_api.MAX_AGE
+
+def test_choose_encoding():
+    available = {'identity': None, 'gzip': None}
+    assert json_api.choose_encoding('gzip, deflate', available) == 'gzip'
+    assert json_api.choose_encoding('gzip;q=0', available) == 'identity'
+    assert json_api.choose_encoding('*', available) == 'gzip'
+    assert json_api.choose_encoding(None, available) == 'identity'
@@ -0,0 +1,22 @@
+import live_updates
+import dashboard_state
+
+def test_diff_values():
+    before = {'covid_data': (), 'covid_news': ({'id': 'a'}, {'id': 'b'}),
+              'updates': ({'title': 'x'},)}
+    after = dict(before, covid_news=({'id': 'b'}, {'id': 'c'}))
+    assert live_updates.diff_values(before, after) == \
+        {'covid_news': {'removed': ['a'], 'added': [[1, {'id': 'c'}]]}}
+    reordered = dict(before, covid_news=({'id': 'b'}, {'id': 'a'}))
+    assert live_updates.diff_values(before, reordered) == \
+        {'covid_news': {'items': [{'id': 'b'}, {'id': 'a'}]}}
+    assert live_updates.diff_values(before, before) == {}
+
+def test_event_stream():
+    version = dashboard_state.publish('updates', ({'title': 'first'},))
+    dashboard_state.publish('updates', ())
+    stream = live_updates.event_stream(str(version-1))
+    assert next(stream).startswith(b'retry:')
+    assert b'"title": "first"' in next(stream) # changes since the page was rendered
+    assert b'"removed": ["first"]' in next(stream)
+    assert live_updates.events_since(-1) is None # older than stored history
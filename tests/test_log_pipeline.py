@@ -0,0 +1,44 @@
+import os
+import logging
+import config_service
+import log_pipeline
+
+def test_rate_limited_logging():
+    log_pipeline.setup_logging()
+    log_pipeline.set_rate_limit('test_log_pipeline', 0.001, 5)
+    logger = logging.getLogger('test_log_pipeline')
+    for i in range(100):
+        logger.info('noisy message %d', i)
+    logger.warning('warnings are not limited')
+    assert log_pipeline.flush_logging(5)
+    with open(os.getcwd()+config_service.get('log_file_path')) as log_file:
+        lines = [line for line in log_file if 'test_log_pipeline' in line]
+    assert sum('noisy message' in line for line in lines) == 5
+    assert 'noisy message 4' in lines[4] and 'warnings are not limited' in lines[-1]
+
+def test_rotation(tmp_path):
+    filename = str(tmp_path/'test.log')
+    writer = log_pipeline._LogWriter(filename, 1000, 2)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'x'*100, None, None)
+    for _ in range(30):
+        writer.write([record]*3)
+    writer.close()
+    assert os.path.getsize(filename) <= 1000
+    assert os.path.exists(filename+'.1') and os.path.exists(filename+'.2')
+    assert not os.path.exists(filename+'.3')
+
+def test_rotation_counts_bytes(tmp_path):
+    filename = str(tmp_path/'test.log')
+    writer = log_pipeline._LogWriter(filename, 1000, 1)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'é'*100, None, None)
+    for _ in range(30):
+        writer.write([record]) # each line is over 200 bytes, but 100 characters
+    writer.close()
+    assert os.path.getsize(filename) <= 1000
+
+def test_prepare_copies_record():
+    handler = log_pipeline._QueueHandler(log_pipeline._queue)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'value %d', (5,), None)
+    prepared = handler.prepare(record)
+    assert prepared.msg == 'value 5' and prepared.args is None
+    assert record.msg == 'value %d' and record.args == (5,) # shared with other handlers
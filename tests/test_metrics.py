@@ -0,0 +1,47 @@
+import metrics
+
+def test_render_metrics():
+    metrics.reset_metrics()
+    metrics.describe('test_seconds', 'Test durations')
+    metrics.observe('test_seconds', 0.003, stage='a')
+    metrics.observe('test_seconds', 20, stage='a')
+    metrics.inc('test_total', kind='x"y')
+    text = metrics.render_metrics()
+    assert '# HELP test_seconds Test durations' in text
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{stage="a",le="0.0025"} 0' in text
+    assert 'test_seconds_bucket{stage="a",le="0.005"} 1' in text # cumulative
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 2' in text
+    assert 'test_seconds_count{stage="a"} 2' in text
+    assert 'test_total{kind="x\\"y"} 1' in text
+
+def test_timed():
+    metrics.reset_metrics()
+    @metrics.timed('test_call_seconds', call='f')
+    def f(fail):
+        if fail:
+            raise ValueError
+    f(False)
+    try:
+        f(True)
+    except ValueError:
+        pass
+    text = metrics.render_metrics()
+    assert 'test_call_seconds_count{call="f"} 2' in text
+    assert 'test_call_errors_total{call="f"} 1' in text
+
+def test_profiler():
+    import threading, time
+    done = threading.Event()
+    def busy_function():
+        while not done.is_set():
+            sum(range(1000))
+    thread = threading.Thread(target=busy_function)
+    thread.start()
+    metrics.start_profiler(0.001)
+    time.sleep(0.2)
+    metrics.stop_profiler()
+    done.set()
+    thread.join()
+    assert 'busy_function' in metrics.profile_report(clear=True)
+    assert metrics.profile_report() == ''
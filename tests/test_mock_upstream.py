@@ -0,0 +1,61 @@
+import pytest
+import api_cache
+import api_transport
+import config_service
+import covid_store
+import covid_data_handler
+import covid_news_handling
+import mock_upstream
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    server = mock_upstream.start_server(covid_rows=2500)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    config_service.override({'covid_api_url': url+mock_upstream.COVID_PATH,
+                             'news_api_url': url+mock_upstream.NEWS_PATH})
+    monkeypatch.setattr(covid_store, 'STORE_DIR', str(tmp_path/'store'))
+    api_cache.clear_cache()
+    yield server
+    api_cache.clear_cache()
+    mock_upstream.stop_server(server)
+    config_service.override(None)
+
+def test_mock_pagination(upstream):
+    data = covid_data_handler.covid_API_request('Exeter', 'ltla')
+    assert data['length'] == 2500 and data['totalPages'] == 3
+    assert data['data'][0]['date'] == '2021-10-28'
+    assert upstream.stats['requests'] == 4 # three pages, then no content
+    stats = covid_data_handler.get_covid_stats()
+    assert stats[0] == config_service.get('location') and stats[2] == 'England'
+    assert all(isinstance(stat, int) for stat in stats[3:])
+
+def test_mock_errors_retried(upstream, monkeypatch):
+    monkeypatch.setattr(covid_news_handling, 'NEWS_RETRIES', 2)
+    upstream.options.update(error_rate=1, error_statuses=[429], retry_after=0)
+    data = covid_news_handling.news_API_request('Covid', 10)
+    assert data['status'] == 'error' and upstream.stats['requests'] == 3
+    upstream.options['error_rate'] = 0
+    data = covid_news_handling.news_API_request('Covid', 10)
+    assert len(data['articles']) == 10
+
+def test_record_replay(upstream, tmp_path):
+    session = covid_news_handling.news_session
+    recordings = str(tmp_path/'recordings')
+    original = session.get_adapter('http://')
+    session.mount('http://', api_transport.RecordReplayAdapter('record', recordings))
+    try:
+        recorded = covid_news_handling.news_API_request('Covid', 20, 2)
+        mock_upstream.stop_server(upstream) # replayed without the network
+        session.mount('http://', api_transport.RecordReplayAdapter('replay', recordings))
+        api_cache.clear_cache()
+        assert covid_news_handling.news_API_request('Covid', 20, 2) == recorded
+        # recordings can also be served by the mock server
+        server = mock_upstream.start_server(recordings=recordings)
+        session.mount('http://', original)
+        config_service.override({'news_api_url':
+            f'http://127.0.0.1:{server.server_address[1]}{mock_upstream.NEWS_PATH}'})
+        api_cache.clear_cache()
+        assert covid_news_handling.news_API_request('Covid', 20, 2) == recorded
+        mock_upstream.stop_server(server)
+    finally:
+        session.mount('http://', original)
@@ -5,4 +5,116 @@ def test_news_API_request():
     assert isinstance(data, dict)
     assert data['status']=='ok'
     assert data['totalResults'] > 0
-    assert isinstance(data['articles'], list)
\ No newline at end of file
+    assert isinstance(data['articles'], list)
+
+def test_news_API_request_cached(monkeypatch):
+    import api_cache
+    import covid_news_handling
+    calls = []
+    class FakeResponse:
+        status_code = 200
+        headers = {}
+        def json(self):
+            return {'status': 'ok', 'totalResults': 20,
+                    'articles': [{'title': str(i)} for i in range(20)]}
+    def fake_get(url, **kwargs):
+        calls.append(url)
+        return FakeResponse()
+    api_cache.clear_cache()
+    monkeypatch.setattr(covid_news_handling.news_session, 'get', fake_get)
+    assert len(news_API_request('cache test', 11)['articles']) == 11
+    assert len(news_API_request('cache test', 12)['articles']) == 12
+    assert len(calls) == 1
+
+def test_news_get_retries(monkeypatch):
+    import covid_news_handling
+    delays = []
+    responses = []
+    class FakeResponse:
+        def __init__(self, status_code, headers):
+            self.status_code = status_code
+            self.headers = headers
+    def fake_get(url, params=None, **kwargs):
+        responses.append(params)
+        if len(responses) == 1:
+            return FakeResponse(429, {'Retry-After': '2'})
+        return FakeResponse(200, {})
+    monkeypatch.setattr(covid_news_handling.news_session, 'get', fake_get)
+    monkeypatch.setattr(covid_news_handling, 'sleep', delays.append)
+    response = covid_news_handling.news_get({'q': 'Covid OR COVID-19'})
+    assert response.status_code == 200
+    assert delays == [2.0]
+    assert len(responses) == 2
+
+def test_article_id():
+    from covid_news_handling import article_id
+    assert article_id('https://News.example.com/story/#top') == \
+        article_id('https://news.example.com/story')
+    assert article_id('https://news.example.com/a') != article_id('https://news.example.com/b')
+
+def test_update_news_skips_dismissed(monkeypatch):
+    import covid_news_handling
+    articles = [{'title': str(i), 'description': '', 'url': f'https://news.example.com/{i}',
+                 'source': {'name': 'source'}} for i in range(30)]
+    pages = []
+    def fake_request(covid_terms=None, page_size=20, page=1):
+        pages.append(page)
+        return {'status': 'ok', 'articles': articles[(page-1)*page_size:page*page_size]}
+    monkeypatch.setattr(covid_news_handling, 'news_API_request', fake_request)
+    monkeypatch.setattr(covid_news_handling, 'dismissed_articles', {})
+    monkeypatch.setattr(covid_news_handling, 'dismissed_path', None)
+    covid_news_handling.update_news('test', sch=False)
+    assert [a['title'] for a in covid_news_handling.covid_news] == [str(i) for i in range(10)]
+    for i in range(10):
+        covid_news_handling.remove_title(str(i)) # displayed, so matched by title
+    for i in range(10, 15):
+        covid_news_handling.remove_article(
+            covid_news_handling.article_id(f'https://news.example.com/{i}'))
+    covid_news_handling.update_news('test', sch=False)
+    assert [a['title'] for a in covid_news_handling.covid_news] == [str(i) for i in range(15, 25)]
+    assert pages == [1, 1, 2] # second page only requested once needed
+
+def test_dismissals_saved_in_batches(monkeypatch, tmp_path):
+    import json
+    import covid_news_handling
+    path = str(tmp_path/'dismissed.json')
+    monkeypatch.setattr(covid_news_handling, 'dismissed_path', path)
+    monkeypatch.setattr(covid_news_handling, 'dismissed_articles', {})
+    writes = []
+    save = covid_news_handling.save_dismissed_articles
+    monkeypatch.setattr(covid_news_handling, 'save_dismissed_articles',
+                        lambda: writes.append(save()))
+    for i in range(10):
+        covid_news_handling.remove_article(f'batch {i}')
+    assert writes == [] # not written by the request
+    covid_news_handling.flush_dismissed_articles()
+    assert len(writes) == 1
+    with open(path) as dismissed_file:
+        assert len(json.load(dismissed_file)) == 10
+    covid_news_handling.flush_dismissed_articles() # nothing pending
+    assert len(writes) == 1
+
+def test_update_news_keeps_news_on_error(monkeypatch):
+    import api_cache
+    import covid_news_handling
+    import dashboard_state
+    class FakeResponse:
+        status_code = 429
+        headers = {}
+        def json(self):
+            return {'status': 'error', 'code': 'rateLimited', 'message': 'too many requests'}
+    monkeypatch.setattr(covid_news_handling.news_session, 'get',
+                        lambda url, **kwargs: FakeResponse())
+    monkeypatch.setattr(covid_news_handling, 'sleep', lambda delay: None)
+    monkeypatch.setattr(covid_news_handling, 'dismissed_articles', {})
+    monkeypatch.setattr(covid_news_handling, 'dismissed_path', None)
+    news = [{'id': 'kept', 'title': 'kept', 'content': ''}]
+    monkeypatch.setattr(covid_news_handling, 'covid_news', news)
+    dashboard_state.publish('covid_news', tuple(news))
+    version = dashboard_state.get_snapshot()[0]
+    api_cache.clear_cache()
+    covid_news_handling.update_news('rate limited')
+    assert covid_news_handling.covid_news is news
+    assert covid_news_handling.dismissed_articles == {} # displayed news not purged
+    assert dashboard_state.get_snapshot()[0] == version
+    assert dashboard_state.get_snapshot()[1]['covid_news'] == tuple(news)
@@ -0,0 +1,105 @@
+from time import time
+import schedule_journal
+import update_scheduler
+
+def test_journal(tmp_path):
+    assert schedule_journal.configure(str(tmp_path/'journal.db'))
+    schedule_journal.save_job('journal test', 'news', 100.0, True)
+    schedule_journal.save_job('journal test', 'news', 200.0, True) # replaced
+    schedule_journal.save_job('journal test', 'covid_data', 50.0, False)
+    assert schedule_journal.load_jobs() == [(50.0, 'journal test', 'covid_data', False),
+                                            (200.0, 'journal test', 'news', True)]
+    schedule_journal.delete_jobs('journal test', 'covid_data')
+    assert len(schedule_journal.load_jobs()) == 1
+    schedule_journal.save_entry('journal test', '08:00 ~ News Updates')
+    assert schedule_journal.load_entries() == [{'title': 'journal test',
+                                                'content': '08:00 ~ News Updates'}]
+    schedule_journal.delete_entry('journal test')
+    schedule_journal.delete_jobs('journal test')
+    assert schedule_journal.load_jobs() == [] and schedule_journal.load_entries() == []
+    assert not schedule_journal.configure('') # disabled, so nothing is stored
+    schedule_journal.save_job('journal test', 'news', 100.0, False)
+    assert schedule_journal.load_jobs() == []
+
+def test_restore(tmp_path):
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    calls = []
+    update_scheduler.register_target('restore test', lambda: calls.append('done'))
+    schedule_journal.configure(str(tmp_path/'journal.db'))
+    now = time()
+    day = update_scheduler.REPEAT_INTERVAL
+    # missed while stopped - a one-off job, and a repeating job (three times)
+    schedule_journal.save_job('restore missed', 'restore test', now-60, False)
+    schedule_journal.save_job('restore repeating', 'restore test', now-3*day+60, True)
+    schedule_journal.save_job('restore later', 'restore test', now+3600, False)
+    try:
+        assert update_scheduler.restore() == 2
+        assert not update_scheduler.is_scheduled('restore missed')
+        jobs = {label: (t, repeating) for t, label, target, repeating
+                in update_scheduler.scheduled_jobs() if target == 'restore test'}
+        assert abs(jobs['restore repeating'][0]-(now+60)) < 1 # same time of day
+        assert jobs['restore repeating'][1]
+        update_scheduler.run_pending()
+        assert calls == ['done'] # caught up once, not once per missed run
+        assert sorted(label for _, label, _, _ in schedule_journal.load_jobs()) == \
+            ['restore later', 'restore repeating']
+    finally:
+        update_scheduler.cancel('restore repeating')
+        update_scheduler.cancel('restore later')
+        schedule_journal.configure('')
+
+def test_shared_journal(tmp_path, monkeypatch):
+    import shared_backend
+    monkeypatch.setattr(shared_backend, 'db_path', str(tmp_path/'shared.db'))
+    try:
+        assert schedule_journal.configure() # kept in the shared database
+        assert schedule_journal.db_path == shared_backend.db_path
+        schedule_journal.save_job('shared test', 'news', 100.0, True)
+        assert schedule_journal.load_jobs() == [(100.0, 'shared test', 'news', True)]
+    finally:
+        schedule_journal.configure('')
+
+def test_leader_takeover(tmp_path, monkeypatch):
+    import config_service
+    import dashboard_state
+    import main
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    get = config_service.get
+    monkeypatch.setattr(config_service, 'get', lambda key, default=None:
+                        str(tmp_path/'journal.db') if key == 'schedule_journal_path'
+                        else get(key, default))
+    update_scheduler.register_target('takeover test', lambda: None)
+    try:
+        schedule_journal.configure()
+        # left by the previous leader - a queued job, and an update which will not run
+        schedule_journal.save_job('takeover queued', 'takeover test', time()+3600, False)
+        schedule_journal.save_entry('takeover queued', '23:00 ~ News Updates')
+        schedule_journal.save_entry('takeover stale', '22:00 ~ News Updates')
+        dashboard_state.publish('updates', ({'title': 'takeover stale',
+                                             'content': '22:00 ~ News Updates'},))
+        main.restore_schedule()
+        assert update_scheduler.is_scheduled('takeover queued')
+        assert [u['title'] for u in dashboard_state.get_value('updates')] == \
+            ['takeover queued']
+    finally:
+        update_scheduler.cancel('takeover queued')
+        schedule_journal.configure('')
+
+def test_journalled_after_run(tmp_path):
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    journalled = []
+    schedule_journal.configure(str(tmp_path/'journal.db'))
+    update_scheduler.register_target('after run test', lambda: journalled.extend(
+        label for _, label, _, _ in schedule_journal.load_jobs()))
+    try:
+        update_scheduler.schedule('after run once', 'after run test', 0)
+        update_scheduler.schedule('after run repeating', 'after run test', 0, True)
+        update_scheduler.run_pending()
+        # still journalled while the update ran, so a crash would be caught up
+        assert sorted(journalled) == ['after run once', 'after run repeating']
+        jobs = schedule_journal.load_jobs()
+        assert [label for _, label, _, _ in jobs] == ['after run repeating']
+        assert jobs[0][0] > time()+update_scheduler.REPEAT_INTERVAL-60 # next run
+    finally:
+        update_scheduler.cancel('after run repeating')
+        schedule_journal.configure('')
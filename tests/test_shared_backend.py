@@ -0,0 +1,57 @@
+import shared_backend
+import dashboard_state
+
+def test_shared_values(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_backend, 'db_path', None)
+    monkeypatch.setattr(dashboard_state, '_snapshot', (0, dashboard_state._snapshot[1]))
+    assert shared_backend.configure(str(tmp_path/'state.db'))
+    version = shared_backend.write_value('covid_data', ('Exeter', 1))
+    assert shared_backend.read_version() == version
+    assert shared_backend.read_values() == (version, {'covid_data': ('Exeter', 1)})
+    # value written by another process is picked up by the snapshot
+    shared_backend.write_value('covid_data', ('Exeter', 2))
+    dashboard_state.sync(force=True)
+    assert dashboard_state.get_value('covid_data') == ('Exeter', 2)
+    with dashboard_state.key_lock('updates'):
+        dashboard_state.publish('updates', ({'title': 'test'},))
+    assert shared_backend.read_values()[1]['updates'] == ({'title': 'test'},)
+
+def test_commands_and_leader(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_backend, 'db_path', None)
+    shared_backend.configure(str(tmp_path/'state.db'))
+    applied = []
+    shared_backend.submit_command('cancel', {'label': 'test'})
+    other_process = shared_backend.file_lock('leader')
+    assert shared_backend.acquire_file_lock(other_process, blocking=False)
+    shared_backend.start(lambda: applied.append('leader'),
+                         lambda command, args: applied.append((command, args)))
+    import time
+    time.sleep(3*shared_backend.POLL_INTERVAL)
+    assert not shared_backend.is_leader() and applied == []
+    shared_backend.release_file_lock(other_process) # leader exits
+    time.sleep(3*shared_backend.POLL_INTERVAL)
+    assert shared_backend.is_leader()
+    assert applied == ['leader', ('cancel', {'label': 'test'})]
+    shared_backend.stop(timeout=2)
+    other_process.close()
+
+def test_interleaved_publish(tmp_path, monkeypatch):
+    import os
+    import subprocess
+    import sys
+    monkeypatch.setattr(shared_backend, 'db_path', None)
+    monkeypatch.setattr(dashboard_state, '_snapshot', (0, dashboard_state._snapshot[1]))
+    path = str(tmp_path/'state.db')
+    assert shared_backend.configure(path)
+    dashboard_state.publish('covid_data', ('Exeter', 1))
+    # another worker writes a different value, unseen by this process
+    subprocess.run([sys.executable, '-c', 'import shared_backend; '
+                    f'shared_backend.configure({path!r}); '
+                    "shared_backend.write_value('covid_news', ({'title': 'other'},))"],
+                   check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    version = dashboard_state.publish('updates', ({'title': 'test'},))
+    assert version == shared_backend.read_version() == 3
+    values = dashboard_state.get_snapshot()[1]
+    assert values['covid_news'] == ({'title': 'other'},)
+    assert values['updates'] == ({'title': 'test'},)
+    assert values['covid_data'] == ('Exeter', 1)
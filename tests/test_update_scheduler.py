@@ -0,0 +1,52 @@
+from time import sleep
+import update_scheduler
+
+def test_run_pending():
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    calls = []
+    update_scheduler.register_target('run pending test', lambda: calls.append('done'))
+    assert update_scheduler.schedule('run pending test', 'run pending test', 0)
+    assert update_scheduler.is_scheduled('run pending test')
+    update_scheduler.run_pending()
+    assert calls == ['done']
+    assert not update_scheduler.is_scheduled('run pending test')
+
+def test_coalesced_jobs():
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    calls = []
+    completed = []
+    update_scheduler.register_target('coalesce test', lambda: calls.append('done'))
+    update_scheduler.on_complete(completed.append)
+    for i in range(10): # e.g. ten users scheduling the same update
+        update_scheduler.schedule(f'coalesce test {i}', 'coalesce test', 0)
+    update_scheduler.schedule('coalesce test later', 'coalesce test', 1)
+    update_scheduler.run_pending()
+    assert calls == ['done'] # a single update, feeding every label
+    assert sorted(completed) == sorted(f'coalesce test {i}' for i in range(10)) \
+        + ['coalesce test later']
+    update_scheduler.completion_callbacks.remove(completed.append)
+
+def test_cancel_and_repeat():
+    update_scheduler.stop(timeout=1) # jobs are run by the test alone
+    calls = []
+    update_scheduler.register_target('cancel test', lambda: calls.append('done'))
+    update_scheduler.schedule('cancelled', 'cancel test', 0)
+    update_scheduler.schedule('repeating', 'cancel test', 0, repeating=True)
+    assert update_scheduler.cancel('cancelled')
+    assert not update_scheduler.cancel('cancelled')
+    update_scheduler.run_pending()
+    assert calls == ['done']
+    assert update_scheduler.is_scheduled('repeating') # next day's update
+    assert any(label == 'repeating' for _, label, _, _ in update_scheduler.scheduled_jobs())
+    assert update_scheduler.cancel('repeating')
+    assert not update_scheduler.is_scheduled('repeating')
+
+def test_engine_thread():
+    calls = []
+    update_scheduler.register_target('engine test', lambda: calls.append('done'))
+    update_scheduler.start()
+    update_scheduler.schedule('engine test', 'engine test', 0.1)
+    sleep(0.5)
+    update_scheduler.stop(timeout=1)
+    assert calls == ['done']
+    assert not update_scheduler.is_scheduled('engine test')
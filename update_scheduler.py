@@ -0,0 +1,359 @@
+'''This module handles: running scheduled updates on a background thread, so
+updates fire on time whether or not any client requests arrive.
+
+All updates are held in a single heap of jobs, ordered by fire time, and
+indexed by label, so scheduling and cancelling a job are O(log n). Each job
+has a target (e.g. covid_data or news) - the update function registered under
+that name. Jobs for the same target which are due within COALESCE_WINDOW of
+each other are run as a single update, so many labels scheduled for the same
+time lead to one api request.
+
+If the schedule is journalled (see schedule_journal), every change to the
+queue is also written to disk, and restore rebuilds the queue after a restart.
+
+Below is a summary of the functions defined within this module
+
+update_scheduler
+    .register_target()
+        > sets the update function run by jobs for a target
+    .schedule()
+        > schedules a labelled update of a target
+    .cancel()
+        > cancels the updates scheduled under a label
+    .restore()
+        > rebuilds the queue from the schedule journal, catching up missed updates
+    .wake()
+        > interrupts the engine so newly scheduled jobs are picked up
+    .run_pending()
+        > runs all due jobs, returning the delay until the next job
+    .is_scheduled()
+        > checks if a label still has jobs queued
+    .scheduled_jobs()
+        > returns the queued jobs, in the order they will run
+    .on_complete()
+        > adds a function to be called when a label has no jobs left
+    .start()
+        > starts the engine on a background (daemon) thread
+    .stop()
+        > stops the engine thread
+'''
+
+import logging
+import threading
+from heapq import heappush, heappop, heapify
+from itertools import count
+from time import time
+import metrics
+import schedule_journal
+
+logger_us = logging.getLogger(__name__)
+
+MAX_IDLE = 60 # longest wait (seconds) between engine passes
+COALESCE_WINDOW = 5 # jobs for a target due within this time (seconds) share an update
+REPEAT_INTERVAL = 24*60*60 # time (seconds) between repeating updates
+CATCH_UP_LABEL = '(catch-up)' # label of updates run for jobs missed while stopped
+
+# job entries are lists, [time, seq, label, target, repeating, cancelled], so a
+# cancelled job can be marked in place and skipped when it reaches the top of the heap
+TIME, SEQ, LABEL, TARGET, REPEATING, CANCELLED = range(6)
+
+targets = {} # target name -> update function
+_heap = []
+_jobs = {} # label -> {target -> job entry}
+_cancelled_count = 0 # cancelled entries still in the heap
+_seq = count() # ties are run in the order they were scheduled
+_completed = [] # labels cancelled since the last engine pass
+# held while adding, cancelling or running jobs
+scheduler_lock = threading.RLock()
+completion_callbacks = []
+_wake_event = threading.Event()
+_stop_event = threading.Event()
+_engine_thread = None
+
+metrics.describe('dashboard_scheduler_pass_seconds', 'Duration of scheduler engine passes '
+                 '(including the updates run)')
+metrics.describe('dashboard_scheduler_coalesced_total', 'Scheduled jobs run as part of '
+                 'another job\'s update')
+metrics.describe('dashboard_scheduler_missed_total', 'Journalled jobs missed while the '
+                 'dashboard was stopped')
+
+def register_target(name: str, update) -> type(None):
+    '''Sets the update function run by jobs for a target.
+
+    Args:
+        name: target name, e.g. covid_data
+        update: function taking no arguments
+    '''
+    targets[name] = update
+
+def _push(label: str, target: str, fire_time: float, repeating: bool) -> type(None):
+    '''Adds a job to the heap and the label index (scheduler_lock must be held).'''
+    job = [fire_time, next(_seq), label, target, repeating, False]
+    heappush(_heap, job)
+    _jobs.setdefault(label, {})[target] = job
+
+def _discard(job: list) -> type(None):
+    '''Marks a job as cancelled (scheduler_lock must be held).'''
+    global _cancelled_count
+    job[CANCELLED] = True
+    _cancelled_count += 1
+    if _cancelled_count > 64 and _cancelled_count > len(_heap)//2:
+        # rebuilt, so cancelled jobs far from the top do not accumulate
+        _heap[:] = [j for j in _heap if not j[CANCELLED]]
+        heapify(_heap)
+        _cancelled_count = 0
+
+def schedule(label: str, target: str, delay: float, repeating: bool=False) -> bool:
+    '''Schedules a labelled update of a target, replacing any update of the
+    same target already scheduled under the label.
+
+    Args:
+        label: label of update in interface
+        target: name of registered target, e.g. news
+        delay: time (seconds) until the (initial) update
+        repeating: flag for repeating updates (every REPEAT_INTERVAL)
+
+    Returns:
+        True if the update was scheduled
+    '''
+    if not isinstance(label, str) or target not in targets:
+        return False
+    with scheduler_lock:
+        previous = _jobs.get(label, {}).get(target)
+        if previous is not None:
+            _discard(previous)
+        fire_time = time()+max(delay, 0)
+        _push(label, target, fire_time, repeating)
+        schedule_journal.save_job(label, target, fire_time, repeating)
+    logger_us.info('update scheduled [label=%s, target=%s, delay=%.0f, repeating=%s]',
+                   label, target, delay, repeating)
+    wake() # engine recalculates the time of the next job
+    return True
+
+def cancel(label: str) -> bool:
+    '''Cancels all updates scheduled under a label.
+
+    Args:
+        label: label of update in interface
+
+    Returns:
+        True if any updates were cancelled
+    '''
+    with scheduler_lock:
+        jobs = _jobs.pop(label, None)
+        if not jobs:
+            return False
+        for job in jobs.values():
+            _discard(job)
+        _completed.append(label)
+        schedule_journal.delete_jobs(label)
+    logger_us.info('scheduled updates cancelled [label=%s]', label)
+    wake() # completion callbacks are called by the engine
+    return True
+
+def restore() -> int:
+    '''Rebuilds the queue from the schedule journal, e.g. after a restart.
+
+    Jobs missed while the dashboard was stopped are caught up with a single
+    update of each target (under CATCH_UP_LABEL), however many runs were
+    missed. Missed one-off jobs are then complete, and repeating jobs move to
+    their next run, keeping their time of day.
+
+    Returns:
+        Number of jobs restored to the queue
+    '''
+    now = time()
+    restored = 0
+    missed = {}
+    with scheduler_lock:
+        for fire_time, label, target, repeating in schedule_journal.load_jobs():
+            if target not in targets:
+                logger_us.warning('journalled job has unknown target [label=%s, target=%s]',
+                                  label, target)
+                schedule_journal.delete_jobs(label, target)
+                continue
+            if target in _jobs.get(label, {}):
+                continue # already queued
+            if fire_time <= now:
+                missed[target] = missed.get(target, 0)+1
+                if not repeating:
+                    schedule_journal.delete_jobs(label, target)
+                    _completed.append(label) # leaves the interface, unless still queued
+                    continue
+                fire_time += ((now-fire_time)//REPEAT_INTERVAL+1)*REPEAT_INTERVAL
+                schedule_journal.save_job(label, target, fire_time, True)
+            _push(label, target, fire_time, repeating)
+            restored += 1
+        for target, count_missed in missed.items():
+            previous = _jobs.get(CATCH_UP_LABEL, {}).get(target)
+            if previous is not None:
+                _discard(previous)
+            _push(CATCH_UP_LABEL, target, now, False) # not journalled, runs immediately
+            metrics.inc('dashboard_scheduler_missed_total', count_missed, target=target)
+    logger_us.info('schedule restored [jobs=%d, missed=%s]', restored, missed)
+    wake()
+    return restored
+
+def wake() -> type(None):
+    '''Wakes the engine thread, so it recalculates the time of the next job.'''
+    _wake_event.set()
+
+def _discard_top() -> type(None):
+    '''Removes a cancelled job from the top of the heap (scheduler_lock must be held).'''
+    global _cancelled_count
+    heappop(_heap)
+    _cancelled_count -= 1
+
+def _pop_due(now: float) -> dict:
+    '''Removes the jobs due by now, along with any jobs for the same targets
+    due within COALESCE_WINDOW (scheduler_lock must be held).
+
+    Returns:
+        Dictionary of target -> due jobs
+    '''
+    due = {}
+    deferred = []
+    while _heap:
+        job = _heap[0]
+        if job[CANCELLED]:
+            _discard_top()
+        elif job[TIME] <= now:
+            due.setdefault(job[TARGET], []).append(heappop(_heap))
+        elif job[TIME] <= now+COALESCE_WINDOW:
+            job = heappop(_heap)
+            if job[TARGET] in due:
+                due[job[TARGET]].append(job)
+            else: # not yet due, and no update of its target is running
+                deferred.append(job)
+        else:
+            break
+    for job in deferred:
+        heappush(_heap, job)
+    return due
+
+@metrics.timed('dashboard_scheduler_pass_seconds')
+def run_pending() -> float:
+    '''Runs all due jobs - one update for each target - and reschedules
+    repeating jobs.
+
+    Returns:
+        Delay (seconds) until the next queued job, or None if nothing is queued
+    '''
+    completed = []
+    with scheduler_lock:
+        now = time()
+        due = _pop_due(now)
+        for jobs in due.values():
+            for job in jobs:
+                label, target = job[LABEL], job[TARGET]
+                if job[REPEATING]:
+                    _push(label, target, job[TIME]+REPEAT_INTERVAL, True)
+                    continue
+                label_jobs = _jobs.get(label, {})
+                if label_jobs.get(target) is job:
+                    del label_jobs[target]
+                    if not label_jobs:
+                        del _jobs[label]
+                        completed.append(label)
+        completed.extend(_completed)
+        _completed.clear()
+    for target, jobs in due.items():
+        labels = [job[LABEL] for job in jobs]
+        if len(jobs) > 1:
+            metrics.inc('dashboard_scheduler_coalesced_total', len(jobs)-1, target=target)
+        try:
+            targets[target]()
+            logger_us.info('scheduled update run [target=%s, labels=%s]',
+                           target, ', '.join(labels))
+        except Exception:
+            logger_us.exception('scheduled update failed [target=%s, labels=%s]',
+                                target, ', '.join(labels))
+        # journalled only once the update has run, so one interrupted by a
+        # crash is caught up by restore
+        for label in labels:
+            _journal_job(label, target)
+    for label in completed:
+        if not is_scheduled(label): # e.g. rescheduled while the update ran
+            for callback in completion_callbacks:
+                callback(label)
+    with scheduler_lock:
+        while _heap and _heap[0][CANCELLED]:
+            _discard_top()
+        if not _heap:
+            return None
+        return max(_heap[0][TIME]-time(), 0)
+
+def _journal_job(label: str, target: str) -> type(None):
+    '''Writes the queued job of a label and target to the schedule journal -
+    its next run, or its removal if none is queued.'''
+    with scheduler_lock:
+        job = _jobs.get(label, {}).get(target)
+        if job is None:
+            schedule_journal.delete_jobs(label, target)
+        else:
+            schedule_journal.save_job(label, target, job[TIME], job[REPEATING])
+
+def is_scheduled(label: str) -> bool:
+    '''Checks if any jobs are queued under the label.
+
+    Args:
+        label: label of update in interface
+
+    Returns:
+        True if the update is still pending
+    '''
+    return label in _jobs
+
+def scheduled_jobs() -> list:
+    '''Returns the queued jobs, in the order they will run.
+
+    Returns:
+        List of (time, label, target, repeating) tuples
+    '''
+    with scheduler_lock:
+        jobs = sorted(j for j in _heap if not j[CANCELLED])
+    return [(j[TIME], j[LABEL], j[TARGET], j[REPEATING]) for j in jobs]
+
+def on_complete(callback) -> type(None):
+    '''Adds a function to be called (with the label) when a label's last job
+    is removed, i.e. its updates are complete or cancelled.
+
+    Args:
+        callback: function taking the label as its only argument
+    '''
+    if callback not in completion_callbacks:
+        completion_callbacks.append(callback)
+
+def _engine() -> type(None):
+    '''Main loop of the engine thread.'''
+    logger_us.info('scheduler engine started')
+    while not _stop_event.is_set():
+        delay = run_pending()
+        if delay is None or delay > MAX_IDLE:
+            delay = MAX_IDLE
+        _wake_event.wait(delay)
+        _wake_event.clear()
+    logger_us.info('scheduler engine stopped')
+
+def start() -> type(None):
+    '''Starts the engine thread (if not already running).'''
+    global _engine_thread
+    if _engine_thread is not None and _engine_thread.is_alive():
+        return
+    _stop_event.clear()
+    _engine_thread = threading.Thread(target=_engine, name='update-scheduler',
+                                      daemon=True)
+    _engine_thread.start()
+
+def stop(timeout: float=None) -> type(None):
+    '''Stops the engine thread.
+
+    Args:
+        timeout: maximum time (seconds) to wait for the thread to finish
+    '''
+    global _engine_thread
+    _stop_event.set()
+    wake()
+    if _engine_thread is not None:
+        _engine_thread.join(timeout)
+        _engine_thread = None